@@ -10,33 +10,199 @@ Algorithms / techniques used:
   - Multi-layer Perceptron (MLPClassifier) neural network (scikit-learn)
 - Preprocessing: StandardScaler, LabelEncoder
 - Imbalance handling: SMOTE (oversampling)
-- Evaluation: cross_val_score (f1_macro), train/test split
+- Evaluation: 5-fold CV (f1_macro), train/test split; models × folds trained in parallel (joblib)
 - Models saved/loaded via joblib
+- Training / plotting dependencies are imported lazily; prediction needs only numpy
 """
 
-import pandas as pd
+# Inference path (run_ai.py, ai_server.py) chỉ cần numpy + estimator đã unpickle.
+# pandas / scikit-learn training / imblearn / matplotlib được import lazy trong các
+# method training để giảm cold start của mỗi process chẩn đoán.
+import os
+import time
+import threading
+from collections import OrderedDict
+
 import numpy as np
-from sklearn.model_selection import train_test_split, cross_val_score
-from sklearn.preprocessing import StandardScaler, LabelEncoder
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.svm import SVC
-from sklearn.neural_network import MLPClassifier
-from sklearn.metrics import classification_report, confusion_matrix
-import joblib
-import matplotlib.pyplot as plt
-import seaborn as sns
-from imblearn.over_sampling import SMOTE
 import warnings
 warnings.filterwarnings('ignore')
 
+import timing
+
+# 13 feature gốc (UCI) theo đúng thứ tự training, kèm giá trị mặc định như predict_heart_rate_risk
+RAW_FEATURES = ['age', 'sex', 'cp', 'trestbps', 'chol', 'fbs', 'restecg',
+                'thalach', 'exang', 'oldpeak', 'slope', 'ca', 'thal']
+RAW_FEATURE_DEFAULTS = {
+    'age': 50, 'sex': 1, 'cp': 0, 'trestbps': 120, 'chol': 200, 'fbs': 0, 'restecg': 0,
+    'thalach': 80, 'exang': 0, 'oldpeak': 0, 'slope': 1, 'ca': 0, 'thal': 2
+}
+
+# Cận phải của các bin trong feature_engineering (pd.cut, right=True)
+AGE_GROUP_EDGES = [40, 50, 60, 70]
+BP_CATEGORY_EDGES = [120, 140, 160]
+CHOL_CATEGORY_EDGES = [200, 240, 300]
+
+# Hyperparameter mặc định của các candidate trong train_models.
+# hyperparam_search.py tìm giá trị tốt hơn và ghi ra file cho --params.
+DEFAULT_MODEL_PARAMS = {
+    # RandomForest (ensemble tree-based)
+    'RandomForest': {
+        'n_estimators': 200,
+        'max_depth': 10,
+        'min_samples_split': 5,
+        'min_samples_leaf': 2,
+        'random_state': 42,
+        'class_weight': 'balanced',
+    },
+    # SVM: scikit-learn SVC (used as a classifier with probability=True)
+    'SVM': {
+        'kernel': 'rbf',
+        'C': 1.0,
+        'gamma': 'scale',
+        'probability': True,
+        'random_state': 42,
+        'class_weight': 'balanced',
+    },
+    # NeuralNetwork: scikit-learn MLPClassifier (feed-forward neural network)
+    'NeuralNetwork': {
+        'hidden_layer_sizes': (64, 32, 16),
+        'activation': 'relu',
+        'solver': 'adam',
+        'alpha': 0.001,
+        'learning_rate': 'adaptive',
+        'max_iter': 1000,
+        'random_state': 42,
+    },
+}
+
+RISK_LEVELS = np.array(['very_low', 'low', 'medium', 'high', 'critical'])
+
+
+def artifact_version(filepath):
+    """Identify an artifact on disk; changes whenever the file is rewritten"""
+    stat = os.stat(filepath)
+    return (os.path.abspath(filepath), stat.st_mtime_ns, stat.st_size)
+
+
+def build_model(name, params=None):
+    """Tạo estimator chưa fit cho một candidate, params ghi đè DEFAULT_MODEL_PARAMS[name]"""
+    if name not in DEFAULT_MODEL_PARAMS:
+        raise ValueError(f"Unknown model: {name}")
+    merged = {**DEFAULT_MODEL_PARAMS[name], **(params or {})}
+
+    if name == 'RandomForest':
+        from sklearn.ensemble import RandomForestClassifier
+        return RandomForestClassifier(**merged)
+    if name == 'SVM':
+        from sklearn.svm import SVC
+        return SVC(**merged)
+    from sklearn.neural_network import MLPClassifier
+    # JSON không có tuple: [64, 32] -> (64, 32)
+    merged['hidden_layer_sizes'] = tuple(np.atleast_1d(merged['hidden_layer_sizes']).tolist())
+    return MLPClassifier(**merged)
+
+
+def _run_training_task(name, model, X, y, train_idx=None, valid_idx=None):
+    """Một task của train_models: fit trên một CV fold (trả về f1_macro) hoặc refit toàn bộ.
+
+    Đặt ở module level để joblib (loky) pickle được sang worker process.
+    """
+    from sklearn.metrics import f1_score
+
+    # Worker process không kế thừa filterwarnings của process cha
+    warnings.filterwarnings('ignore')
+    start = time.time()
+    if train_idx is None:
+        model.fit(X, y)
+        result = {'name': name, 'score': None, 'model': model}
+    else:
+        model.fit(X[train_idx], y[train_idx])
+        score = f1_score(y[valid_idx], model.predict(X[valid_idx]), average='macro')
+        result = {'name': name, 'score': score, 'model': None}
+    result['start'] = start
+    result['end'] = time.time()
+    return result
+
+
+class PredictionCache:
+    """Thread-safe LRU cache with optional TTL for prediction / insight results"""
+
+    def __init__(self, maxsize=4096, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+        # Copy để caller sửa kết quả không làm hỏng entry trong cache
+        return {k: (list(v) if isinstance(v, list) else v) for k, v in value.items()}
+
+    def put(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations
+            }
+
+
 class HeartDiagnosisAI:
     def __init__(self):
         self.models = {}
-        self.scaler = StandardScaler()
+        self.scaler = None  # StandardScaler, tạo khi train hoặc gán từ artifacts
         self.best_model = None
+        self.feature_names = None
+        self.model_version = None
+        self.prediction_cache = None
+
+    def enable_prediction_cache(self, maxsize=4096, ttl=None):
+        """Cache predict_heart_rate_risk / generate_insights keyed on the 17-feature vector"""
+        self.prediction_cache = PredictionCache(maxsize=maxsize, ttl=ttl)
+        return self.prediction_cache
 
     def load_and_preprocess_data(self, filepath='heart.csv'):
         """Load and preprocess data"""
+        import pandas as pd
+
         print("🔄 Loading data...")
 
         # Đọc dữ liệu (UCI Heart Disease dataset)
@@ -57,6 +223,9 @@ class HeartDiagnosisAI:
 
     def feature_engineering(self, df):
         """Create new features from existing data"""
+        import pandas as pd
+        from sklearn.preprocessing import LabelEncoder
+
         print("🔧 Creating features...")
 
         # Tạo features mới
@@ -89,9 +258,11 @@ class HeartDiagnosisAI:
 
         return df
 
-    def train_models(self, X, y):
-        """Train multiple models and select the best"""
-        print("🤖 Training models...")
+    def prepare_training_data(self, X, y):
+        """SMOTE + train/test split + StandardScaler (fit trên train); set self.scaler"""
+        from imblearn.over_sampling import SMOTE
+        from sklearn.model_selection import train_test_split
+        from sklearn.preprocessing import StandardScaler
 
         # Handle class imbalance
         smote = SMOTE(random_state=42)
@@ -103,60 +274,70 @@ class HeartDiagnosisAI:
         )
 
         # Scale features
+        self.scaler = StandardScaler()
         X_train_scaled = self.scaler.fit_transform(X_train)
         X_test_scaled = self.scaler.transform(X_test)
+        return X_train_scaled, X_test_scaled, np.asarray(y_train), np.asarray(y_test)
 
-        # Define models
-        models = {
-            # RandomForest (ensemble tree-based)
-            'RandomForest': RandomForestClassifier(
-                n_estimators=200,
-                max_depth=10,
-                min_samples_split=5,
-                min_samples_leaf=2,
-                random_state=42,
-                class_weight='balanced'
-            ),
-            # SVM: scikit-learn SVC (used as a classifier with probability=True)
-            'SVM': SVC(
-                kernel='rbf',
-                C=1.0,
-                gamma='scale',
-                probability=True,
-                random_state=42,
-                class_weight='balanced'
-            ),
-            # NeuralNetwork: scikit-learn MLPClassifier (feed-forward neural network)
-            'NeuralNetwork': MLPClassifier(
-                hidden_layer_sizes=(64, 32, 16),
-                activation='relu',
-                solver='adam',
-                alpha=0.001,
-                learning_rate='adaptive',
-                max_iter=1000,
-                random_state=42
-            )
-        }
+    def train_models(self, X, y, n_jobs=1, model_params=None, models=None):
+        """Train multiple models and select the best
 
-        best_score = 0
-        best_model_name = None
+        n_jobs: số process cho joblib; mọi (model, CV fold) và bước refit của các model
+        được chạy song song như các task độc lập (-1 = tất cả core, 1 = tuần tự).
+        model_params: {model_name: {param: value}} ghi đè DEFAULT_MODEL_PARAMS.
+        models: chỉ train các model này (mặc định: tất cả).
+        """
+        from joblib import Parallel, delayed
+        from sklearn.base import clone
+        from sklearn.model_selection import StratifiedKFold
+        from sklearn.metrics import classification_report
+
+        print("🤖 Training models...")
+
+        X_train_scaled, X_test_scaled, y_train, y_test = self.prepare_training_data(X, y)
+
+        # Define models (hyperparameter mặc định hoặc từ hyperparam_search.py)
+        model_params = model_params or {}
+        names = list(models) if models else list(DEFAULT_MODEL_PARAMS)
+        models = {name: build_model(name, model_params.get(name)) for name in names}
 
-        # Train và evaluate từng model
+        # Cùng fold như cross_val_score(cv=5) với classifier; mỗi fold và mỗi refit là một task
+        folds = list(StratifiedKFold(n_splits=5).split(X_train_scaled, y_train))
+        tasks = []
         for name, model in models.items():
-            print(f"\n🏃 Training {name}...")
+            for train_idx, valid_idx in folds:
+                tasks.append((name, clone(model), train_idx, valid_idx))
+            tasks.append((name, clone(model), None, None))
+
+        print(f"⚙️  {len(tasks)} training tasks on n_jobs={n_jobs}")
+        started = time.perf_counter()
+        results = Parallel(n_jobs=n_jobs)(
+            delayed(_run_training_task)(name, model, X_train_scaled, y_train, train_idx, valid_idx)
+            for name, model, train_idx, valid_idx in tasks
+        )
+        total_wall = time.perf_counter() - started
+
+        best_score = 0
+        best_model_name = None
 
-            # Cross validation
-            cv_scores = cross_val_score(model, X_train_scaled, y_train, cv=5, scoring='f1_macro')
-            print(".3f")
+        # Evaluate từng model theo thứ tự định nghĩa
+        for name in models:
+            model_results = [r for r in results if r['name'] == name]
+            cv_scores = np.array([r['score'] for r in model_results if r['model'] is None])
+            model = next(r['model'] for r in model_results if r['model'] is not None)
+            # Wall time = từ task đầu tiên bắt đầu tới task cuối cùng xong của model này
+            wall = max(r['end'] for r in model_results) - min(r['start'] for r in model_results)
+            busy = sum(r['end'] - r['start'] for r in model_results)
 
-            # Train on full training data
-            model.fit(X_train_scaled, y_train)
+            print(f"\n🏃 {name}")
+            print(f"📊 CV f1_macro: {cv_scores.mean():.3f} (+/- {cv_scores.std() * 2:.3f})")
+            print(f"⏱️  Wall time: {wall:.2f}s (task time: {busy:.2f}s)")
 
             # Test performance
             y_pred = model.predict(X_test_scaled)
             test_score = model.score(X_test_scaled, y_test)
 
-            print(".3f")
+            print(f"🎯 Test accuracy: {test_score:.3f}")
             print(f"📋 Classification Report:\n{classification_report(y_test, y_pred)}")
 
             self.models[name] = model
@@ -166,12 +347,15 @@ class HeartDiagnosisAI:
                 best_model_name = name
                 self.best_model = model
 
-        print(f"\n🏆 Best model: {best_model_name} with accuracy: {best_score:.3f}")
+        print(f"\n⏱️  Total training wall time: {total_wall:.2f}s")
+        print(f"🏆 Best model: {best_model_name} with accuracy: {best_score:.3f}")
         return best_model_name
 
     def analyze_feature_importance(self, X, feature_names):
         """Analyze feature importance"""
         if hasattr(self.best_model, 'feature_importances_'):
+            import matplotlib.pyplot as plt
+
             importances = self.best_model.feature_importances_
             indices = np.argsort(importances)[::-1]
 
@@ -190,8 +374,98 @@ class HeartDiagnosisAI:
             plt.savefig('feature_importance.png', dpi=300, bbox_inches='tight')
             plt.close()
 
+    def save_model(self, filepath='heart_diagnosis_model.pkl', feature_names=None):
+        """Save best model + scaler + feature names as an uncompressed joblib bundle.
+
+        compress=0 keeps numpy buffers raw on disk so load_model can memory-map them.
+        """
+        import joblib
+
+        if feature_names is not None:
+            self.feature_names = list(feature_names)
+        artifacts = {
+            'model': self.best_model,
+            'scaler': self.scaler,
+            'feature_names': self.feature_names
+        }
+        # Ghi ra file tạm rồi rename: process đang memory-map file cũ (ai_server, run_ai --stream)
+        # giữ nguyên trang của inode cũ thay vì bị truncate dưới chân (SIGBUS)
+        joblib.dump(artifacts, filepath + '.tmp', compress=0)
+        os.replace(filepath + '.tmp', filepath)
+        print(f"💾 Model saved to {filepath}")
+
+    def load_model(self, filepath='heart_diagnosis_model.pkl', mmap_mode='c'):
+        """Load artifacts saved by save_model (or exported .npz from numpy_model.py).
+
+        With mmap_mode numpy buffers are mapped from the file, so several worker
+        processes share the same pages through the OS page cache. The default 'c'
+        (copy-on-write) is used instead of 'r' because libsvm's predict_proba
+        rejects read-only buffers; pages stay shared as long as nobody writes. Note that
+        scikit-learn copies RandomForest tree nodes on unpickle; export the forest with
+        numpy_model.py to share those as well.
+        """
+        if filepath.endswith('.npz'):
+            from numpy_model import load_numpy_model
+            artifacts = load_numpy_model(filepath, mmap=mmap_mode is not None)
+        else:
+            import joblib
+            artifacts = joblib.load(filepath, mmap_mode=mmap_mode)
+
+        if not isinstance(artifacts, dict):
+            artifacts = {'model': artifacts}
+        self.model = artifacts.get('model')
+        self.best_model = self.model
+        if artifacts.get('scaler') is not None:
+            self.scaler = artifacts['scaler']
+        self.feature_names = artifacts.get('feature_names')
+
+        # Model mới: kết quả cache của artifact cũ không còn đúng
+        self.model_version = artifact_version(filepath)
+        if self.prediction_cache is not None:
+            self.prediction_cache.clear()
+        return self
+
     def predict_heart_rate_risk(self, heart_rate_data):
         """Predict risk based on heart rate and other features"""
+        with timing.span("features"):
+            row = self._feature_row(heart_rate_data)
+
+        cache_key = None
+        if self.prediction_cache is not None:
+            cache_key = ('prediction', self.model_version, row)
+            cached = self.prediction_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        features = np.array([row])
+
+        # Scale features
+        with timing.span("scale"):
+            features_scaled = self.scaler.transform(features)
+
+        # Một lần predict_proba duy nhất; severity = class có xác suất cao nhất (như predict_batch)
+        # Many scikit-learn classifiers used above (RandomForest, SVC, MLPClassifier) support predict_proba;
+        # probabilities below come from the chosen scikit-learn model's predict_proba implementation.
+        with timing.span("predict"):
+            probabilities = self.best_model.predict_proba(features_scaled)[0]
+        best = int(np.argmax(probabilities))
+        severity_pred = self.best_model.classes_[best]
+
+        confidence = probabilities[best] * 100
+
+        result = {
+            'severity': int(severity_pred),
+            'confidence': round(confidence, 2),
+            'probabilities': probabilities.tolist(),
+            'risk_level': self._map_severity_to_risk(severity_pred)
+        }
+        if cache_key is not None:
+            self.prediction_cache.put(cache_key, result)
+        return result
+
+    @staticmethod
+    def _feature_row(heart_rate_data):
+        """Build the 17-feature tuple (13 original + 4 engineered) for one reading"""
         # Chuẩn bị input data với feature engineering
         age = heart_rate_data.get('age', 50)
         trestbps = heart_rate_data.get('trestbps', 120)
@@ -239,8 +513,8 @@ class HeartDiagnosisAI:
             heart_rate_data.get('exang', 0)
         )
 
-        # Tạo feature array với 17 features (13 original + 4 engineered)
-        features = np.array([[
+        # Tạo feature tuple với 17 features (13 original + 4 engineered)
+        return (
             age,
             heart_rate_data.get('sex', 1),
             heart_rate_data.get('cp', 0),
@@ -258,26 +532,105 @@ class HeartDiagnosisAI:
             bp_category,
             chol_category,
             risk_score
-        ]])
-
-        # Scale features
-        features_scaled = self.scaler.transform(features)
-
-        # Get predictions
-        severity_pred = self.best_model.predict(features_scaled)[0]
-        # Many scikit-learn classifiers used above (RandomForest, SVC, MLPClassifier) support predict_proba;
-        # probabilities below come from the chosen scikit-learn model's predict_proba implementation.
-        probabilities = self.best_model.predict_proba(features_scaled)[0]
+        )
 
-        confidence = np.max(probabilities) * 100
+    def predict_batch(self, readings):
+        """Vectorized prediction for many readings in a single predict_proba call.
+
+        readings: list of dicts (same keys as predict_heart_rate_risk), a dict of
+        columns ({'age': [...], 'heartRate': [...], ...}) or an (n, 13) array in
+        RAW_FEATURES order. Returns columnar results.
+        """
+        with timing.span("features"):
+            features = self._engineer_batch(self._batch_columns(readings))
+        if len(features) == 0:
+            return {
+                'severity': np.empty(0, dtype=int),
+                'confidence': np.empty(0),
+                'probabilities': np.empty((0, 0)),
+                'risk_level': []
+            }
+
+        with timing.span("scale"):
+            features_scaled = self.scaler.transform(features)
+        with timing.span("predict"):
+            probabilities = self.best_model.predict_proba(features_scaled)
+
+        # Severity = class có xác suất cao nhất, không gọi predict() riêng
+        best = np.argmax(probabilities, axis=1)
+        severity = np.asarray(self.best_model.classes_)[best].astype(int)
+        confidence = np.round(probabilities[np.arange(len(best)), best] * 100, 2)
+
+        in_range = (severity >= 0) & (severity < len(RISK_LEVELS))
+        risk_level = np.where(in_range, RISK_LEVELS[np.clip(severity, 0, len(RISK_LEVELS) - 1)], 'unknown')
 
         return {
-            'severity': int(severity_pred),
-            'confidence': round(confidence, 2),
-            'probabilities': probabilities.tolist(),
-            'risk_level': self._map_severity_to_risk(severity_pred)
+            'severity': severity,
+            'confidence': confidence,
+            'probabilities': probabilities,
+            'risk_level': risk_level.tolist()
         }
 
+    @staticmethod
+    def _batch_columns(readings):
+        """Normalize batch input into a dict of float arrays keyed by RAW_FEATURES"""
+        if isinstance(readings, np.ndarray):
+            matrix = np.atleast_2d(readings).astype(float)
+            if matrix.shape[1] != len(RAW_FEATURES):
+                raise ValueError(f"Expected {len(RAW_FEATURES)} columns in RAW_FEATURES order, got {matrix.shape[1]}")
+            return {name: matrix[:, i] for i, name in enumerate(RAW_FEATURES)}
+
+        if isinstance(readings, dict):
+            lengths = {len(v) for v in readings.values()}
+            if len(lengths) > 1:
+                raise ValueError("All columns must have the same length")
+            n = lengths.pop() if lengths else 0
+            columns = {}
+            for name in RAW_FEATURES:
+                if name in readings:
+                    columns[name] = np.asarray(readings[name], dtype=float)
+                elif name == 'thalach' and 'heartRate' in readings:
+                    columns[name] = np.asarray(readings['heartRate'], dtype=float)
+                else:
+                    columns[name] = np.full(n, RAW_FEATURE_DEFAULTS[name], dtype=float)
+            return columns
+
+        readings = list(readings)
+        n = len(readings)
+        columns = {}
+        for name in RAW_FEATURES:
+            default = RAW_FEATURE_DEFAULTS[name]
+            if name == 'thalach':
+                values = (r.get('thalach', r.get('heartRate', default)) for r in readings)
+            else:
+                values = (r.get(name, default) for r in readings)
+            columns[name] = np.fromiter(values, dtype=float, count=n)
+        return columns
+
+    @staticmethod
+    def _engineer_batch(columns):
+        """Build the (n, 17) feature matrix: 13 original + 4 engineered features"""
+        age = columns['age']
+        trestbps = columns['trestbps']
+        chol = columns['chol']
+        thalach = columns['thalach']
+
+        age_group = np.digitize(age, AGE_GROUP_EDGES, right=True)
+        bp_category = np.digitize(trestbps, BP_CATEGORY_EDGES, right=True)
+        chol_category = np.digitize(chol, CHOL_CATEGORY_EDGES, right=True)
+        risk_score = (
+            (age > 50).astype(int) +
+            (trestbps > 140) +
+            (chol > 240) +
+            (thalach < 120) +
+            columns['exang']
+        )
+
+        return np.column_stack(
+            [columns[name] for name in RAW_FEATURES] +
+            [age_group, bp_category, chol_category, risk_score]
+        )
+
     def _map_severity_to_risk(self, severity):
         """Map severity level to risk description"""
         risk_map = {
@@ -289,9 +642,19 @@ class HeartDiagnosisAI:
         }
         return risk_map.get(severity, 'unknown')
 
-    def generate_insights(self, heart_rate_data):
-        """Generate AI insights based on prediction"""
-        prediction = self.predict_heart_rate_risk(heart_rate_data)
+    def generate_insights(self, heart_rate_data, prediction=None):
+        """Generate AI insights based on prediction (reuses `prediction` if already computed)"""
+        cache_key = None
+        if self.prediction_cache is not None:
+            # Recommendations / risk factors còn phụ thuộc heartRate ngoài feature vector
+            cache_key = ('insights', self.model_version, self._feature_row(heart_rate_data),
+                         heart_rate_data.get('heartRate', 80))
+            cached = self.prediction_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        if prediction is None:
+            prediction = self.predict_heart_rate_risk(heart_rate_data)
 
         insights = {
             'severity': prediction['severity'],
@@ -302,6 +665,8 @@ class HeartDiagnosisAI:
             'preventive_measures': self._generate_preventive_measures(prediction)
         }
 
+        if cache_key is not None:
+            self.prediction_cache.put(cache_key, insights)
         return insights
 
     def _generate_risk_assessment(self, prediction):
@@ -385,6 +750,27 @@ class HeartDiagnosisAI:
 
 def main():
     """Main function to train and test the model"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Train the heart diagnosis models")
+    parser.add_argument("--jobs", type=int, default=-1,
+                        help="Số process song song cho training/CV (-1 = tất cả core, 1 = tuần tự)")
+    parser.add_argument("--params", default=None,
+                        help="File JSON từ hyperparam_search.py; chỉ train model đã được chọn với params đã tune")
+    parser.add_argument("--no-lut", action="store_true",
+                        help="Không build lookup table (diagnosis_lut.py) cho model mới")
+    args = parser.parse_args()
+
+    model_params, models = None, None
+    if args.params:
+        import json
+        with open(args.params) as f:
+            search = json.load(f)
+        model_params = search.get('params', search)
+        if search.get('selected'):
+            models = [search['selected']]
+        print(f"🔧 Hyperparameters from {args.params}: {models or list(model_params)}")
+
     print("🫀 AI Heart Diagnosis System")
     print("=" * 50)
 
@@ -405,13 +791,21 @@ def main():
     print(f"📈 Target classes: {sorted(y.unique())}")
 
     # Train models
-    best_model = ai.train_models(X, y)
+    best_model = ai.train_models(X, y, n_jobs=args.jobs, model_params=model_params, models=models)
 
     # Analyze feature importance
     ai.analyze_feature_importance(X, feature_cols)
 
     # Save model
-    ai.save_model()
+    ai.save_model(feature_names=feature_cols)
+
+    # Lookup table trên lưới input của run_ai: serving không cần gọi model cho input trên lưới
+    if not args.no_lut:
+        from diagnosis_lut import build_lookup_table, lut_path_for, model_fingerprint
+        lut_path = lut_path_for('heart_diagnosis_model.pkl')
+        n_cells = build_lookup_table(ai, lut_path, source_model='heart_diagnosis_model.pkl',
+                                     source_sha256=model_fingerprint('heart_diagnosis_model.pkl'))
+        print(f"📋 Lookup table: {n_cells:,} ô -> {lut_path}")
 
     # Test prediction
     # Test prediction với data đầy đủ
@@ -436,7 +830,7 @@ def main():
     print(f"Confidence: {result['confidence']:.1f}%")
     print(f"Risk Level: {result['risk_level']}")
 
-    insights = ai.generate_insights(test_data)
+    insights = ai.generate_insights(test_data, result)
     print(f"Risk Assessment: {insights['risk_assessment']}")
     print(f"Recommendations: {insights['recommendations'][:3]}")  # Show first 3
     print(f"Risk Factors: {insights['risk_factors'][:3]}")  # Show first 3
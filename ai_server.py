@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# ai_server.py
+"""
+Worker Python chạy lâu dài cho chẩn đoán nhịp tim.
+Load HeartDiagnosisAI + heart_diagnosis_model.pkl đúng một lần, warm-up, rồi phục vụ
+các request tương đương run_ai_diagnosis qua stdin/stdout JSONL hoặc Unix socket
+(xem inference_worker.py cho protocol).
+
+Cách chạy:
+  python3 ai_server.py                          # stdio, Node.js spawn một lần và giữ process
+  python3 ai_server.py --socket /tmp/ai.sock    # Unix socket cho nhiều client
+  python3 ai_server.py --max-batch 64           # gom request đồng thời thành một predict_batch (microbatch.py)
+  python3 ai_server.py --pool-workers 4         # predict chạy trên N process, model trong shared memory (inference_pool.py)
+  python3 ai_server.py --gate                   # reading clearly-normal của device không gọi model (anomaly_gate.py)
+
+Request mẫu:
+  {"id": "1", "op": "diagnose", "heart_rate": 85, "age": 45, "sex": 1, "trestbps": 130, "chol": 220}
+  {"id": "2", "op": "health"}
+"""
+
+import sys
+import time
+import argparse
+import threading
+import contextlib
+
+from inference_worker import InferenceWorker
+from microbatch import MicroBatcher
+from anomaly_gate import AnomalyGate, to_epoch
+from run_ai import MODEL_PATH, load_diagnosis_ai, diagnose_with_ai, diagnose_batch_with_ai, _parse_reading
+from ai_heart_diagnosis import PredictionCache, artifact_version
+from diagnosis_lut import lut_path_for
+
+# Mỗi nhánh nhịp tim của _build_feature_vector được chạy một lần khi warm-up
+WARMUP_HEART_RATES = [72, 45, 125, 150]
+
+# Tần suất tối đa stat() file model để phát hiện artifact mới
+RELOAD_CHECK_INTERVAL_S = 1.0
+
+
+class DiagnosisServer:
+    def __init__(self, model_path=MODEL_PATH, cache_size=4096, cache_ttl=None, max_batch=0, max_wait_ms=2.0,
+                 pool_workers=0, gate=False):
+        self.model_path = model_path
+        self.ai = None
+        self.pool_workers = pool_workers
+        self.pool = None
+        self.load_time_ms = None
+        self.warmup_ms = None
+        self.reloads = 0
+        self.cache = PredictionCache(maxsize=cache_size, ttl=cache_ttl) if cache_size > 0 else None
+        self._artifact_version = None
+        self._last_reload_check = 0.0
+        self._reload_lock = threading.Lock()
+        self.worker = InferenceWorker("heart-diagnosis")
+        self.batcher = None
+        if max_batch > 0:
+            self.batcher = MicroBatcher(self.diagnose_batch, max_batch, max_wait_ms).start_background()
+            self._diagnose_model = self.diagnose_batched
+        else:
+            self._diagnose_model = self.diagnose
+        self.gate = AnomalyGate() if gate else None
+        self.worker.register("diagnose", self.diagnose_gated if gate else self._diagnose_model)
+        self.worker.register("health", self.health)
+
+    def load(self):
+        """Load artifacts một lần và warm-up toàn bộ đường predict"""
+        started = time.perf_counter()
+        version = self.artifact_version()
+        ai = load_diagnosis_ai(self.model_path)
+        if ai is None:
+            raise RuntimeError(f"Cannot load model from {self.model_path}")
+        old_pool = self.pool
+        if self.pool_workers > 0:
+            from inference_pool import InferencePool
+            self.pool = InferencePool(self.model_path, workers=self.pool_workers)
+            self.pool.warm_up()
+            self.pool.attach(ai)
+
+        # Cache dùng chung qua các lần reload; key chứa model_version và bị clear khi đổi model
+        ai.model_version = version
+        if self.cache is not None:
+            self.cache.clear()
+            ai.prediction_cache = self.cache
+        self.ai = ai
+        self._artifact_version = version
+        if old_pool is not None:
+            old_pool.close()
+        self.load_time_ms = round((time.perf_counter() - started) * 1000, 2)
+        self.warm_up()
+
+    def artifact_version(self):
+        """Version của model + lookup table: bảng được ghi sau model (ai_heart_diagnosis.py build nó
+        sau khi lưu .pkl) nên bảng mới cũng phải kích hoạt reload"""
+        try:
+            lut_version = artifact_version(lut_path_for(self.model_path))
+        except FileNotFoundError:
+            lut_version = None
+        return artifact_version(self.model_path), lut_version
+
+    def maybe_reload(self):
+        """Reload model nếu file artifact đã bị ghi đè (kiểm tra tối đa mỗi RELOAD_CHECK_INTERVAL_S)"""
+        now = time.monotonic()
+        if now - self._last_reload_check < RELOAD_CHECK_INTERVAL_S:
+            return False
+        with self._reload_lock:
+            self._last_reload_check = now
+            try:
+                version = self.artifact_version()
+            except OSError:
+                return False  # file đang được ghi lại, giữ model cũ
+            if version == self._artifact_version:
+                return False
+            try:
+                with contextlib.redirect_stdout(sys.stderr):
+                    self.load()
+            except Exception as exc:
+                print(f"⚠️ Reload failed, keeping previous model: {exc}", file=sys.stderr)
+                self._artifact_version = version  # không thử lại file hỏng mỗi request
+                return False
+            self.reloads += 1
+            print(f"🔄 Reloaded {self.model_path} ({self.load_time_ms} ms)", file=sys.stderr)
+            return True
+
+    def warm_up(self):
+        started = time.perf_counter()
+        for heart_rate in WARMUP_HEART_RATES:
+            diagnose_with_ai(self.ai, heart_rate)
+        self.warmup_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    def diagnose(self, request):
+        heart_rate = request.get("heart_rate", request.get("heartRate"))
+        if heart_rate is None:
+            raise ValueError("heart_rate is required")
+        if self.ai is None:
+            raise RuntimeError("Model is not loaded")
+        self.maybe_reload()
+
+        return diagnose_with_ai(
+            self.ai,
+            float(heart_rate),
+            request.get("age", 50),
+            request.get("sex", 1),
+            request.get("trestbps", 120),
+            request.get("chol", 200),
+        )
+
+    def diagnose_gated(self, request):
+        """Reading clearly-normal so với lịch sử của device không gọi model: trả về {"gated": true}
+        và Node.js dùng kết quả rule-based; còn lại đi đường diagnose thường"""
+        heart_rate = request.get("heart_rate", request.get("heartRate"))
+        device_id = request.get("device_id")
+        needs_model, _ = self.gate.check(str(device_id) if device_id is not None else None,
+                                         heart_rate, to_epoch(request.get("timestamp")))
+        if needs_model:
+            return self._diagnose_model(request)
+        return {"gated": True, "heart_rate": float(heart_rate)}
+
+    def diagnose_batched(self, request):
+        """Như diagnose nhưng request đồng thời được gom thành một predict_batch"""
+        if self.ai is None:
+            raise RuntimeError("Model is not loaded")
+        self.maybe_reload()
+        return self.batcher.submit_threadsafe(request)
+
+    def diagnose_batch(self, requests):
+        """run_batch của MicroBatcher: một lần predict_batch cho cả batch (không qua prediction cache);
+        request sai trả về Exception riêng cho request đó"""
+        results = [None] * len(requests)
+        valid, readings = [], []
+        for i, request in enumerate(requests):
+            try:
+                readings.append(_parse_reading(request))
+                valid.append(i)
+            except (ValueError, TypeError) as exc:
+                results[i] = exc
+        for i, result in zip(valid, diagnose_batch_with_ai(self.ai, readings)):
+            results[i] = result
+        return results
+
+    def health(self, request=None):
+        return {
+            **self.worker.base_health(),
+            "status": "ok" if self.ai is not None else "loading",
+            "model_path": self.model_path,
+            "model_type": type(self.ai.model).__name__ if self.ai is not None else None,
+            "load_time_ms": self.load_time_ms,
+            "warmup_ms": self.warmup_ms,
+            "reloads": self.reloads,
+            "cache": self.cache.stats() if self.cache is not None else None,
+            "microbatch": self.batcher.stats() if self.batcher is not None else None,
+            "lut": self.ai.lut.stats() if getattr(self.ai, "lut", None) is not None else None,
+            "pool": {"workers": self.pool.workers, "shared_mb": round(self.pool.nbytes / 1e6, 2)}
+            if self.pool is not None else None,
+            "gate": self.gate.stats() if self.gate is not None else None,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Long-lived heart diagnosis inference worker")
+    parser.add_argument("--model", default=MODEL_PATH, help="Đường dẫn heart_diagnosis_model.pkl")
+    parser.add_argument("--socket", default=None, help="Unix socket path (mặc định: stdin/stdout)")
+    parser.add_argument("--cache-size", type=int, default=4096, help="Số entry LRU cache prediction (0 = tắt)")
+    parser.add_argument("--cache-ttl", type=float, default=None, help="TTL (giây) cho mỗi entry cache")
+    parser.add_argument("--max-batch", type=int, default=0,
+                        help="Gom tối đa N request diagnose đồng thời thành một predict_batch (0 = tắt)")
+    parser.add_argument("--max-wait-ms", type=float, default=2.0, help="Thời gian chờ gom batch tối đa")
+    parser.add_argument("--pool-workers", type=int, default=0,
+                        help="Chạy predict trên N process dùng chung model qua shared memory (0 = trong process)")
+    parser.add_argument("--gate", action="store_true",
+                        help="Bỏ qua model cho reading clearly-normal theo EWMA từng device (anomaly_gate.py)")
+    args = parser.parse_args()
+
+    server = DiagnosisServer(args.model, cache_size=args.cache_size, cache_ttl=args.cache_ttl,
+                             max_batch=args.max_batch, max_wait_ms=args.max_wait_ms,
+                             pool_workers=args.pool_workers, gate=args.gate)
+    try:
+        # load_diagnosis_ai in debug ra stdout, giữ stdout sạch cho protocol
+        with contextlib.redirect_stdout(sys.stderr):
+            server.load()
+    except Exception as exc:
+        print(f"❌ Không thể khởi động ai_server: {exc}", file=sys.stderr)
+        sys.exit(1)
+
+    ready_info = {"load_time_ms": server.load_time_ms, "warmup_ms": server.warmup_ms}
+    if args.socket:
+        server.worker.serve_unix(args.socket, ready_info)
+    else:
+        server.worker.serve_stdio(ready_info, concurrency=max(1, 2 * args.max_batch, 2 * args.pool_workers))
+
+
+if __name__ == "__main__":
+    main()
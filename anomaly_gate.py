@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""anomaly_gate.py
+Bộ lọc streaming trước model: phần lớn reading trong Data là nhịp tim nghỉ bình thường,
+không cần đi qua HeartDiagnosisAI. Mỗi device giữ state O(1) trong các mảng NumPy
+(EWMA mean / variance, reading cuối, thời điểm cuối, số reading) và mỗi reading được xếp loại:
+
+  clearly-normal : nằm trong NORMAL_RANGE, device đã có đủ lịch sử, |z| và tốc độ thay đổi nhỏ
+                   -> dùng kết quả rule-based, không gọi model
+  needs-model    : mọi trường hợp còn lại (reason cho biết vì sao)
+
+State luôn được cập nhật sau khi xếp loại, nên mức nền của từng device tự thích nghi.
+
+Dùng:
+  gate = AnomalyGate()
+  needs_model, reason = gate.check("device-1", 72, timestamp=1718000000.0)
+  python ai_server.py --gate                          # worker trả về {"gated": true} cho reading clearly-normal
+
+Replay để đo tỉ lệ lời gọi model tránh được:
+  python anomaly_gate.py --days 30                    # Data trong MongoDB, theo thứ tự createdAt
+  python anomaly_gate.py --jsonl readings.jsonl --check-model
+  python anomaly_gate.py --synthetic 200000 --devices 500
+"""
+
+import sys
+import json
+import math
+import time
+import argparse
+import threading
+import contextlib
+from datetime import datetime
+
+import numpy as np
+
+# Khoảng "Normal heart rate" của getRuleBasedDiagnosis (src/services/ai.service.js)
+NORMAL_RANGE = (60.0, 100.0)
+EWMA_ALPHA = 0.1
+Z_THRESHOLD = 2.5
+MAX_RATE_BPM_PER_S = 2.0
+MIN_HISTORY = 5
+# Độ lệch chuẩn tối thiểu (bpm) khi tính z: device rất ổn định không bị coi mọi dao động nhỏ là bất thường
+MIN_STD_BPM = 3.0
+INITIAL_CAPACITY = 1024
+
+REASONS = ("out_of_range", "invalid", "no_device", "warming_up", "z_score", "rate_of_change")
+
+
+class AnomalyGate:
+    def __init__(self, alpha=EWMA_ALPHA, z_threshold=Z_THRESHOLD, max_rate=MAX_RATE_BPM_PER_S,
+                 min_history=MIN_HISTORY, normal_range=NORMAL_RANGE, min_std=MIN_STD_BPM,
+                 capacity=INITIAL_CAPACITY):
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.max_rate = max_rate
+        self.min_history = min_history
+        self.low, self.high = normal_range
+        self.min_var = min_std ** 2
+        self._lock = threading.Lock()
+
+        self._slots = {}                         # device id -> index trong các mảng state
+        self.mean = np.zeros(capacity, dtype=np.float64)
+        self.var = np.zeros(capacity, dtype=np.float64)
+        self.last_value = np.zeros(capacity, dtype=np.float64)
+        self.last_time = np.full(capacity, np.nan, dtype=np.float64)
+        self.count = np.zeros(capacity, dtype=np.int32)
+
+        self.checked = 0
+        self.gated = 0
+        self.reasons = dict.fromkeys(REASONS, 0)
+
+    # ------------------------------- State -----------------------------------
+
+    def _slot(self, device_id):
+        slot = self._slots.get(device_id)
+        if slot is None:
+            slot = len(self._slots)
+            if slot == len(self.mean):
+                self._grow()
+            self._slots[device_id] = slot
+        return slot
+
+    def _grow(self):
+        size = len(self.mean) * 2
+        for name in ("mean", "var", "last_value", "last_time", "count"):
+            old = getattr(self, name)
+            new = np.full(size, np.nan, dtype=old.dtype) if name == "last_time" else np.zeros(size, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _update(self, slot, value, timestamp):
+        n = int(self.count[slot])
+        if n == 0:
+            self.mean[slot], self.var[slot] = value, 0.0
+        else:
+            # EWMA mean / variance (Welford dạng exponential)
+            diff = value - self.mean[slot]
+            incr = self.alpha * diff
+            self.mean[slot] += incr
+            self.var[slot] = (1 - self.alpha) * (self.var[slot] + diff * incr)
+        self.last_value[slot] = value
+        if timestamp is not None:
+            self.last_time[slot] = timestamp
+        self.count[slot] = n + 1
+
+    # ------------------------------- Check -----------------------------------
+
+    def _classify(self, slot, value, timestamp):
+        if not self.low <= value <= self.high:
+            return "out_of_range"
+        if self.count[slot] < self.min_history:
+            return "warming_up"
+        z = (value - self.mean[slot]) / math.sqrt(max(self.var[slot], self.min_var))
+        if abs(z) > self.z_threshold:
+            return "z_score"
+        # Không có timestamp: coi hai reading liên tiếp cách nhau 1 giây (ngưỡng theo bpm mỗi reading)
+        last_time = self.last_time[slot]
+        dt = timestamp - last_time if timestamp is not None and not math.isnan(last_time) else 1.0
+        if abs(value - self.last_value[slot]) / max(dt, 1.0) > self.max_rate:
+            return "rate_of_change"
+        return None
+
+    def check(self, device_id, heart_rate, timestamp=None):
+        """(needs_model, reason) cho một reading; reason là None khi reading clearly-normal.
+
+        timestamp: epoch giây (float) hoặc None.
+        """
+        try:
+            value = float(heart_rate)
+        except (TypeError, ValueError):
+            value = math.nan
+        with self._lock:
+            self.checked += 1
+            if math.isnan(value):
+                reason = "invalid"
+            elif device_id is None:
+                reason = "out_of_range" if not self.low <= value <= self.high else "no_device"
+            else:
+                slot = self._slot(device_id)
+                reason = self._classify(slot, value, timestamp)
+                self._update(slot, value, timestamp)
+            if reason is None:
+                self.gated += 1
+            else:
+                self.reasons[reason] += 1
+        return reason is not None, reason
+
+    def stats(self):
+        return {
+            "checked": self.checked,
+            "gated": self.gated,
+            "model_calls_avoided": round(self.gated / self.checked, 4) if self.checked else None,
+            "devices": len(self._slots),
+            "state_bytes": sum(getattr(self, name).nbytes for name in ("mean", "var", "last_value", "last_time", "count")),
+            "reasons": dict(self.reasons),
+        }
+
+# ------------------------------- Replay --------------------------------------
+
+
+def to_epoch(value):
+    """timestamp của record (datetime, ISO string, epoch giây/ms) -> epoch giây"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, (int, float)):
+        return value / 1000 if value > 1e11 else float(value)
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def reading_of(record):
+    """(device key, heartRate, epoch giây) từ một record Data / dòng JSONL"""
+    device = record.get("deviceId") or record.get("device_id") or record.get("userId")
+    timestamp = record.get("timestamp", record.get("createdAt"))
+    return (str(device) if device is not None else None,
+            record.get("heartRate", record.get("heart_rate")), to_epoch(timestamp))
+
+
+def iter_mongo(uri, days, start_date, end_date, limit=None):
+    from train_history_model import open_collections, build_time_filter
+
+    client, data_col, _ = open_collections(uri)
+    try:
+        cursor = data_col.find(build_time_filter(days, start_date, end_date),
+                               {"_id": 0, "userId": 1, "deviceId": 1, "heartRate": 1, "timestamp": 1, "createdAt": 1},
+                               batch_size=5000).sort("createdAt", 1)
+        if limit:
+            cursor = cursor.limit(limit)
+        for record in cursor:
+            yield reading_of(record)
+    finally:
+        client.close()
+
+
+def iter_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield reading_of(json.loads(line))
+
+
+def iter_synthetic(n, devices, seed=42):
+    """Stream giả lập: mỗi device một nhịp nghỉ riêng, đo mỗi ~60 s, thỉnh thoảng có episode nhanh/chậm"""
+    rng = np.random.default_rng(seed)
+    baseline = rng.normal(72, 7, devices)
+    device = rng.integers(0, devices, n)
+    clock = np.full(devices, 1.7e9)
+    episode = rng.random(n) < 0.03
+    shift = np.where(rng.random(n) < 0.5, rng.normal(45, 15, n), rng.normal(-25, 8, n))
+    noise = rng.normal(0, 2.5, n)
+    for i in range(n):
+        d = device[i]
+        clock[d] += rng.exponential(60)
+        heart_rate = baseline[d] + noise[i] + (shift[i] if episode[i] else 0.0)
+        yield f"device-{d}", round(float(heart_rate), 1), float(clock[d])
+
+
+def replay(readings, gate, check_model=None, model_batch=4096):
+    """Chạy gate trên stream; check_model: HeartDiagnosisAI để kiểm tra các reading đã bị gate"""
+    started = time.perf_counter()
+    pending, severities, model_s = [], [], [0.0]
+
+    def flush():
+        from run_ai import diagnose_batch_with_ai
+        flush_started = time.perf_counter()
+        results = diagnose_batch_with_ai(check_model, pending)
+        severities.extend(int(r["severity"]) for r in results if r is not None)
+        pending.clear()
+        model_s[0] += time.perf_counter() - flush_started
+
+    for device, heart_rate, timestamp in readings:
+        needs_model, _ = gate.check(device, heart_rate, timestamp)
+        if not needs_model and check_model is not None:
+            # Cùng giá trị mặc định diagnoseWithPythonAI dùng khi reading không có thông tin bệnh nhân
+            pending.append((float(heart_rate), 50, 1, 120, 200))
+            if len(pending) >= model_batch:
+                flush()
+    gate_s = time.perf_counter() - started - model_s[0]
+    if pending:
+        flush()
+
+    report = {**gate.stats(), "gate_s": round(gate_s, 3),
+              "readings_per_s": round(gate.checked / gate_s, 1) if gate_s else None}
+    if check_model is not None:
+        # Model sẽ đánh severity >= 2 (needsAttention trong Node.js) cho bao nhiêu reading đã bị gate
+        counts = np.bincount(severities, minlength=5) if severities else np.zeros(5, dtype=int)
+        report["gated_model_severity"] = {str(s): int(c) for s, c in enumerate(counts)}
+        report["gated_needs_attention"] = int(counts[2:].sum())
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a heart-rate stream through the anomaly pre-filter")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--jsonl", default=None, help="File JSONL: {deviceId|userId, heartRate, timestamp|createdAt}")
+    source.add_argument("--synthetic", type=int, default=None, help="Dùng N reading giả lập thay cho MongoDB")
+    parser.add_argument("--devices", type=int, default=500, help="Số device cho --synthetic")
+    parser.add_argument("--uri", default=None, help="MongoDB URI (mặc định như train_history_model.py)")
+    parser.add_argument("--days", type=int, default=None)
+    parser.add_argument("--startDate", type=str, default=None)
+    parser.add_argument("--endDate", type=str, default=None)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--alpha", type=float, default=EWMA_ALPHA)
+    parser.add_argument("--z-threshold", type=float, default=Z_THRESHOLD)
+    parser.add_argument("--max-rate", type=float, default=MAX_RATE_BPM_PER_S, help="bpm mỗi giây")
+    parser.add_argument("--min-history", type=int, default=MIN_HISTORY)
+    parser.add_argument("--check-model", default=None, metavar="MODEL",
+                        help="Chạy model trên các reading đã bị gate để đếm số ca model sẽ cảnh báo")
+    parser.add_argument("--json", action="store_true", help="Chỉ in kết quả JSON")
+    args = parser.parse_args()
+
+    gate = AnomalyGate(alpha=args.alpha, z_threshold=args.z_threshold, max_rate=args.max_rate,
+                       min_history=args.min_history)
+    if args.synthetic:
+        readings = iter_synthetic(args.synthetic, args.devices)
+    elif args.jsonl:
+        readings = iter_jsonl(args.jsonl)
+    else:
+        from train_history_model import DEFAULT_URI
+        readings = iter_mongo(args.uri or DEFAULT_URI, args.days, args.startDate, args.endDate, args.limit)
+
+    ai = None
+    if args.check_model:
+        from run_ai import load_diagnosis_ai
+        with contextlib.redirect_stdout(sys.stderr):
+            ai = load_diagnosis_ai(args.check_model)
+        if ai is None:
+            sys.exit(1)
+
+    report = replay(readings, gate, ai)
+    if args.json:
+        print(json.dumps(report))
+        return
+
+    print(f"🚦 {report['checked']} readings from {report['devices']} devices "
+          f"({report['readings_per_s']:,.0f} readings/s, state {report['state_bytes'] / 1024:.1f} KiB)")
+    if report["checked"]:
+        print(f"   model calls avoided: {report['gated']} ({report['model_calls_avoided']:.1%})")
+    print(f"   needs model: {report['reasons']}")
+    if ai is not None:
+        print(f"   model severity on gated readings: {report['gated_model_severity']} "
+              f"(needsAttention: {report['gated_needs_attention']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""bench_diagnosis.py
+Micro-benchmark thời gian model cho mỗi lần chẩn đoán (run_ai.diagnose_with_ai).
+
+So sánh:
+  - legacy : predict + predict_proba, rồi generate_insights predict lại lần nữa
+             (2 lần scaler.transform, 4 lần gọi estimator mỗi request)
+  - single : một lần predict_proba, generate_insights dùng lại prediction
+
+Usage:
+  python bench_diagnosis.py --model heart_diagnosis_model.pkl --requests 200
+"""
+
+import sys
+import json
+import time
+import argparse
+import statistics
+import contextlib
+
+import numpy as np
+
+from run_ai import MODEL_PATH, load_diagnosis_ai, _build_feature_vector
+
+
+class _CountingEstimator:
+    """Bọc estimator để đếm số lần gọi predict / predict_proba"""
+
+    def __init__(self, estimator):
+        self.estimator = estimator
+        self.classes_ = estimator.classes_
+        self.calls = 0
+
+    def predict(self, X):
+        self.calls += 1
+        return self.estimator.predict(X)
+
+    def predict_proba(self, X):
+        self.calls += 1
+        return self.estimator.predict_proba(X)
+
+
+def _legacy_predict(ai, data):
+    """predict_heart_rate_risk trước khi gộp về một lần predict_proba"""
+    features_scaled = ai.scaler.transform(np.array([ai._feature_row(data)]))
+    severity_pred = ai.best_model.predict(features_scaled)[0]
+    probabilities = ai.best_model.predict_proba(features_scaled)[0]
+    return {
+        'severity': int(severity_pred),
+        'confidence': round(np.max(probabilities) * 100, 2),
+        'probabilities': probabilities.tolist(),
+        'risk_level': ai._map_severity_to_risk(severity_pred)
+    }
+
+
+def legacy_diagnosis(ai, features):
+    _legacy_predict(ai, features)
+    return ai.generate_insights(features, _legacy_predict(ai, features))
+
+
+def single_pass_diagnosis(ai, features):
+    prediction = ai.predict_heart_rate_risk(features)
+    return ai.generate_insights(features, prediction)
+
+
+def _time_pipeline(ai, pipeline, workload):
+    timings = []
+    for features in workload:
+        started = time.perf_counter()
+        pipeline(ai, features)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def run_benchmark(model_path=MODEL_PATH, n_requests=200, seed=42):
+    with contextlib.redirect_stdout(sys.stderr):
+        ai = load_diagnosis_ai(model_path)
+    if ai is None:
+        raise RuntimeError(f"Cannot load model from {model_path}")
+    ai.prediction_cache = None  # đo chi phí model thật, không đo cache
+    ai.best_model = counter = _CountingEstimator(ai.best_model)
+
+    rng = np.random.default_rng(seed)
+    workload = [
+        _build_feature_vector(float(hr), float(age), 1, 120, 200)
+        for hr, age in zip(rng.integers(40, 180, n_requests), rng.integers(20, 85, n_requests))
+    ]
+
+    # Warm-up cả hai đường trước khi đo
+    for pipeline in (legacy_diagnosis, single_pass_diagnosis):
+        _time_pipeline(ai, pipeline, workload[:10])
+
+    results = {}
+    for name, pipeline in (("legacy", legacy_diagnosis), ("single", single_pass_diagnosis)):
+        counter.calls = 0
+        timings = _time_pipeline(ai, pipeline, workload)
+        results[name] = {
+            "median_ms": round(statistics.median(timings), 4),
+            "p95_ms": round(float(np.percentile(timings, 95)), 4),
+            "estimator_calls_per_request": counter.calls / len(workload),
+        }
+
+    results["speedup"] = round(results["legacy"]["median_ms"] / results["single"]["median_ms"], 2)
+    results["model_type"] = type(counter.estimator).__name__
+    results["requests"] = n_requests
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-request model time: legacy double prediction vs single pass")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--json", action="store_true", help="Chỉ in kết quả JSON")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.model, args.requests)
+    if args.json:
+        print(json.dumps(results))
+        return
+
+    print(f"⏱️  Per-request model time ({results['model_type']}, {results['requests']} requests)")
+    for name in ("legacy", "single"):
+        r = results[name]
+        print(f"   {name:7s} median {r['median_ms']:.3f} ms  p95 {r['p95_ms']:.3f} ms  "
+              f"estimator calls/request {r['estimator_calls_per_request']:.0f}")
+    print(f"   Speedup: {results['speedup']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
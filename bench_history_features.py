@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""bench_history_features.py
+So sánh pipeline feature của train_history_model trước đây (dict mỗi record + apply
+cond_vector mỗi row) với pipeline cột mới (HistoryColumnBuilder + encode_feature_matrix).
+
+Kiểm tra ma trận feature, label và conditions_used giống nhau, rồi báo thời gian từng stage.
+
+Usage:
+  python bench_history_features.py --rows 200000
+  python bench_history_features.py --rows 1000000 --skip-legacy --sparse --json
+"""
+
+import json
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from train_history_model import build_dataframe, encode_feature_matrix
+
+CONDITIONS = ["hypertension", "Diabetes", "asthma", "obesity", "arrhythmia", "smoker", "athlete",
+              "anemia", "thyroid", "copd", "kidney", "migraine"]
+
+
+def make_records(n_rows, n_users=500, seed=0, start=datetime(2026, 1, 1)):
+    """Record đã gắn "_user" như fetch_records trả về"""
+    rnd = random.Random(seed)
+    users = [{
+        "age": rnd.choice([None, rnd.randint(18, 85)]),
+        "gender": rnd.choice(["male", "female", "other", None]),
+        "weight": rnd.choice([None, rnd.randint(45, 110)]),
+        "conditions": rnd.sample(CONDITIONS, rnd.randint(0, 4)),
+    } for _ in range(n_users)]
+
+    records = []
+    for i in range(n_rows):
+        hr = rnd.randint(40, 170)
+        records.append({
+            "heartRate": hr,
+            "status": "normal" if hr < 100 else "warning" if hr < 140 else "critical",
+            "aiDiagnosis": {"severity": "low" if hr < 100 else "medium" if hr < 120 else "high"} if rnd.random() < 0.8 else {},
+            "createdAt": start + timedelta(minutes=3 * i) if rnd.random() < 0.99 else None,
+            "_user": users[rnd.randrange(n_users)],
+        })
+    return records
+
+# ------------------------- Implementation trước đây -------------------------
+
+
+def legacy_build_dataframe(records, label_source):
+    rows = []
+    for r in records:
+        user = r.get("_user", {})
+        ai_diag = r.get("aiDiagnosis", {})
+        severity = ai_diag.get("severity")
+        status = r.get("status")
+
+        label = None
+        if label_source == "aiDiagnosis.severity":
+            label = severity
+        elif label_source == "status":
+            label = status
+        else:
+            label = severity or status
+
+        if not label:
+            continue
+
+        row = {
+            "heartRate": r.get("heartRate"),
+            "age": user.get("age"),
+            "gender": user.get("gender"),
+            "weight": user.get("weight"),
+            "conditions": user.get("conditions", []),
+            "label": label,
+            "created_hour": r.get("createdAt", datetime.utcnow()).hour if r.get("createdAt") else None,
+            "is_night": 1 if r.get("createdAt") and (r.get("createdAt").hour < 6 or r.get("createdAt").hour >= 22) else 0,
+        }
+        rows.append(row)
+
+    df = pd.DataFrame(rows)
+    df = df.dropna(subset=["heartRate"])
+    return df
+
+
+def legacy_encode_features(df, limit=20):
+    df["gender"] = df["gender"].fillna("other").astype(str)
+    gender_map = {"male": 0, "female": 1, "other": 2}
+    df["gender_enc"] = df["gender"].map(gender_map).fillna(2)
+
+    for col in ["age", "weight"]:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+            df[col] = df[col].fillna(df[col].median())
+
+    all_conditions = [c.lower() for arr in df["conditions"].tolist() for c in (arr if isinstance(arr, list) else [])]
+    top_conditions = [c for c, _ in Counter(all_conditions).most_common(limit)]
+
+    def cond_vector(conds):
+        vec = []
+        lower = [c.lower() for c in conds] if isinstance(conds, list) else []
+        for c in top_conditions:
+            vec.append(1 if c in lower else 0)
+        return vec
+
+    cond_matrix = df["conditions"].apply(cond_vector).tolist()
+    cond_df = pd.DataFrame(cond_matrix, columns=[f"cond_{c}" for c in top_conditions])
+
+    df["hr_is_low"] = (df["heartRate"] < 60).astype(int)
+    df["hr_is_high"] = (df["heartRate"] > 100).astype(int)
+
+    feature_df = pd.concat([
+        df[["heartRate", "age", "weight", "gender_enc", "created_hour", "is_night", "hr_is_low", "hr_is_high"]].reset_index(drop=True),
+        cond_df.reset_index(drop=True)
+    ], axis=1)
+    return feature_df, df["label"], top_conditions
+
+# -----------------------------------------------------------------------------
+
+
+def _timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def run_benchmark(n_rows, label_source="auto", sparse=False, skip_legacy=False, seed=0):
+    records = make_records(n_rows, seed=seed)
+    result = {"rows": n_rows, "label_source": label_source, "sparse": sparse}
+
+    df, result["build_s"] = _timed(lambda: build_dataframe(records, label_source))
+    (matrix, meta), result["encode_s"] = _timed(lambda: encode_feature_matrix(df, sparse=sparse))
+    result["shape"] = list(matrix.shape)
+    result["dtype"] = str(matrix.dtype)
+
+    if skip_legacy:
+        return result
+
+    legacy_df, result["legacy_build_s"] = _timed(lambda: legacy_build_dataframe(records, label_source))
+    (legacy_features, legacy_labels, legacy_top), result["legacy_encode_s"] = _timed(
+        lambda: legacy_encode_features(legacy_df.copy()))
+
+    dense = matrix.toarray() if sparse else matrix
+    result["identical"] = bool(
+        legacy_top == meta["conditions_used"]
+        and list(legacy_features.columns) == meta["feature_columns"]
+        and np.array_equal(legacy_features.to_numpy(dtype=np.float32), dense, equal_nan=True)
+        and legacy_labels.tolist() == df["label"].tolist()
+    )
+    result["speedup"] = round(
+        (result["legacy_build_s"] + result["legacy_encode_s"]) / (result["build_s"] + result["encode_s"]), 2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark history feature construction: legacy vs columnar")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--label-source", default="auto", choices=["aiDiagnosis.severity", "status", "auto"])
+    parser.add_argument("--sparse", action="store_true", help="Ma trận scipy CSR thay vì dense")
+    parser.add_argument("--skip-legacy", action="store_true", help="Chỉ đo pipeline mới (cho số row rất lớn)")
+    parser.add_argument("--json", action="store_true", help="Chỉ in kết quả JSON")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.rows, args.label_source, args.sparse, args.skip_legacy)
+    if args.json:
+        print(json.dumps(result))
+        return
+
+    print(f"🧮 {result['rows']} records -> matrix {result['shape']} {result['dtype']}{' (CSR)' if args.sparse else ''}")
+    print(f"   Columnar: build {result['build_s']:.2f}s + encode {result['encode_s']:.2f}s")
+    if not args.skip_legacy:
+        print(f"   Legacy  : build {result['legacy_build_s']:.2f}s + encode {result['legacy_encode_s']:.2f}s")
+        print(f"   Speedup : {result['speedup']}x, identical output: {result['identical']}")
+
+
+if __name__ == "__main__":
+    main()
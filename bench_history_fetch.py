@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""bench_history_fetch.py
+So sánh extractor cũ của train_history_model (list(find) + find_one mỗi user) với
+fetch streaming mới (projection + batch cursor + $in) trên cùng dữ liệu giả lập.
+
+Kiểm tra hai DataFrame giống hệt nhau, rồi báo thời gian, số query users và peak memory.
+
+Backend:
+  python bench_history_fetch.py                                 # mongomock (in-process)
+  python bench_history_fetch.py --uri mongodb://localhost:27017 # mongod local, DB tạm bị drop sau khi chạy
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import tracemalloc
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from train_history_model import build_dataframe, iter_records
+
+BENCH_DB = "history_fetch_bench"
+CONDITIONS = ["hypertension", "diabetes", "asthma", "obesity", "Arrhythmia", "smoker", "athlete"]
+
+
+def make_synthetic(n_records=20000, n_users=200, seed=0, start=datetime(2026, 1, 1)):
+    """users + heart rate records giống schema của User / Data model"""
+    rnd = random.Random(seed)
+    users = []
+    for i in range(n_users):
+        users.append({
+            "_id": ObjectId() if i % 10 else f"legacy-user-{i}",  # một số userId là string thường
+            "username": f"user{i}",
+            "email": f"user{i}@example.com",
+            "password": "x" * 60,
+            "age": rnd.choice([None, rnd.randint(18, 85)]),
+            "gender": rnd.choice(["male", "female", "other", None]),
+            "weight": rnd.choice([None, rnd.randint(45, 110)]),
+            "conditions": rnd.sample(CONDITIONS, rnd.randint(0, 3)),
+        })
+    records = []
+    for i in range(n_records):
+        user = rnd.choice(users)
+        hr = rnd.randint(40, 170)
+        severity = "low" if hr < 100 else "medium" if hr < 120 else "high" if hr < 150 else "critical"
+        status = "normal" if hr < 100 else "warning" if hr < 140 else "critical"
+        created = start + timedelta(minutes=7 * i)
+        records.append({
+            "userId": user["_id"],
+            "deviceId": f"device-{hash(str(user['_id'])) % 50}",
+            "heartRate": hr,
+            "status": status,
+            "aiDiagnosis": {
+                "diagnosis": "Synthetic", "severity": severity, "analysis": "x" * 200,
+                "recommendations": ["rest", "hydrate"], "riskFactors": [], "needsAttention": hr > 120,
+            } if rnd.random() < 0.9 else {},
+            "timestamp": created,
+            "createdAt": created,
+        })
+    return users, records
+
+
+class CountingCollection:
+    """Proxy đếm số lần query một collection"""
+
+    def __init__(self, col):
+        self.col = col
+        self.queries = 0
+
+    def find(self, *args, **kwargs):
+        self.queries += 1
+        return self.col.find(*args, **kwargs)
+
+    def find_one(self, *args, **kwargs):
+        self.queries += 1
+        return self.col.find_one(*args, **kwargs)
+
+
+def legacy_fetch(data_col, users_col, query):
+    """fetch_records trước đây: materialize mọi document + N+1 find_one"""
+    records = list(data_col.find(query))
+    user_cache = {}
+    for r in records:
+        uid = r.get("userId")
+        uid_str = str(uid) if isinstance(uid, ObjectId) else uid
+        if uid_str and uid_str not in user_cache:
+            user_doc = users_col.find_one({"_id": ObjectId(uid_str)}) if ObjectId.is_valid(uid_str) else users_col.find_one({"_id": uid_str})
+            user_cache[uid_str] = user_doc or {}
+        r["_user"] = user_cache.get(uid_str, {})
+    return records
+
+
+def _measure(fn):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def run_benchmark(db, n_records, n_users, batch_size, seed=0):
+    users, records = make_synthetic(n_records, n_users, seed)
+    db["users"].drop()
+    db["datas"].drop()
+    db["users"].insert_many(users)
+    db["datas"].insert_many(records)
+    query = {"createdAt": {"$gte": datetime(2026, 1, 1)}}
+
+    legacy_users = CountingCollection(db["users"])
+    legacy_df, legacy_s, legacy_peak = _measure(
+        lambda: build_dataframe(legacy_fetch(db["datas"], legacy_users, query), "auto"))
+
+    stream_users = CountingCollection(db["users"])
+    stream_df, stream_s, stream_peak = _measure(
+        lambda: build_dataframe(iter_records(db["datas"], stream_users, query, batch_size), "auto"))
+
+    legacy_df.reset_index(drop=True).equals(stream_df.reset_index(drop=True)) or sys.exit(
+        "❌ Streaming extractor không cho cùng DataFrame với extractor cũ")
+
+    return {
+        "records": n_records,
+        "users": n_users,
+        "batch_size": batch_size,
+        "rows": len(stream_df),
+        "legacy_s": round(legacy_s, 3),
+        "stream_s": round(stream_s, 3),
+        "legacy_user_queries": legacy_users.queries,
+        "stream_user_queries": stream_users.queries,
+        "legacy_peak_mb": round(legacy_peak / 2**20, 2),
+        "stream_peak_mb": round(stream_peak / 2**20, 2),
+        "identical": True,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark history extraction: legacy vs streaming")
+    parser.add_argument("--uri", default=None, help="MongoDB URI (mặc định: mongomock)")
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--json", action="store_true", help="Chỉ in kết quả JSON")
+    args = parser.parse_args()
+
+    if args.uri:
+        from pymongo import MongoClient
+        client = MongoClient(args.uri)
+    else:
+        try:
+            import mongomock
+        except ImportError:
+            print("❌ Cần mongomock (pip install mongomock) hoặc --uri tới một mongod local")
+            sys.exit(1)
+        client = mongomock.MongoClient()
+
+    try:
+        result = run_benchmark(client[BENCH_DB], args.records, args.users, args.batch_size)
+    finally:
+        client.drop_database(BENCH_DB)
+        client.close()
+
+    if args.json:
+        print(json.dumps(result))
+        return
+
+    print(f"📦 {result['records']} records, {result['users']} users -> {result['rows']} rows (DataFrame giống hệt)")
+    print(f"   Legacy : {result['legacy_s']:.2f}s, {result['legacy_user_queries']} user queries, peak {result['legacy_peak_mb']:.1f} MB")
+    print(f"   Stream : {result['stream_s']:.2f}s, {result['stream_user_queries']} user queries, peak {result['stream_peak_mb']:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""bench_startup.py
+Đo cold start của đường chẩn đoán: từ lúc spawn interpreter tới prediction đầu tiên,
+giống chi phí mỗi lần Node.js spawn run_ai.py.
+
+Mỗi run spawn một interpreter mới, import run_ai, load artifacts và chẩn đoán một lần đo.
+Child tự báo thời gian từng giai đoạn; parent đo tổng wall time.
+
+Usage:
+  python bench_startup.py --runs 5
+  python bench_startup.py --model heart_diagnosis_model.pkl --json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Module nặng chỉ cần cho training/plotting; không nên xuất hiện trên inference path
+HEAVY_MODULES = ["pandas", "matplotlib", "seaborn", "imblearn", "sklearn"]
+
+CHILD_SCRIPT = r"""
+import sys, time, json, io, contextlib
+t0 = time.perf_counter()
+sys.path.insert(0, {root!r})
+with contextlib.redirect_stdout(io.StringIO()):
+    import run_ai
+    t_import = time.perf_counter()
+    ai = run_ai.load_diagnosis_ai({model!r})
+    t_load = time.perf_counter()
+    result = run_ai.diagnose_with_ai(ai, 85, 45, 1, 130, 220) if ai is not None else None
+    t_predict = time.perf_counter()
+print(json.dumps({{
+    "ok": result is not None,
+    "import_ms": (t_import - t0) * 1000,
+    "load_ms": (t_load - t_import) * 1000,
+    "first_prediction_ms": (t_predict - t_load) * 1000,
+    "heavy_modules": [m for m in {heavy!r} if m in sys.modules],
+}}))
+"""
+
+
+def _spawn(code):
+    started = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+    return (time.perf_counter() - started) * 1000, proc
+
+
+def measure_startup(model_path, runs=5):
+    """Trả về median của các giai đoạn cold start qua `runs` lần spawn"""
+    interpreter_ms = statistics.median(_spawn("pass")[0] for _ in range(runs))
+
+    code = CHILD_SCRIPT.format(root=ROOT, model=model_path, heavy=HEAVY_MODULES)
+    samples = []
+    for _ in range(runs):
+        total_ms, proc = _spawn(code)
+        if proc.returncode != 0:
+            raise RuntimeError(f"Benchmark child failed: {proc.stderr.strip()}")
+        child = json.loads(proc.stdout.strip().splitlines()[-1])
+        if not child["ok"]:
+            raise RuntimeError(f"Could not load model from {model_path}")
+        child["total_ms"] = total_ms
+        samples.append(child)
+
+    def median(key):
+        return round(statistics.median(s[key] for s in samples), 2)
+
+    return {
+        "runs": runs,
+        "model_path": model_path,
+        "interpreter_ms": round(interpreter_ms, 2),
+        "import_ms": median("import_ms"),
+        "load_ms": median("load_ms"),
+        "first_prediction_ms": median("first_prediction_ms"),
+        "interpreter_to_first_prediction_ms": median("total_ms"),
+        "heavy_modules_loaded": samples[-1]["heavy_modules"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start benchmark for the diagnosis inference path")
+    parser.add_argument("--model", default="heart_diagnosis_model.pkl")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="Chỉ in kết quả JSON")
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(ROOT, args.model)):
+        print(f"❌ Model file không tồn tại: {args.model} (chạy python ai_heart_diagnosis.py trước)")
+        sys.exit(1)
+
+    result = measure_startup(args.model, args.runs)
+    if args.json:
+        print(json.dumps(result))
+        return
+
+    print("⏱️  Cold start (median of %d runs)" % result["runs"])
+    print(f"   Interpreter only:          {result['interpreter_ms']:.1f} ms")
+    print(f"   import run_ai:             {result['import_ms']:.1f} ms")
+    print(f"   Load artifacts:            {result['load_ms']:.1f} ms")
+    print(f"   First prediction:          {result['first_prediction_ms']:.1f} ms")
+    print(f"   Spawn -> first prediction: {result['interpreter_to_first_prediction_ms']:.1f} ms")
+    print(f"   Heavy modules loaded:      {', '.join(result['heavy_modules_loaded']) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
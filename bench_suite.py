@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+"""bench_suite.py
+Benchmark suite cho cả hai model (diagnosis: heart_diagnosis_model.pkl, history: heart_model/history_model.pkl)
+và các CLI entry point Node.js spawn. Kết quả dạng JSON để so sánh giữa các lần chạy.
+
+Các phần (chọn bằng --only / --skip):
+  cold_start : spawn `run_ai.py` và `predict_history_model.py` như Node.js (wall time tới khi process
+               thoát, trong thư mục tạm để không ghi đè ai_result.json), kèm breakdown của bench_startup.py
+  load       : thời gian load artifact + RSS trước / sau load / sau prediction đầu tiên (process riêng)
+  latency    : latency warm của HeartDiagnosisAI.predict_heart_rate_risk (không cache) và history predict_rows
+  throughput : predict_batch / predict_rows với batch 1, 100, 10000 (rows/s)
+  training   : wall time của train_models trên heart.csv (không ghi model)
+
+Usage:
+  python bench_suite.py --output bench_results.json
+  python bench_suite.py --skip training --baseline bench_results.json --tolerance 15
+  python bench_suite.py --only latency,throughput --json
+
+Với --baseline, metric chậm hơn baseline quá --tolerance % được in ra và exit code = 1.
+Metric *_per_s càng cao càng tốt; các metric thời gian (*_ms, *_s) và RSS (*_mb) càng thấp càng tốt.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import contextlib
+import subprocess
+
+import numpy as np
+
+from bench_startup import measure_startup
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SECTIONS = ("cold_start", "load", "latency", "throughput", "training")
+BATCH_SIZES = (1, 100, 10000)
+SUITE_VERSION = 1
+
+DIAGNOSIS_MODEL = "heart_diagnosis_model.pkl"
+HISTORY_MODEL = os.path.join("heart_model", "history_model.pkl")
+
+LOAD_CHILD = r"""
+import sys, time, json, io, contextlib
+sys.path.insert(0, {root!r})
+
+def rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+kind, path = {kind!r}, {path!r}
+with contextlib.redirect_stdout(io.StringIO()):
+    if kind == 'diagnosis':
+        from ai_heart_diagnosis import HeartDiagnosisAI
+        from run_ai import _build_feature_vector
+        base = rss_mb()
+        t0 = time.perf_counter()
+        ai = HeartDiagnosisAI().load_model(path)
+        t1 = time.perf_counter()
+        loaded = rss_mb()
+        ai.predict_heart_rate_risk(_build_feature_vector(85, 45, 1, 130, 220))
+    else:
+        import predict_history_model as phm
+        base = rss_mb()
+        t0 = time.perf_counter()
+        bundle, meta = phm.read_artifacts(path, phm.os.path.join(phm.os.path.dirname(path), 'history_features.json'))
+        t1 = time.perf_counter()
+        loaded = rss_mb()
+        phm.predict_rows(bundle, meta, [phm.row_args({{'heartRate': 78}})])
+    t2 = time.perf_counter()
+print(json.dumps({{
+    "load_ms": (t1 - t0) * 1000,
+    "first_prediction_ms": (t2 - t1) * 1000,
+    "rss_base_mb": base,
+    "rss_loaded_mb": loaded,
+    "rss_after_prediction_mb": rss_mb(),
+}}))
+"""
+
+
+# ------------------------------- Helpers -------------------------------------
+
+
+def _percentiles(samples_ms):
+    samples = np.asarray(samples_ms)
+    return {
+        "p50_ms": round(float(np.percentile(samples, 50)), 4),
+        "p90_ms": round(float(np.percentile(samples, 90)), 4),
+        "p99_ms": round(float(np.percentile(samples, 99)), 4),
+        "mean_ms": round(float(samples.mean()), 4),
+    }
+
+
+def _run(cmd, cwd, stdin=None):
+    started = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=cwd, input=stdin, capture_output=True, text=True)
+    elapsed = (time.perf_counter() - started) * 1000
+    if proc.returncode != 0:
+        raise RuntimeError(f"{' '.join(cmd)} failed: {(proc.stderr or proc.stdout).strip()[-500:]}")
+    return elapsed
+
+
+def _time_repeated(fn, min_seconds=0.2, min_repeats=3):
+    """Median ms của fn() qua ít nhất min_repeats lần và min_seconds giây"""
+    fn()  # warm-up
+    timings, started = [], time.perf_counter()
+    while len(timings) < min_repeats or time.perf_counter() - started < min_seconds:
+        t0 = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(timings)
+
+
+def diagnosis_workload(n, seed=42):
+    """Các lần đo như Node.js gửi (heart rate, tuổi ngẫu nhiên), qua _build_feature_vector của run_ai"""
+    from run_ai import _build_feature_vector
+
+    rng = np.random.default_rng(seed)
+    heart_rates = rng.integers(40, 180, n)
+    ages = rng.integers(20, 85, n)
+    sexes = rng.integers(0, 2, n)
+    return [_build_feature_vector(float(hr), float(age), int(sex), 120, 200)
+            for hr, age, sex in zip(heart_rates, ages, sexes)]
+
+
+def history_workload(n, seed=42):
+    from predict_history_model import row_args
+
+    rng = np.random.default_rng(seed)
+    genders = np.array(["male", "female", "other"])
+    return [row_args({
+        "heartRate": float(hr), "age": float(age), "gender": str(gender),
+        "hour": int(hour), "conditions": "hypertension" if cond else "",
+    }) for hr, age, gender, hour, cond in zip(
+        rng.integers(40, 180, n), rng.integers(20, 85, n), rng.choice(genders, n),
+        rng.integers(0, 24, n), rng.random(n) < 0.3)]
+
+
+def load_diagnosis_model(path):
+    from ai_heart_diagnosis import HeartDiagnosisAI
+
+    ai = HeartDiagnosisAI().load_model(path)
+    ai.prediction_cache = None  # đo model thật, không đo cache
+    return ai
+
+
+def load_history_model(path):
+    import predict_history_model as phm
+
+    bundle, meta = phm.read_artifacts(path, os.path.join(os.path.dirname(path), "history_features.json"))
+    return bundle, meta, phm.FeaturePlan(meta)
+
+# ------------------------------- Sections ------------------------------------
+
+
+def bench_cold_start(cfg):
+    """Wall time spawn -> exit của CLI, trong thư mục tạm trỏ (symlink) tới artifacts"""
+    interpreter_ms = statistics.median(_run([sys.executable, "-c", "pass"], ROOT) for _ in range(cfg.runs))
+    out = {"interpreter_ms": round(interpreter_ms, 2)}
+
+    scratch = tempfile.mkdtemp(prefix="bench_suite_")
+    try:
+        if cfg.diagnosis_model:
+            os.symlink(cfg.diagnosis_model, os.path.join(scratch, DIAGNOSIS_MODEL))
+            cmd = [sys.executable, os.path.join(ROOT, "run_ai.py"), "85", "45", "1", "130", "220"]
+            out["run_ai_cli_ms"] = round(statistics.median(_run(cmd, scratch) for _ in range(cfg.runs)), 2)
+            stages = measure_startup(cfg.diagnosis_model, cfg.runs)
+            out["run_ai_stages"] = {k: stages[k] for k in (
+                "import_ms", "load_ms", "first_prediction_ms", "heavy_modules_loaded")}
+        if cfg.history_model:
+            os.symlink(os.path.dirname(cfg.history_model), os.path.join(scratch, "heart_model"))
+            script = os.path.join(ROOT, "predict_history_model.py")
+            cmd = [sys.executable, script, "--heartRate", "78", "--age", "55", "--gender", "female"]
+            out["predict_history_cli_ms"] = round(statistics.median(_run(cmd, scratch) for _ in range(cfg.runs)), 2)
+            rows = "\n".join(json.dumps({"heartRate": 60 + i % 80}) for i in range(100))
+            cmd = [sys.executable, script, "--batch", "-"]
+            out["predict_history_cli_batch100_ms"] = round(
+                statistics.median(_run(cmd, scratch, rows) for _ in range(cfg.runs)), 2)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return out
+
+
+def bench_load(cfg):
+    """Load artifact trong process mới: thời gian load và RSS (MB) trước / sau"""
+    artifacts = []
+    if cfg.diagnosis_model:
+        artifacts.append(("diagnosis", cfg.diagnosis_model))
+        npz = os.path.splitext(cfg.diagnosis_model)[0] + ".npz"
+        if os.path.exists(npz):
+            artifacts.append(("diagnosis_npz", npz))
+    if cfg.history_model:
+        artifacts.append(("history", cfg.history_model))
+
+    out = {}
+    for name, path in artifacts:
+        code = LOAD_CHILD.format(root=ROOT, kind=name.split("_")[0], path=path)
+        samples = []
+        for _ in range(cfg.runs):
+            proc = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+            if proc.returncode != 0:
+                raise RuntimeError(f"Load benchmark for {path} failed: {proc.stderr.strip()[-500:]}")
+            samples.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+        def median(key):
+            return round(statistics.median(s[key] for s in samples), 2)
+
+        out[name] = {
+            "path": os.path.relpath(path, ROOT),
+            "size_mb": round(os.path.getsize(path) / 1e6, 2),
+            "load_ms": median("load_ms"),
+            "first_prediction_ms": median("first_prediction_ms"),
+            "rss_loaded_delta_mb": round(median("rss_loaded_mb") - median("rss_base_mb"), 2),
+            "rss_after_prediction_mb": median("rss_after_prediction_mb"),
+        }
+    return out
+
+
+def bench_latency(cfg):
+    """Latency warm một prediction (model đã load, cache tắt)"""
+    out = {}
+    if cfg.diagnosis_model:
+        ai = load_diagnosis_model(cfg.diagnosis_model)
+        workload = diagnosis_workload(cfg.requests)
+        for features in workload[:50]:
+            ai.predict_heart_rate_risk(features)
+        timings = []
+        for features in workload:
+            started = time.perf_counter()
+            ai.predict_heart_rate_risk(features)
+            timings.append((time.perf_counter() - started) * 1000)
+        out["predict_heart_rate_risk"] = {"requests": len(timings), **_percentiles(timings)}
+
+    if cfg.history_model:
+        from predict_history_model import predict_rows
+
+        bundle, meta, plan = load_history_model(cfg.history_model)
+        rows = history_workload(cfg.requests)
+        for row in rows[:50]:
+            predict_rows(bundle, meta, [row], plan)
+        timings = []
+        for row in rows:
+            started = time.perf_counter()
+            predict_rows(bundle, meta, [row], plan)
+            timings.append((time.perf_counter() - started) * 1000)
+        out["history_predict_rows"] = {"requests": len(timings), **_percentiles(timings)}
+    return out
+
+
+def bench_throughput(cfg):
+    """Một lần gọi batch với mỗi kích thước: ms / batch (median) và rows/s"""
+    out = {}
+    if cfg.diagnosis_model:
+        ai = load_diagnosis_model(cfg.diagnosis_model)
+        workload = diagnosis_workload(max(cfg.batch_sizes))
+        out["predict_batch"] = {}
+        for size in cfg.batch_sizes:
+            batch = workload[:size]
+            ms = _time_repeated(lambda: ai.predict_batch(batch))
+            out["predict_batch"][str(size)] = {"batch_ms": round(ms, 4), "rows_per_s": round(size / ms * 1000, 1)}
+
+    if cfg.history_model:
+        from predict_history_model import predict_rows
+
+        bundle, meta, plan = load_history_model(cfg.history_model)
+        workload = history_workload(max(cfg.batch_sizes))
+        out["history_predict_rows"] = {}
+        for size in cfg.batch_sizes:
+            batch = workload[:size]
+            ms = _time_repeated(lambda: predict_rows(bundle, meta, batch, plan))
+            out["history_predict_rows"][str(size)] = {"batch_ms": round(ms, 4), "rows_per_s": round(size / ms * 1000, 1)}
+    return out
+
+
+def bench_training(cfg):
+    """train_models trên heart.csv như ai_heart_diagnosis.py main() (không save model)"""
+    from ai_heart_diagnosis import HeartDiagnosisAI
+
+    data_path = os.path.join(ROOT, "heart.csv")
+    if not os.path.exists(data_path):
+        return {"skipped": "heart.csv not found"}
+
+    ai = HeartDiagnosisAI()
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        df = ai.feature_engineering(ai.load_and_preprocess_data(data_path))
+        feature_cols = [col for col in df.columns if col not in ['target', 'severity']]
+        prepared = time.perf_counter()
+        best = ai.train_models(df[feature_cols], df['severity'], n_jobs=cfg.train_jobs)
+        finished = time.perf_counter()
+    return {
+        "rows": len(df),
+        "n_jobs": cfg.train_jobs,
+        "best_model": best,
+        "prepare_s": round(prepared - started, 3),
+        "train_models_s": round(finished - prepared, 3),
+    }
+
+
+BENCHMARKS = {
+    "cold_start": bench_cold_start,
+    "load": bench_load,
+    "latency": bench_latency,
+    "throughput": bench_throughput,
+    "training": bench_training,
+}
+
+# ------------------------------- Results -------------------------------------
+
+
+def flatten_metrics(results, prefix=""):
+    """{"latency": {"x": {"p50_ms": 1}}} -> {"latency.x.p50_ms": 1}; chỉ giữ metric so sánh được"""
+    metrics = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            metrics.update(flatten_metrics(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and key.endswith(
+                ("_ms", "_s", "_mb", "_per_s")):
+            metrics[name] = value
+    return metrics
+
+
+def higher_is_better(name):
+    return name.endswith("_per_s")
+
+
+def compare(metrics, baseline, tolerance):
+    """List (metric, baseline, current, change %) chậm hơn baseline quá tolerance %"""
+    regressions = []
+    for name, current in metrics.items():
+        old = baseline.get(name)
+        if not old:
+            continue
+        change = (current - old) / old * 100
+        worse = -change if higher_is_better(name) else change
+        if worse > tolerance:
+            regressions.append((name, old, current, round(change, 1)))
+    return regressions
+
+
+def environment():
+    import sklearn
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "sklearn": sklearn.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "git_commit": commit,
+    }
+
+
+def run_suite(cfg, sections, log=print):
+    results = {}
+    for section in sections:
+        log(f"⏱️  {section}...")
+        started = time.perf_counter()
+        results[section] = BENCHMARKS[section](cfg)
+        log(f"   done in {time.perf_counter() - started:.1f}s")
+    return {
+        "suite_version": SUITE_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": environment(),
+        "config": {
+            "sections": list(sections),
+            "runs": cfg.runs,
+            "requests": cfg.requests,
+            "batch_sizes": list(cfg.batch_sizes),
+            "train_jobs": cfg.train_jobs,
+            "diagnosis_model": cfg.diagnosis_model and os.path.relpath(cfg.diagnosis_model, ROOT),
+            "history_model": cfg.history_model and os.path.relpath(cfg.history_model, ROOT),
+        },
+        "results": results,
+        "metrics": flatten_metrics(results),
+    }
+
+
+def print_report(report):
+    print("\n📊 Results")
+    for name, value in report["metrics"].items():
+        print(f"   {name:60s} {value:>12,.3f}" if isinstance(value, float) else f"   {name:60s} {value:>12,}")
+
+
+def _resolve(path):
+    """Đường dẫn tuyệt đối nếu file tồn tại, không thì None (phần benchmark của model đó bị bỏ qua)"""
+    if not path:
+        return None
+    path = os.path.abspath(os.path.join(ROOT, path))
+    return path if os.path.exists(path) else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite for the diagnosis / history models and CLIs")
+    parser.add_argument("--model", default=DIAGNOSIS_MODEL, help="Diagnosis model (.pkl)")
+    parser.add_argument("--history-model", default=HISTORY_MODEL)
+    parser.add_argument("--only", default=None, help=f"Chỉ chạy các phần này, vd. latency,throughput ({','.join(SECTIONS)})")
+    parser.add_argument("--skip", default="", help="Bỏ qua các phần này, vd. training")
+    parser.add_argument("--runs", type=int, default=5, help="Số lần spawn cho cold_start / load")
+    parser.add_argument("--requests", type=int, default=1000, help="Số prediction đo latency")
+    parser.add_argument("--batch-sizes", default=",".join(map(str, BATCH_SIZES)))
+    parser.add_argument("--train-jobs", type=int, default=1, help="n_jobs cho train_models (1 = tái lập được)")
+    parser.add_argument("--output", default=None, help="Ghi kết quả JSON ra file")
+    parser.add_argument("--baseline", default=None, help="File JSON của lần chạy trước để so sánh")
+    parser.add_argument("--tolerance", type=float, default=10.0, help="Ngưỡng regression (%%)")
+    parser.add_argument("--json", action="store_true", help="Chỉ in kết quả JSON")
+    args = parser.parse_args()
+
+    sections = [s.strip() for s in (args.only or ",".join(SECTIONS)).split(",") if s.strip()]
+    skip = {s.strip() for s in args.skip.split(",") if s.strip()}
+    unknown = (set(sections) | skip) - set(SECTIONS)
+    if unknown:
+        parser.error(f"unknown sections: {', '.join(sorted(unknown))}")
+    sections = [s for s in sections if s not in skip]
+
+    args.batch_sizes = tuple(int(v) for v in args.batch_sizes.split(",") if v.strip())
+    args.diagnosis_model = _resolve(args.model)
+    args.history_model = _resolve(args.history_model)
+    log = (lambda *a: print(*a, file=sys.stderr)) if args.json else print
+    if not args.diagnosis_model:
+        log(f"⚠️ Không có diagnosis model ({args.model}), bỏ qua phần của model này")
+    if not args.history_model:
+        log(f"⚠️ Không có history model ({args.history_model}), bỏ qua phần của model này")
+
+    report = run_suite(args, sections, log)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        log(f"💾 Saved {args.output}")
+    if args.json:
+        print(json.dumps(report))
+    else:
+        print_report(report)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["metrics"]
+        regressions = compare(report["metrics"], baseline, args.tolerance)
+        shared = len(set(baseline) & set(report["metrics"]))
+        if regressions:
+            log(f"\n❌ {len(regressions)}/{shared} metric chậm hơn baseline quá {args.tolerance:g}%:")
+            for name, old, new, change in regressions:
+                log(f"   {name}: {old} -> {new} ({change:+.1f}%)")
+            sys.exit(1)
+        log(f"\n✅ {shared} metric trong ngưỡng {args.tolerance:g}% so với baseline")
+
+
+if __name__ == "__main__":
+    main()
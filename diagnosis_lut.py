@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""diagnosis_lut.py
+Bảng tra cứu (lookup table) kết quả model chẩn đoán trên miền input của run_ai.
+
+_build_feature_vector chỉ phụ thuộc heart rate qua 4 band (<= 50, bình thường, 120-139, >= 140),
+nên với (age, sex, trestbps, chol) trên một lưới rời rạc, mọi input có thể có của model đều
+liệt kê được. Build step chạy model một lần trên toàn bộ lưới (predict_batch theo chunk) và lưu
+severity / confidence / probabilities vào file .npz không nén; serving chỉ còn là tính index
+trong mảng (O(1)). Input ngoài lưới (vd. tuổi lẻ, huyết áp không nằm trên bước lưới) vẫn dùng model.
+
+Lưới mặc định: band (4) x age 18..100 (83) x sex 0/1 x trestbps 90..200 bước 5 (23)
+x chol 120..400 bước 10 (29) = 442,888 ô, ~10 MB.
+
+Bảng lưu sha256 của file model nguồn (meta_json.source_sha256); khi load (run_ai.load_diagnosis_ai)
+bảng bị bỏ qua nếu fingerprint không khớp model đang dùng (model đã train lại mà chưa build lại bảng).
+File .npz export bằng numpy_model.py mang fingerprint của .pkl nguồn nên dùng chung bảng.
+Bảng được ghi ra file tạm rồi os.replace: process đang mmap bảng cũ không bị ảnh hưởng, và
+ai_server.py reload khi file bảng đổi.
+
+Usage:
+  python diagnosis_lut.py --model heart_diagnosis_model.pkl            # build heart_diagnosis_model.lut.npz
+  python diagnosis_lut.py --model heart_diagnosis_model.pkl --verify   # build + so với model trên input ngẫu nhiên
+  python diagnosis_lut.py --verify-only                                 # chỉ kiểm tra bảng đã có
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import contextlib
+
+import numpy as np
+
+from ai_heart_diagnosis import RISK_LEVELS
+
+DEFAULT_AGES = tuple(range(18, 101))
+DEFAULT_SEXES = (0, 1)
+DEFAULT_TRESTBPS = tuple(range(90, 201, 5))
+DEFAULT_CHOL = tuple(range(120, 401, 10))
+# Một heart rate đại diện cho mỗi band của _build_feature_vector
+BAND_HEART_RATES = (45.0, 80.0, 130.0, 150.0)
+
+BUILD_CHUNK_ROWS = 50000
+
+
+def lut_path_for(model_path):
+    """heart_diagnosis_model.pkl / .npz -> heart_diagnosis_model.lut.npz"""
+    return os.path.splitext(model_path)[0] + '.lut.npz'
+
+
+def model_fingerprint(model_path):
+    """sha256 của model; .npz export bởi numpy_model.py trả về fingerprint của .pkl nguồn"""
+    from numpy_model import _mmap_npz, file_sha256
+
+    if model_path.endswith('.npz'):
+        source = json.loads(str(_mmap_npz(model_path)['meta_json'])).get('source_sha256')
+        if source:
+            return source
+    return file_sha256(model_path)
+
+
+def heart_rate_band(heart_rate):
+    """Index band theo đúng thứ tự điều kiện trong _build_feature_vector"""
+    if heart_rate >= 140:
+        return 3
+    if heart_rate >= 120:
+        return 2
+    if heart_rate <= 50:
+        return 0
+    return 1
+
+
+def normalize_inputs(age, sex, trestbps, chol):
+    """Giá trị mặc định giống _build_feature_vector"""
+    return float(age or 50), int(1 if sex is None else sex), float(trestbps or 120), float(chol or 200)
+
+
+class DiagnosisLUT:
+    def __init__(self, arrays):
+        # np.asarray: view ndarray thường trên memmap, index một phần tử nhanh hơn qua subclass memmap
+        self.severity = np.asarray(arrays['severity'])
+        self.confidence_centi = np.asarray(arrays['confidence_centi'])
+        self.probabilities = np.asarray(arrays['probabilities'])
+        self.meta = json.loads(str(arrays['meta_json']))
+        axes = [arrays['band_heart_rates'], arrays['ages'], arrays['sexes'], arrays['trestbps'], arrays['chol']]
+        self.axes = [np.asarray(axis, dtype=float) for axis in axes]
+        self.shape = tuple(len(axis) for axis in self.axes)
+        self.strides = tuple(int(np.prod(self.shape[i + 1:])) for i in range(len(self.shape)))
+        # value -> index cho từng trục (trừ band, tính bằng heart_rate_band)
+        self._age_index = {float(v): i for i, v in enumerate(self.axes[1])}
+        self._sex_index = {int(v): i for i, v in enumerate(self.axes[2])}
+        self._trestbps_index = {float(v): i for i, v in enumerate(self.axes[3])}
+        self._chol_index = {float(v): i for i, v in enumerate(self.axes[4])}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.severity)
+
+    def cell_index(self, heart_rate, age, sex, trestbps, chol):
+        """Index phẳng của ô chứa input, None nếu input nằm ngoài lưới"""
+        age, sex, trestbps, chol = normalize_inputs(age, sex, trestbps, chol)
+        i_age = self._age_index.get(age)
+        i_sex = self._sex_index.get(sex)
+        i_bp = self._trestbps_index.get(trestbps)
+        i_chol = self._chol_index.get(chol)
+        if i_age is None or i_sex is None or i_bp is None or i_chol is None:
+            return None
+        s = self.strides
+        return heart_rate_band(heart_rate) * s[0] + i_age * s[1] + i_sex * s[2] + i_bp * s[3] + i_chol
+
+    def prediction(self, index):
+        """Cùng dạng dict với HeartDiagnosisAI.predict_heart_rate_risk (probabilities là float32)"""
+        severity = int(self.severity[index])
+        return {
+            'severity': severity,
+            'confidence': int(self.confidence_centi[index]) / 100,
+            'probabilities': self.probabilities[index].tolist(),
+            'risk_level': str(RISK_LEVELS[severity]) if 0 <= severity < len(RISK_LEVELS) else 'unknown',
+        }
+
+    def lookup(self, heart_rate, age, sex, trestbps, chol):
+        """Prediction từ bảng, hoặc None nếu input ngoài lưới (caller dùng model)"""
+        index = self.cell_index(heart_rate, age, sex, trestbps, chol)
+        if index is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.prediction(index)
+
+    def cell_inputs(self, index):
+        """(heart_rate, age, sex, trestbps, chol) đại diện của một ô"""
+        coords = np.unravel_index(index, self.shape)
+        hr, age, sex, bp, chol = (float(axis[i]) for axis, i in zip(self.axes, coords))
+        return hr, age, int(sex), bp, chol
+
+    def matches(self, fingerprint):
+        """Bảng được build từ model có fingerprint này (model_fingerprint)"""
+        return fingerprint is not None and self.meta.get('source_sha256') == fingerprint
+
+    def stats(self):
+        return {'cells': len(self), 'hits': self.hits, 'misses': self.misses,
+                'source_model': self.meta.get('source_model'), 'source_sha256': self.meta.get('source_sha256'),
+                'built_at': self.meta.get('built_at')}
+
+
+def _to_centi(confidence):
+    """confidence (%, đã round 2 chữ số) -> uint16 phần trăm x 100, tái tạo chính xác bằng / 100"""
+    return np.rint(np.asarray(confidence, dtype=float) * 100).astype(np.uint16)
+
+
+def _predict_cells(ai, inputs):
+    from run_ai import _build_feature_vector
+
+    return ai.predict_batch([_build_feature_vector(*cell) for cell in inputs])
+
+
+def build_lookup_table(ai, path, ages=DEFAULT_AGES, sexes=DEFAULT_SEXES, trestbps=DEFAULT_TRESTBPS,
+                       chol=DEFAULT_CHOL, source_model=None, source_sha256=None):
+    """Chạy model của `ai` trên toàn bộ lưới và ghi bảng ra `path` (.npz không nén).
+
+    source_sha256: model_fingerprint của file model đã load vào `ai`; thiếu thì bảng không bao giờ được dùng.
+    """
+    axes = [BAND_HEART_RATES, ages, sexes, trestbps, chol]
+    n_cells = int(np.prod([len(axis) for axis in axes]))
+    n_classes = len(ai.best_model.classes_)
+    severity = np.empty(n_cells, dtype=np.int8)
+    confidence = np.empty(n_cells, dtype=np.uint16)
+    probabilities = np.empty((n_cells, n_classes), dtype=np.float32)
+
+    # itertools.product duyệt theo thứ tự C, khớp index phẳng của DiagnosisLUT.cell_index
+    cells = itertools.product(*axes)
+    for start in range(0, n_cells, BUILD_CHUNK_ROWS):
+        chunk = list(itertools.islice(cells, BUILD_CHUNK_ROWS))
+        batch = _predict_cells(ai, chunk)
+        stop = start + len(chunk)
+        severity[start:stop] = batch['severity']
+        confidence[start:stop] = _to_centi(batch['confidence'])
+        probabilities[start:stop] = batch['probabilities']
+
+    meta = {
+        'source_model': source_model,
+        'source_sha256': source_sha256,
+        'model_type': type(ai.best_model).__name__,
+        'built_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'cells': n_cells,
+    }
+    # Ghi ra file tạm rồi rename: server đang mmap bảng cũ không bị truncate dưới chân (SIGBUS)
+    with open(path + '.tmp', 'wb') as f:
+        np.savez(f, severity=severity, confidence_centi=confidence, probabilities=probabilities,
+                 band_heart_rates=np.asarray(BAND_HEART_RATES, dtype=float), ages=np.asarray(ages, dtype=float),
+                 sexes=np.asarray(sexes, dtype=float), trestbps=np.asarray(trestbps, dtype=float),
+                 chol=np.asarray(chol, dtype=float), meta_json=np.array(json.dumps(meta)))
+    os.replace(path + '.tmp', path)
+    return n_cells
+
+
+def load_lookup_table(path):
+    from numpy_model import _mmap_npz
+
+    return DiagnosisLUT(_mmap_npz(path))
+
+
+def load_lut_for(ai, model_path):
+    """Bảng của model_path nếu có và được build từ chính file model đó, không thì None"""
+    path = lut_path_for(model_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        lut = load_lookup_table(path)
+        fingerprint = model_fingerprint(model_path)
+    except Exception as exc:
+        print(f"⚠️ Không đọc được lookup table {path}: {exc}")
+        return None
+    if not lut.matches(fingerprint):
+        print(f"⚠️ Lookup table {path} không khớp model hiện tại (chạy lại diagnosis_lut.py), dùng model")
+        return None
+    print(f"📋 Lookup table: {len(lut)} ô từ {path}")
+    return lut
+
+# ------------------------------- Verify -------------------------------------
+
+
+def random_grid_inputs(lut, n, seed=42):
+    """Input trên lưới với heart rate thật (30..200 bpm), dạng Node.js gửi"""
+    rng = np.random.default_rng(seed)
+    return [(float(rng.integers(30, 201)), float(rng.choice(lut.axes[1])), int(rng.choice(lut.axes[2])),
+             float(rng.choice(lut.axes[3])), float(rng.choice(lut.axes[4]))) for _ in range(n)]
+
+
+def verify_fidelity(lut, ai, n=5000, seed=42):
+    """So bảng với predict_heart_rate_risk (model thật, không cache) trên n input ngẫu nhiên"""
+    from run_ai import _build_feature_vector
+
+    cache, ai.prediction_cache = ai.prediction_cache, None
+    inputs = random_grid_inputs(lut, n, seed)
+    severity_mismatch = confidence_mismatch = 0
+    max_prob_diff = 0.0
+    lookup_s = model_s = 0.0
+    try:
+        for reading in inputs:
+            started = time.perf_counter()
+            got = lut.lookup(*reading)
+            lookup_s += time.perf_counter() - started
+            started = time.perf_counter()
+            expected = ai.predict_heart_rate_risk(_build_feature_vector(*reading))
+            model_s += time.perf_counter() - started
+            severity_mismatch += got['severity'] != expected['severity']
+            confidence_mismatch += got['confidence'] != expected['confidence']
+            max_prob_diff = max(max_prob_diff, float(np.abs(np.subtract(got['probabilities'],
+                                                                        expected['probabilities'])).max()))
+    finally:
+        ai.prediction_cache = cache
+    return {
+        'rows': n,
+        'severity_mismatch': int(severity_mismatch),
+        'confidence_mismatch': int(confidence_mismatch),
+        'max_prob_diff': max_prob_diff,
+        'lookup_us': round(lookup_s / n * 1e6, 2),
+        'model_us': round(model_s / n * 1e6, 2),
+        'ok': severity_mismatch == 0 and confidence_mismatch == 0,
+    }
+
+
+def main():
+    from run_ai import MODEL_PATH, load_diagnosis_ai
+
+    parser = argparse.ArgumentParser(description="Precompute a lookup table of diagnosis model outputs over the run_ai input grid")
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--output', default=None, help='Mặc định: <model>.lut.npz')
+    parser.add_argument('--verify', action='store_true', help='So bảng với model sau khi build')
+    parser.add_argument('--verify-only', action='store_true', help='Không build, chỉ kiểm tra bảng đã có')
+    parser.add_argument('--samples', type=int, default=5000, help='Số input ngẫu nhiên cho --verify')
+    args = parser.parse_args()
+
+    # Fingerprint trước khi load: nếu model bị thay giữa chừng thì bảng bị coi là cũ, không sai
+    fingerprint = model_fingerprint(args.model) if os.path.exists(args.model) else None
+    with contextlib.redirect_stdout(sys.stderr):
+        ai = load_diagnosis_ai(args.model, use_lut=False)
+    if ai is None:
+        sys.exit(1)
+    output = args.output or lut_path_for(args.model)
+
+    if not args.verify_only:
+        started = time.perf_counter()
+        n_cells = build_lookup_table(ai, output, source_model=os.path.basename(args.model),
+                                     source_sha256=fingerprint)
+        print(f"💾 {n_cells:,} ô -> {output} ({os.path.getsize(output) / 1e6:.1f} MB) "
+              f"trong {time.perf_counter() - started:.1f}s")
+
+    if args.verify or args.verify_only:
+        report = verify_fidelity(load_lookup_table(output), ai, args.samples)
+        print(f"🔍 Fidelity: rows={report['rows']} severity_mismatch={report['severity_mismatch']} "
+              f"confidence_mismatch={report['confidence_mismatch']} max_prob_diff={report['max_prob_diff']:.2e}")
+        print(f"⏱️ lookup {report['lookup_us']:.1f} µs vs model {report['model_us']:.1f} µs mỗi input")
+        if not report['ok']:
+            print("❌ Lookup table lệch so với model")
+            sys.exit(1)
+        print("✅ Lookup table khớp model")
+
+
+if __name__ == '__main__':
+    main()
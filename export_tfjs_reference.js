@@ -0,0 +1,45 @@
+// export_tfjs_reference.js
+// Ghi output của TF.js cho một dải heart rate vào heart_model/reference_outputs.json,
+// để tfjs_model.py --verify đối chiếu evaluator NumPy với TF.js.
+// Chạy lại mỗi khi train.js ghi model mới: node export_tfjs_reference.js
+import * as tf from '@tensorflow/tfjs-node';
+import fs from 'fs';
+import path from 'path';
+import { fileURLToPath } from 'url';
+
+const __filename = fileURLToPath(import.meta.url);
+const __dirname = path.dirname(__filename);
+
+const modelDir = path.join(__dirname, 'heart_model');
+const normPath = path.join(__dirname, 'normalization.json');
+
+// Cùng chuẩn hoá với normalizeInput() trong src/services/ai.service.js
+const normalize = (value, norm) => {
+    if (!norm || !Array.isArray(norm.mean) || !Array.isArray(norm.std)) return value;
+    return (value - norm.mean[0]) / (norm.std[0] || 1.0);
+};
+
+const exportReference = async () => {
+    const model = await tf.loadLayersModel('file://' + path.join(modelDir, 'model.json'));
+    const norm = fs.existsSync(normPath) ? JSON.parse(fs.readFileSync(normPath, 'utf8')) : null;
+
+    // 0 -> 300 bpm (giới hạn của DataSchema) bước 0.5, cộng vài giá trị ngoài dải
+    const inputs = [-50, 1000];
+    for (let hr = 0; hr <= 300; hr += 0.5) inputs.push(hr);
+
+    const xs = tf.tensor2d(inputs.map((hr) => [normalize(hr, norm)]));
+    const outputs = await model.predict(xs).array();
+
+    const outPath = path.join(modelDir, 'reference_outputs.json');
+    fs.writeFileSync(outPath, JSON.stringify({
+        generatedBy: `tfjs ${tf.version.tfjs}`,
+        inputs,
+        outputs,
+    }));
+    console.log(`Wrote ${inputs.length} reference outputs to ${outPath}`);
+};
+
+exportReference().catch((err) => {
+    console.error(err);
+    process.exit(1);
+});
@@ -0,0 +1,325 @@
+"""history_feature_store.py
+Feature store cục bộ cho train_history_model: cột thô của mỗi record được lưu thành các
+shard NumPy (.npy) chia theo ngày createdAt và đọc lại bằng memory-map, nên train lại
+trên cùng window là đọc file thay vì scan MongoDB.
+
+Layout:
+  <root>/manifest.json                   khoảng createdAt đã sync, vocab, số row mỗi ngày
+  <root>/day=YYYY-MM-DD/<column>.npy     heartRate, age, weight : float64 (NaN = thiếu)
+                                         gender, severity, status,
+                                         deviceId                : int32 code trong vocab (-1 = None)
+                                         createdAt, timestamp    : int64 (ns, timestamp NaT = thiếu)
+                                         condset                 : int32, bộ conditions của row
+                                         condset_ptr, condset_val: long table các bộ conditions
+
+Store chỉ giữ cột thô. Label (--label-source), median fill, top-k conditions... được tính
+khi đọc (train_history_model.frame_from_raw / encode_features) vì phụ thuộc window và
+tham số train. Chỉ record có createdAt mới được lưu (window luôn lọc theo createdAt).
+
+Sync: store đầy đủ cho mọi record có createdAt trong [synced_from, synced_until]; mỗi lần
+sync lấy từ MongoDB record mới hơn synced_until và phần window cũ hơn synced_from.
+
+Giới hạn: store là snapshot tại lúc sync. Field có thể đổi trong MongoDB sau đó - severity
+(aiDiagnosis.severity, label mặc định, bị ghi lại bởi rescore_history.py), status, profile user
+join vào (age, weight, gender, conditions) - và record đến muộn với createdAt <= synced_until
+(createdAt do client gửi, vd. arduino.controller.js) không được sync tăng dần nhìn thấy.
+refresh_days (train_history_model.py --refresh-days N, mặc định 1) đọc lại toàn bộ N ngày cuối
+tính đến synced_until và thay hẳn các shard đó; sau khi rescore hoặc sửa profile trên dữ liệu
+cũ hơn, chạy với --refresh-days đủ lớn hoặc xoá thư mục store để build lại.
+
+Xem nhanh nội dung store:
+  python history_feature_store.py heart_model/feature_store
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_STORE_DIR = os.path.join("heart_model", "feature_store")
+
+RAW_COLUMNS = ["heartRate", "age", "gender", "weight", "conditions", "severity", "status", "createdAt",
+               "deviceId", "timestamp"]
+NUMERIC_COLUMNS = ["heartRate", "age", "weight"]
+CODED_COLUMNS = ["gender", "severity", "status", "deviceId"]
+NAT = np.iinfo(np.int64).min  # datetime64[ns] NaT
+
+
+def _encode(values: pd.Series, vocab: list):
+    """Giá trị (str hoặc None) -> int32 code trong vocab; vocab chỉ được append"""
+    index = {v: i for i, v in enumerate(vocab)}
+    present = values.notna()
+    for value in pd.unique(values[present].astype(str)):
+        if value not in index:
+            index[value] = len(vocab)
+            vocab.append(value)
+    codes = np.full(len(values), -1, dtype=np.int32)
+    codes[present.to_numpy()] = values[present].astype(str).map(index).to_numpy(dtype=np.int32)
+    return codes
+
+
+def _decode(codes: np.ndarray, vocab: list):
+    lookup = np.array(list(vocab) + [None], dtype=object)  # code -1 -> None
+    return lookup[codes]
+
+
+class FeatureStore:
+    def __init__(self, root=DEFAULT_STORE_DIR):
+        self.root = root
+        self.manifest_path = os.path.join(root, "manifest.json")
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self):
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        else:
+            manifest = {"days": {}, "vocab": {}}
+        # Store tạo trước khi có deviceId/timestamp: thêm vocab rỗng
+        for name in CODED_COLUMNS + ["conditions"]:
+            manifest["vocab"].setdefault(name, [])
+        return manifest
+
+    def _save_manifest(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.manifest_path)
+
+    # ------------------------------------------------------------- sync range
+
+    @property
+    def synced(self):
+        return "synced_from" in self.manifest
+
+    def _get_time(self, key):
+        value = self.manifest.get(key)
+        return datetime.fromisoformat(value) if value else None
+
+    def sync(self, fetch_raw, start: datetime | None = None, refresh_days: int = 0):
+        """Lấy từ MongoDB phần còn thiếu để store phủ [start, mới nhất].
+
+        fetch_raw(query) -> DataFrame RAW_COLUMNS (vd. train_history_model.fetch_raw).
+        refresh_days > 0: đọc lại các ngày (theo createdAt) từ synced_until - refresh_days và thay
+        shard của chúng, để nhận label / profile đã đổi và record đến muộn trong khoảng đó.
+        Trả về số record đã ghi.
+        """
+        written = 0
+        if not self.synced:
+            query = {"createdAt": {"$gte": start}} if start else {"createdAt": {"$ne": None}}
+            written += self.write(fetch_raw(query))
+            self.manifest["synced_from"] = start.isoformat() if start else None
+        else:
+            synced_from = self._get_time("synced_from")
+            # Backfill phần window cũ hơn những gì đã có
+            if synced_from is not None and (start is None or start < synced_from):
+                query = {"createdAt": {"$lt": synced_from}}
+                if start is not None:
+                    query["createdAt"]["$gte"] = start
+                written += self.write(fetch_raw(query))
+                self.manifest["synced_from"] = start.isoformat() if start else None
+
+            synced_until = self._get_time("synced_until")
+            if synced_until and refresh_days > 0:
+                # Từ đầu ngày: shard được thay nguyên ngày
+                refresh_from = datetime.combine((synced_until - timedelta(days=refresh_days)).date(),
+                                                datetime.min.time())
+                if synced_from is not None:
+                    refresh_from = max(refresh_from, synced_from)
+                written += self.write(fetch_raw({"createdAt": {"$gte": refresh_from}}),
+                                      replace_from=refresh_from.strftime("%Y-%m-%d"))
+            else:
+                query = {"createdAt": {"$gt": synced_until}} if synced_until else (
+                    {"createdAt": {"$gte": synced_from}} if synced_from else {"createdAt": {"$ne": None}})
+                written += self.write(fetch_raw(query))
+
+        self._save_manifest()
+        return written
+
+    # ------------------------------------------------------------------ write
+
+    def write(self, raw: pd.DataFrame, replace_from: str | None = None):
+        """Ghi cột thô vào shard theo ngày (gộp với shard đã có). Trả về số row đã ghi.
+
+        replace_from ("YYYY-MM-DD"): raw là toàn bộ record từ ngày đó; shard của các ngày này được
+        thay thế thay vì gộp, ngày không còn record nào bị xoá.
+        """
+        created = pd.to_datetime(raw["createdAt"]) if len(raw) else pd.Series([], dtype="datetime64[ns]")
+        raw = raw[created.notna().to_numpy()].reset_index(drop=True)
+        if replace_from is not None:
+            days = set(pd.to_datetime(raw["createdAt"]).dt.strftime("%Y-%m-%d")) if len(raw) else set()
+            for day in [d for d in self.manifest["days"] if d >= replace_from and d not in days]:
+                shutil.rmtree(self._day_dir(day), ignore_errors=True)
+                del self.manifest["days"][day]
+        if raw.empty:
+            if replace_from is not None:
+                self._save_manifest()
+            return 0
+        created = pd.to_datetime(raw["createdAt"]).astype("datetime64[ns]")
+        raw = raw.assign(createdAt=created)
+
+        for day, part in raw.groupby(created.dt.strftime("%Y-%m-%d"), sort=True):
+            if day in self.manifest["days"] and (replace_from is None or day < replace_from):
+                part = pd.concat([self._read_day(day), part], ignore_index=True)
+            part = part.sort_values("createdAt", kind="stable").reset_index(drop=True)
+            self._write_day(day, part)
+            self.manifest["days"][day] = len(part)
+
+        newest = created.max().to_pydatetime()
+        synced_until = self._get_time("synced_until")
+        if synced_until is None or newest > synced_until:
+            self.manifest["synced_until"] = newest.isoformat()
+        self.manifest["days"] = dict(sorted(self.manifest["days"].items()))
+        self._save_manifest()
+        return len(raw)
+
+    def _day_dir(self, day):
+        return os.path.join(self.root, f"day={day}")
+
+    def _write_day(self, day, part: pd.DataFrame):
+        vocab = self.manifest["vocab"]
+        arrays = {col: pd.to_numeric(part[col], errors="coerce").to_numpy(dtype=np.float64) for col in NUMERIC_COLUMNS}
+        for col in CODED_COLUMNS:
+            arrays[col] = _encode(part[col], vocab[col])
+        arrays["createdAt"] = part["createdAt"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+        arrays["timestamp"] = pd.to_datetime(part["timestamp"]).to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+        # Nhiều row dùng chung một bộ conditions (cùng user): lưu mỗi bộ một lần
+        set_index, ptr, val = {}, [0], []
+        condset = np.empty(len(part), dtype=np.int32)
+        cond_index = {c: i for i, c in enumerate(vocab["conditions"])}
+        for i, conds in enumerate(part["conditions"].tolist()):
+            key = tuple(str(c) for c in conds) if isinstance(conds, (list, tuple)) else ()
+            if key not in set_index:
+                set_index[key] = len(set_index)
+                for c in key:
+                    if c not in cond_index:
+                        cond_index[c] = len(vocab["conditions"])
+                        vocab["conditions"].append(c)
+                    val.append(cond_index[c])
+                ptr.append(len(val))
+            condset[i] = set_index[key]
+        arrays["condset"] = condset
+        arrays["condset_ptr"] = np.asarray(ptr, dtype=np.int32)
+        arrays["condset_val"] = np.asarray(val, dtype=np.int32)
+
+        final = self._day_dir(day)
+        tmp, old = final + ".tmp", final + ".old"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, f"{name}.npy"), array)
+        if os.path.exists(final):
+            os.replace(final, old)
+        os.replace(tmp, final)
+        shutil.rmtree(old, ignore_errors=True)
+
+    # ------------------------------------------------------------------- read
+
+    def _load_day(self, day):
+        directory = self._day_dir(day)
+        return {name[:-4]: np.load(os.path.join(directory, name), mmap_mode="r")
+                for name in os.listdir(directory) if name.endswith(".npy")}
+
+    def _collect(self, days, mask_fn=None):
+        """Cột đã lọc của nhiều ngày, nối lại thành một DataFrame (decode vocab một lần)"""
+        columns = {name: [] for name in NUMERIC_COLUMNS + CODED_COLUMNS + ["createdAt", "timestamp", "condset"]}
+        set_ptrs, set_vals = [], []
+        n_sets = n_vals = 0
+        for day in days:
+            arrays = self._load_day(day)
+            # Shard ghi trước khi có deviceId/timestamp
+            arrays.setdefault("deviceId", np.full(len(arrays["createdAt"]), -1, dtype=np.int32))
+            arrays.setdefault("timestamp", np.full(len(arrays["createdAt"]), NAT, dtype=np.int64))
+            mask = mask_fn(arrays["createdAt"]) if mask_fn is not None else slice(None)
+            for name in columns:
+                columns[name].append(np.asarray(arrays[name][mask]))
+            # index bộ conditions là cục bộ trong shard: dịch theo số bộ của các shard trước
+            columns["condset"][-1] = columns["condset"][-1] + n_sets
+            ptr = np.asarray(arrays["condset_ptr"])
+            set_ptrs.append(ptr[:-1] + n_vals)
+            set_vals.append(np.asarray(arrays["condset_val"]))
+            n_sets += len(ptr) - 1
+            n_vals += len(set_vals[-1])
+
+        if not days:
+            return pd.DataFrame({col: pd.Series([], dtype=object) for col in RAW_COLUMNS})
+
+        merged = {name: np.concatenate(parts) for name, parts in columns.items()}
+        vals = np.concatenate(set_vals)
+        ptr = np.append(np.concatenate(set_ptrs), len(vals))
+        cond_vocab = np.array(self.manifest["vocab"]["conditions"], dtype=object)
+        # Các shard lặp lại cùng bộ conditions (cùng user): mỗi bộ khác nhau chỉ tạo list một lần
+        decoded = {}
+        sets = np.empty(n_sets, dtype=object)
+        for i in range(n_sets):
+            key = vals[ptr[i]:ptr[i + 1]].tobytes()
+            if key not in decoded:
+                decoded[key] = cond_vocab[vals[ptr[i]:ptr[i + 1]]].tolist()
+            sets[i] = decoded[key]
+
+        vocab = self.manifest["vocab"]
+        return pd.DataFrame({
+            "heartRate": merged["heartRate"],
+            "age": merged["age"],
+            "gender": _decode(merged["gender"], vocab["gender"]),
+            "weight": merged["weight"],
+            "conditions": sets[merged["condset"]],
+            "severity": _decode(merged["severity"], vocab["severity"]),
+            "status": _decode(merged["status"], vocab["status"]),
+            "createdAt": merged["createdAt"].view("datetime64[ns]"),
+            "deviceId": _decode(merged["deviceId"], vocab["deviceId"]),
+            "timestamp": merged["timestamp"].view("datetime64[ns]"),
+        }, columns=RAW_COLUMNS)
+
+    def _read_day(self, day):
+        return self._collect([day])
+
+    def read(self, start: datetime | None = None, end: datetime | None = None, after: datetime | None = None):
+        """Cột thô của mọi record có start <= createdAt <= end (và createdAt > after)"""
+        lower = max([t for t in (start, after) if t is not None], default=None)
+        days = [day for day in self.manifest["days"]
+                if (lower is None or day >= lower.strftime("%Y-%m-%d"))
+                and (end is None or day <= end.strftime("%Y-%m-%d"))]
+
+        bounds = [(start, np.greater_equal), (after, np.greater), (end, np.less_equal)]
+        bounds = [(np.datetime64(t, "ns").astype(np.int64), op) for t, op in bounds if t is not None]
+
+        def mask_fn(created):
+            mask = np.ones(len(created), dtype=bool)
+            for value, op in bounds:
+                mask &= op(created, value)
+            return mask
+
+        return self._collect(days, mask_fn if bounds else None)
+
+    def info(self):
+        return {
+            "root": self.root,
+            "synced_from": self.manifest.get("synced_from"),
+            "synced_until": self.manifest.get("synced_until"),
+            "days": len(self.manifest["days"]),
+            "rows": sum(self.manifest["days"].values()),
+            "conditions_vocab": len(self.manifest["vocab"]["conditions"]),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the history feature store contents")
+    parser.add_argument("store", nargs="?", default=DEFAULT_STORE_DIR)
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.store, "manifest.json")):
+        print(f"❌ Không có feature store tại {args.store}")
+        sys.exit(1)
+    print(json.dumps(FeatureStore(args.store).info(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
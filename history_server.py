@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# history_server.py
+"""
+Worker Python chạy lâu dài cho history model (heart_model/history_model.pkl).
+Load artifacts một lần và phục vụ các request tương đương predict_history_model.py qua
+stdin/stdout JSONL hoặc Unix socket (xem inference_worker.py cho protocol).
+Model được load lại tự động khi train_history_model.py ghi artifacts mới.
+Nếu model được train với --window-features, server giữ cửa sổ trượt theo deviceId: mỗi
+request có deviceId (và timestamp) được thêm vào chuỗi của device đó, sau các reading đã lưu
+trong collection Data (arduino/heartrate controller) mà server chưa thấy, như lúc train
+(add_window_features tính trên mọi reading đã lưu của device). Cần --uri / MONGODB_URI; không có
+thì window chỉ gồm các reading gửi tới server, thưa hơn lúc train và rỗng sau mỗi lần restart.
+
+Cách chạy:
+  python3 history_server.py                          # stdio, Node.js spawn một lần và giữ process
+  python3 history_server.py --socket /tmp/hist.sock  # Unix socket cho nhiều client
+  python3 history_server.py --uri mongodb://localhost:27017/be_project   # mặc định: MONGODB_URI
+
+Request mẫu:
+  {"id": "1", "op": "predict", "heartRate": 78, "age": 55, "gender": "female", "conditions": ["hypertension"]}
+  {"id": "2", "op": "predict", "rows": [{"heartRate": 78}, {"heartRate": 130, "hour": 23}]}
+  {"id": "3", "op": "predict", "heartRate": 96, "deviceId": "dev-1", "timestamp": "2026-01-01T08:00:00Z"}
+  {"id": "4", "op": "health"}
+"""
+
+import os
+import sys
+import time
+import argparse
+import threading
+import warnings
+from datetime import datetime, timezone
+
+from inference_worker import InferenceWorker
+from hr_window_features import WindowFeatureEngine
+from ai_heart_diagnosis import artifact_version
+from predict_history_model import ARTIFACT_MODEL, ARTIFACT_META, FeaturePlan, read_artifacts, row_args, predict_rows
+
+# Scaler khác StandardScaler vẫn qua sklearn transform: được fit với DataFrame, server truyền numpy array
+warnings.filterwarnings('ignore', message='X does not have valid feature names')
+
+# Tần suất tối đa stat() file model để phát hiện artifact mới
+RELOAD_CHECK_INTERVAL_S = 1.0
+
+MAX_DEVICE_STREAMS = 10000  # số device giữ state window features (bỏ device lâu không gửi)
+HISTORY_TIMEOUT_MS = 1000   # timeout MongoDB khi nạp reading của device, nhỏ hơn timeout request của Node
+
+WARMUP_ROWS = [{"heartRate": 72}, {"heartRate": 45, "hour": 3}, {"heartRate": 150, "gender": "male"}]
+
+
+class DataStreamHistory:
+    """Reading đã lưu trong collection Data theo deviceId (WindowFeatureEngine.history).
+
+    Mỗi lần gọi là một query trên index {deviceId, timestamp}: tối đa `limit` reading mới nhất
+    trong (after, before). Lỗi MongoDB không làm hỏng request: trả về [] và in cảnh báo một lần.
+    """
+
+    def __init__(self, uri, data_col=None):
+        self.uri = uri
+        self._data_col = data_col
+        self._lock = threading.Lock()
+        self._warned = False
+
+    def _collection(self):
+        with self._lock:
+            if self._data_col is None:
+                from train_history_model import open_collections
+                _, self._data_col, _ = open_collections(self.uri, serverSelectionTimeoutMS=HISTORY_TIMEOUT_MS,
+                                                        socketTimeoutMS=HISTORY_TIMEOUT_MS)
+            return self._data_col
+
+    def __call__(self, device_id, after, before, limit):
+        stamp = {"$lt": datetime.fromtimestamp(before, timezone.utc)}
+        if after is not None:
+            stamp["$gt"] = datetime.fromtimestamp(after, timezone.utc)
+        try:
+            cursor = (self._collection().find({"deviceId": device_id, "timestamp": stamp},
+                                              {"_id": 0, "timestamp": 1, "heartRate": 1})
+                      .sort("timestamp", -1).limit(limit))
+            readings = [(_epoch(r["timestamp"]), float(r["heartRate"]))
+                        for r in cursor if r.get("heartRate") is not None]
+        except Exception as exc:
+            if not self._warned:
+                print(f"⚠️ Không đọc được Data của device {device_id}, window chỉ từ request: {exc}", file=sys.stderr)
+                self._warned = True
+            return []
+        self._warned = False
+        return readings[::-1]
+
+
+def _epoch(value):
+    """datetime từ pymongo (naive = UTC) -> epoch giây"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class HistoryServer:
+    def __init__(self, model_path=ARTIFACT_MODEL, meta_path=ARTIFACT_META, history=None):
+        self.model_path = model_path
+        self.meta_path = meta_path
+        self.history = history  # DataStreamHistory, None = window chỉ từ request
+        self.bundle = None
+        self.meta = None
+        self.plan = None
+        self.engine = None
+        self.load_time_ms = None
+        self.reloads = 0
+        self.rows_served = 0
+        self._artifact_version = None
+        self._last_reload_check = 0.0
+        self._reload_lock = threading.Lock()
+        self.worker = InferenceWorker("history-model")
+        self.worker.register("predict", self.predict)
+        self.worker.register("health", self.health)
+
+    def load(self):
+        started = time.perf_counter()
+        version = artifact_version(self.model_path)
+        bundle, meta = read_artifacts(self.model_path, self.meta_path)
+        plan = FeaturePlan(meta)
+        predict_rows(bundle, meta, [row_args(row) for row in WARMUP_ROWS], plan)
+        engine = self.engine
+        if not plan.window_sizes:
+            engine = None
+        elif engine is None or engine.windows != plan.window_sizes:
+            engine = WindowFeatureEngine(plan.window_sizes, max_streams=MAX_DEVICE_STREAMS, history=self.history)
+            if self.history is None:
+                print("⚠️ Model có window features nhưng không có --uri/MONGODB_URI: "
+                      "window chỉ gồm reading gửi tới server", file=sys.stderr)
+        # Gán một lần để request đang chạy luôn thấy bundle/meta/plan nhất quán
+        self.bundle, self.meta, self.plan, self.engine = bundle, meta, plan, engine
+        self._artifact_version = version
+        self.load_time_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    def maybe_reload(self):
+        """Reload nếu history_model.pkl đã bị ghi đè (kiểm tra tối đa mỗi RELOAD_CHECK_INTERVAL_S)"""
+        now = time.monotonic()
+        if now - self._last_reload_check < RELOAD_CHECK_INTERVAL_S:
+            return False
+        with self._reload_lock:
+            self._last_reload_check = now
+            try:
+                version = artifact_version(self.model_path)
+            except OSError:
+                return False  # file đang được ghi lại, giữ model cũ
+            if version == self._artifact_version:
+                return False
+            try:
+                self.load()
+            except Exception as exc:
+                print(f"⚠️ Reload failed, keeping previous model: {exc}", file=sys.stderr)
+                self._artifact_version = version  # không thử lại file hỏng mỗi request
+                return False
+            self.reloads += 1
+            print(f"🔄 Reloaded {self.model_path} ({self.load_time_ms} ms)", file=sys.stderr)
+            return True
+
+    def predict(self, request):
+        """Một row (các field ở top-level) hoặc batch {"rows": [...]}"""
+        if self.bundle is None:
+            raise RuntimeError("Model is not loaded")
+        self.maybe_reload()
+        bundle, meta, plan, engine = self.bundle, self.meta, self.plan, self.engine
+
+        rows = request.get("rows")
+        if rows is None:
+            result = predict_rows(bundle, meta, [row_args(request)], plan, engine)[0]
+            self.rows_served += 1
+            return result
+        if not isinstance(rows, list) or not rows:
+            raise ValueError("rows must be a non-empty list")
+        results = predict_rows(bundle, meta, [row_args(row) for row in rows], plan, engine)
+        self.rows_served += len(results)
+        return {"predictions": results, "count": len(results)}
+
+    def health(self, request=None):
+        return {
+            **self.worker.base_health(),
+            "status": "ok" if self.bundle is not None else "loading",
+            "model_path": self.model_path,
+            "model_type": type(self.bundle["model"]).__name__ if self.bundle is not None else None,
+            "feature_count": len(self.plan.feature_names) if self.plan is not None else None,
+            "load_time_ms": self.load_time_ms,
+            "reloads": self.reloads,
+            "rows_served": self.rows_served,
+            "window_sizes": list(self.plan.window_sizes) if self.plan is not None else [],
+            "device_streams": len(self.engine.streams) if self.engine is not None else 0,
+            "window_history": self.history is not None,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Long-lived history model prediction worker")
+    parser.add_argument("--model", default=ARTIFACT_MODEL, help="Đường dẫn history_model.pkl")
+    parser.add_argument("--meta", default=ARTIFACT_META, help="Đường dẫn history_features.json")
+    parser.add_argument("--socket", default=None, help="Unix socket path (mặc định: stdin/stdout)")
+    parser.add_argument("--uri", default=os.getenv("MONGODB_URI"),
+                        help="MongoDB URI để nạp reading đã lưu của device cho window features (mặc định: MONGODB_URI)")
+    args = parser.parse_args()
+
+    server = HistoryServer(args.model, args.meta, DataStreamHistory(args.uri) if args.uri else None)
+    try:
+        server.load()
+    except Exception as exc:
+        print(f"❌ Không thể khởi động history_server: {exc}", file=sys.stderr)
+        sys.exit(1)
+
+    ready_info = {"load_time_ms": server.load_time_ms}
+    if args.socket:
+        server.worker.serve_unix(args.socket, ready_info)
+    else:
+        server.worker.serve_stdio(ready_info)
+
+
+if __name__ == "__main__":
+    main()
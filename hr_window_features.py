@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""hr_window_features.py
+Feature cửa sổ trượt cho chuỗi heart rate của từng device (collection Data, theo deviceId/timestamp).
+
+Mỗi window (đếm theo số reading, vd. 10 và 60 reading gần nhất, gồm cả reading hiện tại) cho:
+  hr_mean_w<N>, hr_std_w<N>, hr_min_w<N>, hr_max_w<N>
+  hr_rmssd_w<N> : căn trung bình bình phương các hiệu liên tiếp (kiểu HRV trên chuỗi bpm)
+  hr_slope_w<N> : hệ số góc least-squares của heart rate theo thời gian (bpm / phút)
+
+Cập nhật O(1) amortized mỗi reading: ring buffer + tổng chạy (sum, sum bình phương, tổng
+hiệu liên tiếp, các tổng cho hồi quy), deque đơn điệu cho min/max. Mỗi khi ring buffer quay
+hết một vòng, các tổng được tính lại từ buffer (O(N) mỗi N reading) để không tích lũy sai số.
+
+Dùng ở:
+  - train_history_model.py --window-features 10,60 : feature cho mọi record khi train
+  - predict_history_model.py --recent 72,75,80      : feature từ các reading trước đó
+  - history_server.py                                 : giữ state theo deviceId giữa các request,
+                                                        nạp reading đã lưu trong Data (WindowFeatureEngine.history)
+
+Kiểm tra với pandas rolling + đo tốc độ:
+  python hr_window_features.py --check --readings 200000
+"""
+
+import math
+import time
+import argparse
+import threading
+from collections import deque, OrderedDict
+
+import numpy as np
+
+DEFAULT_WINDOWS = (10, 60)
+STATS = ("mean", "std", "min", "max", "rmssd", "slope")
+
+
+def parse_windows(text):
+    """"10,60" -> (10, 60)"""
+    windows = tuple(sorted({int(v) for v in str(text).split(",") if v.strip()}))
+    if not windows or windows[0] < 2:
+        raise ValueError(f"window sizes must be integers >= 2: {text!r}")
+    return windows
+
+
+def window_feature_names(windows):
+    return [f"hr_{stat}_w{size}" for size in windows for stat in STATS]
+
+
+class RollingWindow:
+    """Thống kê của `size` reading gần nhất; push O(1) amortized"""
+
+    def __init__(self, size):
+        if size < 2:
+            raise ValueError("window size must be >= 2")
+        self.size = size
+        self.values = [0.0] * size
+        self.times = [0.0] * size
+        self.count = 0
+        # Các tổng dùng t - origin và x - shift (gốc = reading cũ nhất lúc rebase) để
+        # sum bình phương không triệt tiêu khi trừ (t ~ 1.7e9 giây, heart rate ~ 100)
+        self.origin = 0.0
+        self.shift = 0.0
+        self.min_q = deque()  # (seq, value), value tăng dần
+        self.max_q = deque()  # (seq, value), value giảm dần
+        self.sum = self.sumsq = self.diff_sq = 0.0
+        self.t_sum = self.tt_sum = self.tx_sum = 0.0
+
+    def push(self, t, x):
+        size, values, times = self.size, self.values, self.times
+        n = self.count
+        pos = n % size
+        if n >= size:
+            # Bỏ reading cũ nhất (và hiệu của nó với reading kế tiếp) khỏi các tổng
+            old = values[pos]
+            old_x, old_t = old - self.shift, times[pos] - self.origin
+            self.sum -= old_x
+            self.sumsq -= old_x * old_x
+            self.t_sum -= old_t
+            self.tt_sum -= old_t * old_t
+            self.tx_sum -= old_t * old_x
+            d = values[(pos + 1) % size] - old
+            self.diff_sq -= d * d
+        if n:
+            d = x - values[(n - 1) % size]
+            self.diff_sq += d * d
+        else:
+            self.origin, self.shift = t, x
+
+        values[pos] = x
+        times[pos] = t
+        xr, tr = x - self.shift, t - self.origin
+        self.sum += xr
+        self.sumsq += xr * xr
+        self.t_sum += tr
+        self.tt_sum += tr * tr
+        self.tx_sum += tr * xr
+
+        min_q, max_q = self.min_q, self.max_q
+        while min_q and min_q[-1][1] >= x:
+            min_q.pop()
+        min_q.append((n, x))
+        if min_q[0][0] <= n - size:
+            min_q.popleft()
+        while max_q and max_q[-1][1] <= x:
+            max_q.pop()
+        max_q.append((n, x))
+        if max_q[0][0] <= n - size:
+            max_q.popleft()
+
+        self.count = n + 1
+        if pos == size - 1:
+            self._rebase()
+
+    def _rebase(self):
+        """Buffer vừa đầy một vòng (reading cũ nhất ở index 0): tính lại các tổng"""
+        values, times = self.values, self.times
+        self.origin, self.shift = times[0], values[0]
+        rel_t = [t - self.origin for t in times]
+        rel_x = [x - self.shift for x in values]
+        self.sum = math.fsum(rel_x)
+        self.sumsq = math.fsum(x * x for x in rel_x)
+        self.diff_sq = math.fsum((b - a) ** 2 for a, b in zip(values, values[1:]))
+        self.t_sum = math.fsum(rel_t)
+        self.tt_sum = math.fsum(t * t for t in rel_t)
+        self.tx_sum = math.fsum(t * x for t, x in zip(rel_t, rel_x))
+
+    def stats(self):
+        """(mean, std, min, max, rmssd, slope) theo thứ tự STATS"""
+        k = min(self.count, self.size)
+        mean = self.sum / k
+        std = math.sqrt(max(self.sumsq / k - mean * mean, 0.0))
+        mean += self.shift
+        rmssd = math.sqrt(max(self.diff_sq, 0.0) / (k - 1)) if k > 1 else 0.0
+        sxx = self.tt_sum - self.t_sum * self.t_sum / k
+        if sxx > 1e-9 * max(self.tt_sum, 1.0):
+            slope = (self.tx_sum - self.t_sum * self.sum / k) / sxx * 60.0
+        else:
+            slope = 0.0  # mọi reading cùng thời điểm
+        return mean, std, self.min_q[0][1], self.max_q[0][1], rmssd, slope
+
+
+class WindowFeatureEngine:
+    """State cửa sổ trượt cho nhiều stream (deviceId); giữ tối đa `max_streams` stream gần nhất"""
+
+    def __init__(self, windows=DEFAULT_WINDOWS, max_streams=None, history=None):
+        self.windows = tuple(windows)
+        self.max_streams = max_streams
+        self.streams = OrderedDict()
+        self.lock = threading.Lock()  # history_server: nhiều connection cùng cập nhật state
+        # history(key, after, before, limit) -> [(t, heart_rate), ...] cũ -> mới: reading đã lưu của
+        # stream mà request không gửi kèm (history_server: collection Data), None = chỉ reading của request
+        self.history = history
+
+    @property
+    def feature_names(self):
+        return window_feature_names(self.windows)
+
+    def last_time(self, key):
+        """Thời điểm reading cuối của stream `key`, None nếu chưa có state"""
+        state = self.streams.get(key)
+        if not state:
+            return None
+        window = state[0]
+        return window.times[(window.count - 1) % window.size]
+
+    def backlog(self, key, t):
+        """Reading đã lưu của stream `key` trước t mà engine chưa thấy (tối đa window lớn nhất).
+        Gọi ngoài lock vì history có I/O"""
+        if self.history is None:
+            return []
+        with self.lock:
+            after = self.last_time(key)
+        return self.history(key, after, t, max(self.windows))
+
+    def extend(self, key, readings):
+        """Thêm các reading (t, heart_rate) mới hơn reading cuối của stream; bỏ qua reading đã thêm
+        (hai request cùng device có thể lấy cùng backlog)"""
+        last = self.last_time(key)
+        for t, heart_rate in readings:
+            if last is None or t > last:
+                self.update(key, t, heart_rate)
+                last = t
+
+    def update(self, key, t, heart_rate):
+        """Thêm một reading (t: giây) vào stream `key`, trả về list feature sau khi thêm"""
+        state = self.streams.get(key)
+        if state is None:
+            state = self.streams[key] = [RollingWindow(size) for size in self.windows]
+            if self.max_streams and len(self.streams) > self.max_streams:
+                self.streams.popitem(last=False)
+        elif self.max_streams:
+            self.streams.move_to_end(key)
+        row = []
+        for window in state:
+            window.push(t, heart_rate)
+            row.extend(window.stats())
+        return row
+
+
+def sequence_features(heart_rates, times, windows=DEFAULT_WINDOWS):
+    """Feature của reading cuối trong một chuỗi (cũ -> mới), không giữ state"""
+    engine = WindowFeatureEngine(windows)
+    row = None
+    for t, x in zip(times, heart_rates):
+        row = engine.update(None, t, x)
+    return row
+
+
+def window_features(keys, times, heart_rates, windows=DEFAULT_WINDOWS):
+    """Feature cho mọi reading của nhiều stream, float64 (n, len(windows) * len(STATS)).
+
+    Mỗi stream (key) được duyệt theo thời gian; kết quả theo thứ tự input. key None = reading
+    đứng riêng; thời gian NaN dùng thời gian reading trước trong stream; heartRate NaN -> row NaN.
+    """
+    import pandas as pd
+
+    heart_rates = np.asarray(heart_rates, dtype=float)
+    times = np.asarray(times, dtype=float)
+    n = len(heart_rates)
+    out = np.full((n, len(windows) * len(STATS)), np.nan)
+    if n == 0:
+        return out
+
+    codes, _ = pd.factorize(pd.Series(keys, dtype=object))
+    alone = codes < 0
+    codes[alone] = codes.max() + 1 + np.arange(alone.sum())
+    valid = ~np.isnan(heart_rates)
+    order = np.lexsort((np.arange(n), times, codes))
+    order = order[valid[order]]
+
+    engine = WindowFeatureEngine(windows)
+    hr_list, t_list, code_list = heart_rates.tolist(), times.tolist(), codes.tolist()
+    last_t = {}
+    rows = []
+    for i in order.tolist():
+        key, t = code_list[i], t_list[i]
+        if t != t:
+            t = last_t.get(key, 0.0)
+        last_t[key] = t
+        rows.append(engine.update(key, t, hr_list[i]))
+    if rows:
+        out[order] = rows
+    return out
+
+# ------------------------------- Self-check ----------------------------------
+
+
+def reference_features(keys, times, heart_rates, windows):
+    """pandas rolling trên từng stream (O(n * window) cho slope) để đối chiếu"""
+    import pandas as pd
+
+    df = pd.DataFrame({"key": keys, "t": times, "hr": heart_rates})
+    df = df.sort_values(["key", "t"], kind="stable")
+    parts = []
+    for size in windows:
+        g = df.groupby("key", sort=False)["hr"]
+        roll = g.rolling(size, min_periods=1)
+        diff_sq = g.diff().pow(2)
+        cols = {
+            "mean": roll.mean().droplevel(0),
+            "std": roll.std(ddof=0).droplevel(0).fillna(0.0),
+            "min": roll.min().droplevel(0),
+            "max": roll.max().droplevel(0),
+            "rmssd": np.sqrt(diff_sq.groupby(df["key"]).rolling(size - 1, min_periods=1).mean()
+                             .droplevel(0).reindex(df.index).fillna(0.0)),
+        }
+        slopes = np.zeros(len(df))
+        for key, idx in df.groupby("key", sort=False).indices.items():
+            t = df["t"].to_numpy()[idx]
+            x = df["hr"].to_numpy()[idx]
+            for j in range(len(idx)):
+                lo = max(0, j - size + 1)
+                tw, xw = t[lo:j + 1] - t[lo], x[lo:j + 1]
+                sxx = ((tw - tw.mean()) ** 2).sum()
+                slopes[idx[j]] = ((tw - tw.mean()) * (xw - xw.mean())).sum() / sxx * 60.0 if sxx > 0 else 0.0
+        cols["slope"] = pd.Series(slopes, index=df.index)
+        parts.append(pd.DataFrame(cols)[list(STATS)])
+    ref = pd.concat(parts, axis=1).sort_index()
+    return ref.to_numpy()
+
+
+def make_streams(n_readings, n_devices=50, seed=0):
+    rng = np.random.default_rng(seed)
+    keys = rng.integers(0, n_devices, n_readings).astype(str)
+    times = 1.7e9 + np.cumsum(rng.integers(1, 120, n_readings)).astype(float)
+    heart_rates = np.clip(75 + np.cumsum(rng.normal(0, 2, n_readings)) % 60 + rng.normal(0, 3, n_readings), 35, 200)
+    return keys, times, np.round(heart_rates, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sliding-window heart-rate features per device")
+    parser.add_argument("--windows", default=",".join(map(str, DEFAULT_WINDOWS)))
+    parser.add_argument("--readings", type=int, default=100000)
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--check", action="store_true", help="Đối chiếu với pandas rolling (trên tối đa 20k reading)")
+    args = parser.parse_args()
+
+    windows = parse_windows(args.windows)
+    keys, times, heart_rates = make_streams(args.readings, args.devices)
+
+    started = time.perf_counter()
+    features = window_features(keys, times, heart_rates, windows)
+    elapsed = time.perf_counter() - started
+    print(f"⏱️ {args.readings} readings, {args.devices} devices, windows {windows}: "
+          f"{elapsed:.2f}s ({elapsed / args.readings * 1e6:.2f} µs/reading)")
+
+    if args.check:
+        n = min(args.readings, 20000)
+        ref = reference_features(keys[:n], times[:n], heart_rates[:n], windows)
+        got = window_features(keys[:n], times[:n], heart_rates[:n], windows)
+        diff = np.abs(ref - got)
+        names = window_feature_names(windows)
+        worst = int(diff.max(axis=0).argmax())
+        print(f"🔍 max_abs_diff={diff.max():.2e} (worst: {names[worst]}) on {n} readings")
+        if not np.allclose(ref, got, rtol=1e-6, atol=1e-6):
+            print("❌ Lệch so với pandas rolling")
+            raise SystemExit(1)
+        print("✅ Khớp pandas rolling")
+
+
+if __name__ == "__main__":
+    main()
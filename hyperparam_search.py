@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""hyperparam_search.py
+Tìm hyperparameter cho các candidate của HeartDiagnosisAI.train_models
+(RandomForest, SVM, NeuralNetwork) bằng successive halving.
+
+- Mỗi model có một grid riêng (DEFAULT_GRIDS hoặc --grid file.json) và một bracket riêng.
+- Rung đầu chạy mọi config trên một phần nhỏ train set; mỗi rung chỉ giữ 1/factor config
+  có CV f1_macro tốt nhất và tăng số sample lên factor lần, rung cuối dùng toàn bộ train set.
+  Config kém bị loại khi mới tốn ít tài nguyên.
+- Mọi (config, CV fold) của một rung chạy song song (joblib, --jobs).
+- Các config còn lại được refit và đo latency predict_proba cho 1 mẫu (đúng như serving)
+  cùng với f1_macro trên test set.
+- Chọn model có CV f1_macro cao nhất trong --latency-budget-ms.
+
+Output (--output) dùng trực tiếp cho training:
+  python hyperparam_search.py --latency-budget-ms 5 --output best_params.json
+  python ai_heart_diagnosis.py --params best_params.json
+"""
+
+import sys
+import json
+import math
+import time
+import argparse
+import itertools
+
+import numpy as np
+
+from ai_heart_diagnosis import HeartDiagnosisAI, build_model, _run_training_task
+
+DEFAULT_GRIDS = {
+    'RandomForest': {
+        'n_estimators': [100, 200, 400],
+        'max_depth': [6, 10, None],
+        'min_samples_leaf': [1, 2],
+    },
+    'SVM': {
+        'C': [0.3, 1.0, 3.0, 10.0],
+        'gamma': ['scale', 0.03, 0.1],
+    },
+    'NeuralNetwork': {
+        'hidden_layer_sizes': [[32], [64, 32], [64, 32, 16]],
+        'alpha': [0.0001, 0.001, 0.01],
+    },
+}
+
+# Số lần gọi predict_proba 1 mẫu khi đo latency
+LATENCY_REPEATS = 200
+
+
+def expand_grid(grid):
+    """{param: [values]} -> list các dict config"""
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+
+def halving_schedule(n_samples, min_resources, factor):
+    """Số sample cho từng rung: tăng factor lần mỗi rung, rung cuối = n_samples"""
+    n_rungs = 1 + max(0, int(math.floor(math.log(n_samples / min_resources, factor))))
+    return [int(n_samples / factor ** (n_rungs - 1 - i)) for i in range(n_rungs)]
+
+
+def _stratified_order(y, seed):
+    """Hoán vị xen kẽ các class để mọi prefix đều gần như stratified"""
+    rng = np.random.default_rng(seed)
+    per_class = [rng.permutation(np.flatnonzero(y == c)) for c in np.unique(y)]
+    order = []
+    for i in range(max(len(idx) for idx in per_class)):
+        order.extend(idx[i] for idx in per_class if i < len(idx))
+    return np.asarray(order)
+
+
+def measure_latency(model, X, repeats=LATENCY_REPEATS):
+    """Median ms cho predict_proba một mẫu, và ms/mẫu khi predict cả batch X"""
+    row = X[:1]
+    model.predict_proba(row)  # warm-up
+    samples = []
+    for i in range(repeats):
+        row = X[i % len(X)][None, :]
+        started = time.perf_counter()
+        model.predict_proba(row)
+        samples.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    model.predict_proba(X)
+    batch_s = time.perf_counter() - started
+    return float(np.median(samples) * 1000), float(batch_s * 1000 / len(X))
+
+
+def successive_halving(X, y, grids, n_jobs=-1, factor=3, min_resources=None, cv=3, seed=42):
+    """Chạy successive halving cho từng model; trả về list config sống sót tới rung cuối"""
+    from joblib import Parallel, delayed
+    from sklearn.model_selection import StratifiedKFold
+
+    n_classes = len(np.unique(y))
+    min_resources = min_resources or 10 * n_classes * cv
+    schedule = halving_schedule(len(y), min_resources, factor)
+    order = _stratified_order(y, seed)
+    print(f"🪜 Rungs (samples): {schedule}, factor={factor}, cv={cv}")
+
+    alive = {name: expand_grid(grid) for name, grid in grids.items()}
+    history = []
+    for rung, n_samples in enumerate(schedule):
+        subset = order[:n_samples]
+        X_rung, y_rung = X[subset], y[subset]
+        folds = list(StratifiedKFold(n_splits=cv, shuffle=True, random_state=seed).split(X_rung, y_rung))
+
+        tasks = [
+            (name, i, build_model(name, params), train_idx, valid_idx)
+            for name, configs in alive.items()
+            for i, params in enumerate(configs)
+            for train_idx, valid_idx in folds
+        ]
+        started = time.perf_counter()
+        results = Parallel(n_jobs=n_jobs)(
+            delayed(_run_training_task)((name, i), model, X_rung, y_rung, train_idx, valid_idx)
+            for name, i, model, train_idx, valid_idx in tasks
+        )
+        wall = time.perf_counter() - started
+
+        scores = {}
+        for r in results:
+            scores.setdefault(r['name'], []).append(r['score'])
+
+        n_configs = sum(len(c) for c in alive.values())
+        print(f"   rung {rung}: {n_configs} configs × {cv} folds on {n_samples} samples ({wall:.2f}s)")
+
+        last_rung = rung == len(schedule) - 1
+        next_alive = {}
+        for name, configs in alive.items():
+            ranked = sorted(
+                ((float(np.mean(scores[(name, i)])), params) for i, params in enumerate(configs)),
+                key=lambda item: -item[0],
+            )
+            for score, params in ranked:
+                history.append({'rung': rung, 'samples': n_samples, 'model': name,
+                                'params': params, 'cv_f1_macro': round(score, 4)})
+            keep = len(ranked) if last_rung else max(1, math.ceil(len(ranked) / factor))
+            next_alive[name] = ranked[:keep]
+        alive = {name: [params for _, params in ranked] for name, ranked in next_alive.items()}
+
+    finalists = [
+        {'model': name, 'params': params, 'cv_f1_macro': round(score, 4)}
+        for name, ranked in next_alive.items()
+        for score, params in ranked
+    ]
+    return finalists, history
+
+
+def evaluate_finalists(finalists, X_train, y_train, X_test, y_test):
+    """Refit trên toàn bộ train set, đo f1_macro trên test và latency predict_proba"""
+    from sklearn.metrics import f1_score
+
+    for entry in finalists:
+        model = build_model(entry['model'], entry['params'])
+        started = time.perf_counter()
+        model.fit(X_train, y_train)
+        entry['fit_s'] = round(time.perf_counter() - started, 3)
+        entry['test_f1_macro'] = round(float(f1_score(y_test, model.predict(X_test), average='macro')), 4)
+        single_ms, batch_ms = measure_latency(model, X_test)
+        entry['latency_ms'] = round(single_ms, 4)
+        entry['batch_ms_per_row'] = round(batch_ms, 4)
+    return finalists
+
+
+def select_under_budget(finalists, latency_budget_ms=None):
+    """Config có CV f1_macro cao nhất với latency_ms <= budget (không có budget: cao nhất)"""
+    eligible = [f for f in finalists if latency_budget_ms is None or f['latency_ms'] <= latency_budget_ms]
+    if not eligible:
+        return None
+    return max(eligible, key=lambda f: (f['cv_f1_macro'], f['test_f1_macro'], -f['latency_ms']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Successive halving hyperparameter search for the heart diagnosis models")
+    parser.add_argument("--data", default="heart.csv")
+    parser.add_argument("--grid", default=None, help="File JSON {model: {param: [values]}} thay cho DEFAULT_GRIDS")
+    parser.add_argument("--models", default=None, help="Danh sách model, ví dụ RandomForest,SVM")
+    parser.add_argument("--jobs", type=int, default=-1, help="Số process song song (-1 = tất cả core)")
+    parser.add_argument("--factor", type=int, default=3, help="Hệ số loại config / tăng sample mỗi rung")
+    parser.add_argument("--min-resources", type=int, default=None, help="Số sample của rung đầu")
+    parser.add_argument("--cv", type=int, default=3)
+    parser.add_argument("--latency-budget-ms", type=float, default=None,
+                        help="Latency predict_proba 1 mẫu tối đa cho model được chọn")
+    parser.add_argument("--output", default="best_params.json")
+    args = parser.parse_args()
+
+    grids = DEFAULT_GRIDS
+    if args.grid:
+        with open(args.grid) as f:
+            grids = json.load(f)
+    if args.models:
+        grids = {name: grids[name] for name in args.models.split(",")}
+
+    print("🔎 Hyperparameter search (successive halving)")
+    print("=" * 50)
+
+    ai = HeartDiagnosisAI()
+    df = ai.feature_engineering(ai.load_and_preprocess_data(args.data))
+    feature_cols = [col for col in df.columns if col not in ['target', 'severity']]
+    X_train, X_test, y_train, y_test = ai.prepare_training_data(df[feature_cols], df['severity'])
+
+    started = time.perf_counter()
+    finalists, history = successive_halving(
+        X_train, y_train, grids, n_jobs=args.jobs, factor=args.factor,
+        min_resources=args.min_resources, cv=args.cv,
+    )
+    evaluate_finalists(finalists, X_train, y_train, X_test, y_test)
+    search_s = time.perf_counter() - started
+
+    print(f"\n📊 Finalists ({search_s:.1f}s total):")
+    for f in sorted(finalists, key=lambda f: -f['cv_f1_macro']):
+        print(f"   {f['model']:<14} cv_f1={f['cv_f1_macro']:.3f} test_f1={f['test_f1_macro']:.3f} "
+              f"latency={f['latency_ms']:.3f}ms batch={f['batch_ms_per_row']:.4f}ms/row {f['params']}")
+
+    # Params tốt nhất của từng model (theo CV) cho ai_heart_diagnosis.py --params
+    best_per_model = {}
+    for f in sorted(finalists, key=lambda f: -f['cv_f1_macro']):
+        best_per_model.setdefault(f['model'], f['params'])
+
+    selected = select_under_budget(finalists, args.latency_budget_ms)
+    if selected is None:
+        print(f"❌ Không có config nào đạt latency budget {args.latency_budget_ms} ms")
+    else:
+        best_per_model[selected['model']] = selected['params']
+        print(f"\n🏆 Selected: {selected['model']} {selected['params']} "
+              f"(cv_f1={selected['cv_f1_macro']:.3f}, latency={selected['latency_ms']:.3f}ms)")
+
+    report = {
+        'latency_budget_ms': args.latency_budget_ms,
+        'selected': selected['model'] if selected else None,
+        'params': best_per_model,
+        'finalists': finalists,
+        'history': history,
+        'search_s': round(search_s, 2),
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Saved {args.output}")
+
+    if selected is None:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
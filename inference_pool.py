@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""inference_pool.py
+Process pool cho inference: mảng của model được đặt một lần vào multiprocessing.shared_memory,
+N worker attach vào cùng vùng nhớ (không copy) và chia nhau các chunk của batch.
+
+- Model scikit-learn (.pkl) được export sang mảng NumPy bằng numpy_model.py (RandomForest / SVC / MLP);
+  file .npz đã export được dùng trực tiếp. Cả heart_diagnosis_model.pkl và heart_model/history_model.pkl.
+- Worker: forkserver (hoặc spawn nếu không có); không fork thẳng từ process đang có thread
+  (event loop của MicroBatcher, thread request của serve_stdio) vì worker fork ra có thể kẹt trên lock
+  bị copy. Worker chỉ attach shared memory nên khởi động vẫn rẻ. Mỗi worker giới hạn BLAS/OpenMP còn
+  `threads_per_worker` thread (biến môi trường + threadpoolctl) để N worker không tranh nhau core.
+- Cân bằng tải: batch được cắt thành ~4 chunk mỗi worker, worker rảnh lấy chunk kế tiếp
+  (ProcessPoolExecutor); batch nhỏ đi nguyên một chunk, nhiều request đồng thời chạy trên nhiều worker.
+
+Dùng như model thường (predict_proba + classes_), vd. cho HeartDiagnosisAI / predict_rows:
+  pool = InferencePool('heart_diagnosis_model.pkl', workers=4)
+  pool.attach(ai)                       # ai.predict_batch(...) chạy trên pool
+  bundle = pool.bundle()                # {'model', 'scaler', ...} cho predict_history_model.predict_rows
+
+Scaling 1 -> N worker:
+  python inference_pool.py --model heart_diagnosis_model.pkl --workers 4 --rows 200000
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import atexit
+import argparse
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from numpy_model import NumpyClassifier, NumpyScaler, export_arrays, _mmap_npz
+
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+                   "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS")
+ALIGN = 64
+MIN_CHUNK_ROWS = 256
+CHUNKS_PER_WORKER = 4
+
+_worker = {}
+
+
+def model_arrays(model_path):
+    """Mảng NumPy của model: .npz đọc trực tiếp, bundle joblib export qua numpy_model"""
+    if model_path.endswith(".npz"):
+        return {key: np.asarray(value) for key, value in _mmap_npz(model_path).items()}
+    import joblib
+
+    bundle = joblib.load(model_path)
+    if not isinstance(bundle, dict):
+        bundle = {"model": bundle}
+    meta = {k: v for k, v in bundle.items() if k not in ("model", "scaler")}
+    return export_arrays(bundle["model"], bundle.get("scaler"), meta)
+
+
+def pack_shared(arrays):
+    """Copy mọi mảng vào một SharedMemory; trả về (shm, layout [(key, dtype, shape, offset)])"""
+    layout, offset = [], 0
+    for key, value in arrays.items():
+        value = np.asarray(value, order="C")
+        offset = -(-offset // ALIGN) * ALIGN
+        layout.append((key, value.dtype.str, value.shape, offset))
+        offset += value.nbytes
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for (_, dtype, shape, start), value in zip(layout, arrays.values()):
+        np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start)[...] = value
+    return shm, layout
+
+
+def attach_shared(name, layout):
+    """Attach vào SharedMemory của pool; các mảng là view trên buffer chung (không copy)"""
+    # Worker dùng chung resource_tracker với parent (fork/spawn) nên segment chỉ bị unlink bởi close()
+    shm = shared_memory.SharedMemory(name=name)
+    arrays = {}
+    for key, dtype, shape, offset in layout:
+        view = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+        view.flags.writeable = False
+        arrays[key] = view
+    return shm, arrays
+
+
+def limit_threads(threads):
+    """Giới hạn thread BLAS/OpenMP của process hiện tại"""
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return None
+    return threadpool_limits(limits=threads)
+
+
+def _init_worker(name, layout, threads):
+    _worker["limits"] = limit_threads(threads)
+    _worker["shm"], arrays = attach_shared(name, layout)
+    _worker["model"] = NumpyClassifier(arrays)
+
+
+def _predict_chunk(X):
+    return _worker["model"].predict_proba(X)
+
+
+def _worker_info(_):
+    """(pid, mọi mảng model có nằm trong segment shared memory không) - kiểm tra không copy"""
+    segment = np.frombuffer(_worker["shm"].buf, dtype=np.uint8)
+    shared = all(np.shares_memory(value, segment) for value in _worker["model"].arrays.values() if value.nbytes)
+    return os.getpid(), shared
+
+
+class PooledClassifier:
+    """predict_proba / predict / classes_ như estimator, tính trên các worker của pool"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.classes_ = np.asarray(pool.arrays["classes"])
+        self.kind = str(pool.arrays["kind"])
+
+    def predict_proba(self, X):
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        chunk = max(MIN_CHUNK_ROWS, math.ceil(len(X) / (self.pool.workers * CHUNKS_PER_WORKER)))
+        if len(X) <= chunk:
+            return self.pool.executor.submit(_predict_chunk, X).result()
+        futures = [self.pool.executor.submit(_predict_chunk, X[start:start + chunk])
+                   for start in range(0, len(X), chunk)]
+        return np.vstack([future.result() for future in futures])
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+class InferencePool:
+    def __init__(self, model_path, workers=None, threads_per_worker=1, start_method=None):
+        self.model_path = model_path
+        self.workers = workers or os.cpu_count() or 1
+        self.threads_per_worker = threads_per_worker
+        self.shm, self.layout = pack_shared(model_arrays(model_path))
+        # Parent cũng đọc qua shared memory (classes, scaler, meta), không giữ bản copy thứ hai
+        self._parent_shm, self.arrays = attach_shared(self.shm.name, self.layout)
+        if start_method is None:
+            start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        context = multiprocessing.get_context(start_method)
+        if start_method == "forkserver":
+            context.set_forkserver_preload(["inference_pool"])  # worker fork từ server đã import numpy
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self.shm.name, self.layout, threads_per_worker),
+        )
+        self.model = PooledClassifier(self)
+        self.scaler = NumpyScaler(self.arrays["scaler_mean"], self.arrays["scaler_scale"]) \
+            if "scaler_mean" in self.arrays else None
+        self._closed = False
+        atexit.register(self.close)
+
+    @property
+    def nbytes(self):
+        return self.shm.size
+
+    def warm_up(self):
+        """Khởi động mọi worker (attach shared memory) trước request đầu tiên"""
+        return list(self.executor.map(_worker_info, range(self.workers * 2)))
+
+    def bundle(self):
+        """Bundle cùng dạng load_numpy_model / joblib artifacts, model chạy trên pool"""
+        bundle = json.loads(str(self.arrays.get("meta_json", np.array("{}"))))
+        bundle["model"] = self.model
+        bundle["scaler"] = self.scaler
+        return bundle
+
+    def attach(self, ai):
+        """Cho HeartDiagnosisAI dùng pool: predict_heart_rate_risk / predict_batch gọi worker"""
+        ai.model = ai.best_model = self.model
+        if self.scaler is not None:
+            ai.scaler = self.scaler
+        return ai
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.arrays = {}
+        self._parent_shm.close()
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# ------------------------------- Benchmark -----------------------------------
+
+
+def benchmark_inputs(arrays, rows, seed=42):
+    """Điểm ngẫu nhiên theo phân phối của scaler, đã scale (đầu vào của predict_proba)"""
+    n_features = len(arrays["scaler_mean"]) if "scaler_mean" in arrays else int(arrays["feature"].max()) + 1
+    return np.random.default_rng(seed).standard_normal((rows, n_features))
+
+
+def run_scaling(model_path, max_workers, rows, threads_per_worker=1, repeats=3):
+    """rows/s của predict_proba trên `rows` dòng với 1, 2, 4, ..., max_workers worker"""
+    arrays = model_arrays(model_path)
+    X = benchmark_inputs(arrays, rows)
+
+    local = NumpyClassifier(arrays)
+    limits = limit_threads(threads_per_worker)
+    started = time.perf_counter()
+    expected = local.predict_proba(X)
+    in_process_s = time.perf_counter() - started
+
+    counts = sorted({1, max_workers} | {2 ** k for k in range(1, max_workers.bit_length()) if 2 ** k < max_workers})
+    results = {"rows": rows, "model_type": str(arrays["source_type"]), "cpu_count": os.cpu_count(),
+               "in_process_rows_per_s": round(rows / in_process_s, 1), "scaling": []}
+    for n in counts:
+        with InferencePool(model_path, workers=n, threads_per_worker=threads_per_worker) as pool:
+            info = pool.warm_up()
+            pool.model.predict_proba(X[:1000])
+            timings = []
+            for _ in range(repeats):
+                started = time.perf_counter()
+                got = pool.model.predict_proba(X)
+                timings.append(time.perf_counter() - started)
+            elapsed = min(timings)
+            results["shared_mb"] = round(pool.nbytes / 1e6, 2)
+            results["scaling"].append({
+                "workers": n,
+                "rows_per_s": round(rows / elapsed, 1),
+                "worker_pids": len({pid for pid, _ in info}),
+                "shared_views": all(shared for _, shared in info),
+                "max_abs_diff": float(np.abs(got - expected).max()),
+            })
+    base = results["scaling"][0]["rows_per_s"]
+    for entry in results["scaling"]:
+        entry["speedup"] = round(entry["rows_per_s"] / base, 2)
+    if limits is not None:
+        limits.restore_original_limits()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared-memory multi-process inference pool: scaling benchmark")
+    parser.add_argument("--model", default="heart_diagnosis_model.pkl", help=".pkl (sklearn bundle) hoặc .npz")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Số worker tối đa")
+    parser.add_argument("--threads-per-worker", type=int, default=1)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--json", action="store_true", help="Chỉ in kết quả JSON")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.model):
+        print(f"❌ Model file không tồn tại: {args.model}")
+        sys.exit(1)
+
+    results = run_scaling(args.model, args.workers, args.rows, args.threads_per_worker)
+    if args.json:
+        print(json.dumps(results))
+        return
+
+    print(f"⏱️  {results['model_type']} predict_proba, {results['rows']} rows, "
+          f"{results['shared_mb']} MB shared, {results['cpu_count']} CPU")
+    print(f"   in-process (no pool): {results['in_process_rows_per_s']:>12,.0f} rows/s")
+    for entry in results["scaling"]:
+        print(f"   {entry['workers']:3d} worker(s):        {entry['rows_per_s']:>12,.0f} rows/s  "
+              f"x{entry['speedup']:.2f}  shared={entry['shared_views']}  max_abs_diff={entry['max_abs_diff']:.1e}")
+
+
+if __name__ == "__main__":
+    main()
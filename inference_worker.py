@@ -0,0 +1,183 @@
+"""inference_worker.py
+Vòng lặp JSONL dùng chung cho các Python worker chạy lâu dài (ai_server.py, ...).
+
+Protocol (mỗi message là một dòng JSON):
+  request : {"id": "...", "op": "diagnose", ...}
+  response: {"id": "...", "ok": true, "result": {...}}
+            {"id": "...", "ok": false, "error": "..."}
+  event   : {"event": "ready", ...}   (không có id, gửi một lần sau warm-up)
+
+Transport: stdin/stdout (Node.js spawn một lần và giữ process) hoặc Unix socket.
+Ở chế độ stdio, stdout là kênh protocol nên mọi print() debug được chuyển sang stderr.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import contextlib
+import socketserver
+from collections import deque
+
+import numpy as np
+
+import timing
+
+
+class LatencyStats:
+    """Latency (ms) của `window` request gần nhất cho một op, báo p50/p99 trong health"""
+
+    def __init__(self, window=10000):
+        self._samples = deque(maxlen=window)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def record(self, ms):
+        with self._lock:
+            self._samples.append(ms)
+            self.count += 1
+
+    def summary(self):
+        with self._lock:
+            samples = np.fromiter(self._samples, dtype=float, count=len(self._samples))
+            count = self.count
+        if not len(samples):
+            return {"count": count}
+        p50, p99 = np.percentile(samples, [50, 99])
+        return {
+            "count": count,
+            "window": len(samples),
+            "p50_ms": round(float(p50), 3),
+            "p99_ms": round(float(p99), 3),
+            "mean_ms": round(float(samples.mean()), 3),
+            "max_ms": round(float(samples.max()), 3),
+        }
+
+
+class InferenceWorker:
+    def __init__(self, name):
+        self.name = name
+        self.handlers = {}
+        self.started_at = time.time()
+        self.requests_served = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self.latency = {}
+        self.register("ping", lambda request: {"pong": True})
+
+    def register(self, op, handler):
+        """Đăng ký handler(request) -> dict cho một op"""
+        self.handlers[op] = handler
+        self.latency[op] = LatencyStats()
+
+    def base_health(self):
+        """Thông tin chung cho op health của mọi worker"""
+        return {
+            "worker": self.name,
+            "pid": os.getpid(),
+            "uptime_s": round(time.time() - self.started_at, 3),
+            "requests_served": self.requests_served,
+            "errors": self.errors,
+            "latency": {op: stats.summary() for op, stats in self.latency.items() if stats.count},
+        }
+
+    def handle(self, request):
+        """Xử lý một request đã parse, luôn trả về response dict"""
+        if not isinstance(request, dict):
+            return {"id": None, "ok": False, "error": "Request must be a JSON object"}
+
+        req_id = request.get("id")
+        op = request.get("op", "diagnose")
+        handler = self.handlers.get(op)
+        if handler is None:
+            with self._lock:
+                self.errors += 1
+            return {"id": req_id, "ok": False, "error": f"Unknown op: {op}"}
+
+        started = time.perf_counter()
+        try:
+            # HEART_TIMING: mỗi request một dòng span (load, features, scale, predict, ...)
+            with timing.trace(op, worker=self.name):
+                result = handler(request)
+        except Exception as exc:
+            with self._lock:
+                self.errors += 1
+            return {"id": req_id, "ok": False, "error": str(exc)}
+        finally:
+            self.latency[op].record((time.perf_counter() - started) * 1000)
+
+        with self._lock:
+            self.requests_served += 1
+        return {"id": req_id, "ok": True, "result": result}
+
+    def handle_line(self, line):
+        """Xử lý một dòng JSONL, trả về dòng response (không có newline) hoặc None nếu dòng rỗng"""
+        line = line.strip()
+        if not line:
+            return None
+        try:
+            request = json.loads(line)
+        except ValueError as exc:
+            with self._lock:
+                self.errors += 1
+            return json.dumps({"id": None, "ok": False, "error": f"Invalid JSON: {exc}"})
+        return json.dumps(self.handle(request), ensure_ascii=False)
+
+    def serve_stdio(self, ready_info=None, concurrency=1):
+        """Đọc request từ stdin, ghi response ra stdout cho tới khi stdin đóng.
+
+        concurrency > 1: các dòng được xử lý song song trong thread pool và response ghi theo
+        thứ tự xong (client ghép theo id), để request đồng thời có thể được gom batch (microbatch.py).
+        """
+        out = sys.stdout
+        write_lock = threading.Lock()
+
+        def respond(line):
+            response = self.handle_line(line)
+            if response is not None:
+                with write_lock:
+                    out.write(response + "\n")
+                    out.flush()
+
+        with contextlib.redirect_stdout(sys.stderr):
+            self._emit(out, {"event": "ready", **(ready_info or {})})
+            if concurrency <= 1:
+                for line in sys.stdin:
+                    respond(line)
+                return
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="request") as pool:
+                for line in sys.stdin:
+                    pool.submit(respond, line)
+
+    def serve_unix(self, socket_path, ready_info=None):
+        """Phục vụ nhiều client qua Unix socket, mỗi connection một thread"""
+        worker = self
+
+        class _Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for raw in self.rfile:
+                    response = worker.handle_line(raw.decode("utf-8"))
+                    if response is not None:
+                        self.wfile.write((response + "\n").encode("utf-8"))
+                        self.wfile.flush()
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+        with socketserver.ThreadingUnixStreamServer(socket_path, _Handler) as server:
+            server.daemon_threads = True
+            print(json.dumps({"event": "ready", "socket": socket_path, **(ready_info or {})}), file=sys.stderr, flush=True)
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                if os.path.exists(socket_path):
+                    os.unlink(socket_path)
+
+    @staticmethod
+    def _emit(out, message):
+        out.write(json.dumps(message, ensure_ascii=False) + "\n")
+        out.flush()
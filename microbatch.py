@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""microbatch.py
+Gom các request chẩn đoán đến gần như cùng lúc thành một lần predict vectorized.
+
+MicroBatcher (asyncio) giữ hàng đợi request; một batch được chạy khi:
+  - đủ max_batch request, hoặc
+  - request cũ nhất đã chờ max_wait_ms (mặc định 2 ms), hoặc
+  - ngay lập tức nếu request đang đến thưa hơn max_wait_ms (EWMA khoảng cách giữa các request):
+    chờ cũng không gom thêm được ai, nên không cộng latency khi tải thấp.
+Mỗi lúc chỉ một batch chạy (trong một thread riêng); request đến trong lúc model đang bận
+tự gom thành batch kế tiếp.
+
+Metrics (stats()): độ sâu hàng đợi, histogram kích thước batch, latency cộng thêm do chờ gom
+(enqueue -> batch bắt đầu chạy) và thời gian model mỗi batch.
+
+Dùng:
+  batcher = MicroBatcher(run_batch, max_batch=64, max_wait_ms=2)
+  result = await batcher.submit(request)                  # trong event loop
+  result = batcher.start_background().submit_threadsafe(request)   # từ thread (ai_server.py)
+run_batch(list request) -> list kết quả cùng thứ tự; phần tử là Exception = lỗi riêng request đó.
+
+Benchmark với model chẩn đoán (client đồng thời, so với gọi predict_heart_rate_risk từng request):
+  python microbatch.py --clients 32 --requests 2000
+"""
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+from inference_worker import LatencyStats
+
+GAP_EWMA_ALPHA = 0.2
+
+
+def _bucket(size):
+    """1, 2, 3-4, 5-8, ... (lũy thừa 2)"""
+    if size <= 2:
+        return str(size)
+    upper = 1 << (size - 1).bit_length()
+    return f"{upper // 2 + 1}-{upper}"
+
+
+class MicroBatcher:
+    def __init__(self, run_batch, max_batch=64, max_wait_ms=2.0):
+        if max_batch < 1:
+            raise ValueError("max_batch must be >= 1")
+        self.run_batch = run_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue = []          # (item, future, enqueued_at)
+        self._full = None         # asyncio.Event: hàng đợi đủ max_batch
+        self._flusher = None
+        self._loop = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="microbatch")
+        self._last_arrival = None
+        self._gap_ewma = float("inf")
+
+        self.submitted = 0
+        self.batches = 0
+        self.max_queue_depth = 0
+        self.batch_sizes = {}
+        self.wait_latency = LatencyStats()
+        self.batch_latency = LatencyStats()
+
+    # ------------------------------- Submit ----------------------------------
+
+    async def submit(self, item):
+        """Đưa một request vào hàng đợi và chờ kết quả của nó"""
+        loop = asyncio.get_running_loop()
+        if self._loop is None:
+            self._loop, self._full = loop, asyncio.Event()
+
+        now = time.perf_counter()
+        if self._last_arrival is not None:
+            gap = now - self._last_arrival
+            self._gap_ewma = gap if self._gap_ewma == float("inf") else \
+                GAP_EWMA_ALPHA * gap + (1 - GAP_EWMA_ALPHA) * self._gap_ewma
+        self._last_arrival = now
+
+        future = loop.create_future()
+        self._queue.append((item, future, now))
+        self.submitted += 1
+        self.max_queue_depth = max(self.max_queue_depth, len(self._queue))
+        if len(self._queue) >= self.max_batch:
+            self._full.set()
+        if self._flusher is None:
+            self._flusher = loop.create_task(self._flush_loop())
+        return await future
+
+    def start_background(self):
+        """Chạy event loop của batcher trong một daemon thread (cho caller dạng thread)"""
+        if self._loop is None:
+            self._loop, ready = asyncio.new_event_loop(), threading.Event()
+
+            def run():
+                asyncio.set_event_loop(self._loop)
+                self._full = asyncio.Event()
+                self._loop.call_soon(ready.set)
+                self._loop.run_forever()
+
+            threading.Thread(target=run, name="microbatch-loop", daemon=True).start()
+            ready.wait()
+        return self
+
+    def submit_threadsafe(self, item, timeout=None):
+        """Blocking submit từ thread khác event loop (sau start_background)"""
+        return asyncio.run_coroutine_threadsafe(self.submit(item), self._loop).result(timeout)
+
+    # ------------------------------- Flush -----------------------------------
+
+    async def _flush_loop(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self._queue:
+                if len(self._queue) < self.max_batch and self._gap_ewma < self.max_wait:
+                    deadline = self._queue[0][2] + self.max_wait
+                    while len(self._queue) < self.max_batch:
+                        remaining = deadline - time.perf_counter()
+                        if remaining <= 0:
+                            break
+                        self._full.clear()
+                        try:
+                            await asyncio.wait_for(self._full.wait(), remaining)
+                        except asyncio.TimeoutError:
+                            break
+
+                batch = self._queue[:self.max_batch]
+                del self._queue[:self.max_batch]
+                await self._execute(loop, batch)
+        finally:
+            self._flusher = None
+
+    async def _execute(self, loop, batch):
+        started = time.perf_counter()
+        for _, _, enqueued_at in batch:
+            self.wait_latency.record((started - enqueued_at) * 1000)
+        self.batches += 1
+        key = _bucket(len(batch))
+        self.batch_sizes[key] = self.batch_sizes.get(key, 0) + 1
+
+        items = [item for item, _, _ in batch]
+        try:
+            results = await loop.run_in_executor(self._executor, self.run_batch, items)
+            if len(results) != len(batch):
+                raise RuntimeError(f"run_batch returned {len(results)} results for {len(batch)} requests")
+        except Exception as exc:
+            results = [exc] * len(batch)
+        self.batch_latency.record((time.perf_counter() - started) * 1000)
+
+        for (_, future, _), result in zip(batch, results):
+            if future.done():
+                continue  # caller đã huỷ
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    # ------------------------------- Metrics ---------------------------------
+
+    def stats(self):
+        order = sorted(self.batch_sizes, key=lambda k: int(k.split("-")[0]))
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "submitted": self.submitted,
+            "batches": self.batches,
+            "mean_batch_size": round(self.submitted / self.batches, 2) if self.batches else None,
+            "queue_depth": len(self._queue),
+            "max_queue_depth": self.max_queue_depth,
+            "arrival_gap_ms": round(self._gap_ewma * 1000, 3) if self._gap_ewma != float("inf") else None,
+            "batch_size_histogram": {k: self.batch_sizes[k] for k in order},
+            "added_latency": self.wait_latency.summary(),
+            "batch_latency": self.batch_latency.summary(),
+        }
+
+# ------------------------------- Benchmark -----------------------------------
+
+
+async def _run_clients(call, requests, clients):
+    """`clients` coroutine, mỗi cái gửi tuần tự phần request của nó; trả về latency từng request (ms)"""
+    latencies = []
+
+    async def client(part):
+        for request in part:
+            started = time.perf_counter()
+            await call(request)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    await asyncio.gather(*(client(requests[i::clients]) for i in range(clients)))
+    return latencies
+
+
+def main():
+    import numpy as np
+    from run_ai import MODEL_PATH, load_diagnosis_ai, diagnose_with_ai, diagnose_batch_with_ai, _parse_reading
+
+    parser = argparse.ArgumentParser(description="Benchmark micro-batching of concurrent diagnosis requests")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--clients", type=int, default=32, help="Số client gửi đồng thời")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=2.0)
+    parser.add_argument("--json", action="store_true", help="Chỉ in kết quả JSON")
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(sys.stderr):
+        ai = load_diagnosis_ai(args.model)
+    if ai is None:
+        sys.exit(1)
+    ai.prediction_cache = None
+
+    rng = np.random.default_rng(42)
+    requests = [{"heart_rate": float(hr), "age": float(age)}
+                for hr, age in zip(rng.integers(40, 180, args.requests), rng.integers(20, 85, args.requests))]
+
+    def run_single(request):
+        with contextlib.redirect_stdout(None):
+            return diagnose_with_ai(ai, *_parse_reading(request))
+
+    def run_batch(batch):
+        return diagnose_batch_with_ai(ai, [_parse_reading(r) for r in batch])
+
+    async def bench():
+        # Baseline: mỗi request một lần predict (một thread như worker hiện tại)
+        executor = ThreadPoolExecutor(max_workers=1)
+        loop = asyncio.get_running_loop()
+
+        async def call_single(request):
+            return await loop.run_in_executor(executor, run_single, request)
+
+        batcher = MicroBatcher(run_batch, args.max_batch, args.max_wait_ms)
+        results = {}
+        for name, call in (("single", call_single), ("microbatch", batcher.submit)):
+            await _run_clients(call, requests[:100], args.clients)  # warm-up
+            started = time.perf_counter()
+            latencies = await _run_clients(call, requests, args.clients)
+            elapsed = time.perf_counter() - started
+            p50, p99 = np.percentile(latencies, [50, 99])
+            results[name] = {
+                "requests_per_s": round(len(requests) / elapsed, 1),
+                "p50_ms": round(float(p50), 3),
+                "p99_ms": round(float(p99), 3),
+            }
+        results["microbatch"]["stats"] = batcher.stats()
+        return results
+
+    results = asyncio.run(bench())
+    if args.json:
+        print(json.dumps(results))
+        return
+
+    print(f"⏱️  {args.requests} requests from {args.clients} concurrent clients")
+    for name in ("single", "microbatch"):
+        r = results[name]
+        print(f"   {name:10s} {r['requests_per_s']:9.1f} req/s  p50 {r['p50_ms']:.2f} ms  p99 {r['p99_ms']:.2f} ms")
+    stats = results["microbatch"]["stats"]
+    print(f"   mean batch size {stats['mean_batch_size']}, max queue depth {stats['max_queue_depth']}, "
+          f"added latency p50 {stats['added_latency'].get('p50_ms')} ms")
+    print(f"   batch sizes: {stats['batch_size_histogram']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""numpy_model.py
+Export model scikit-learn (RandomForest / SVC / MLPClassifier + StandardScaler) sang
+các mảng NumPy thuần, và evaluator nhỏ tái tạo predict_proba mà không cần import sklearn.
+
+Định dạng export (.npz, không nén; khi load các mảng được memory-map trực tiếp từ file):
+  - forest : node arrays của mọi cây nối liền (left/right/feature/threshold/value)
+  - mlp    : ma trận trọng số + bias từng layer
+  - svc    : support vectors, dual coef, intercept, Platt A/B (libsvm pairwise coupling)
+  - scaler_mean / scaler_scale, classes, meta_json (feature_names, label_map, ...)
+
+Usage:
+  python numpy_model.py heart_diagnosis_model.pkl --verify
+  python numpy_model.py heart_model/history_model.pkl --output heart_model/history_model.npz
+
+Serving: run_ai.py / ai_server.py nhận trực tiếp file .npz qua --model.
+"""
+
+import os
+import sys
+import json
+import argparse
+
+import numpy as np
+
+# libsvm constants (svm.cpp: sigmoid_predict / multiclass_probability)
+SVM_MIN_PROB = 1e-7
+FOREST_CHUNK_ROWS = 4096
+
+_ACTIVATIONS = {
+    'identity': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0),
+    'tanh': np.tanh,
+    'logistic': lambda x: 1.0 / (1.0 + np.exp(-x)),
+}
+
+
+# ------------------------------- Export -------------------------------------
+
+def export_arrays(model, scaler=None, meta=None):
+    """Convert a fitted sklearn classifier (+ optional StandardScaler) into a dict of arrays"""
+    kind = type(model).__name__
+    arrays = {'classes': np.asarray(model.classes_)}
+
+    if hasattr(model, 'estimators_') and hasattr(model.estimators_[0], 'tree_'):
+        arrays.update(_export_forest(model))
+    elif hasattr(model, 'coefs_'):
+        arrays.update(_export_mlp(model))
+    elif hasattr(model, 'support_vectors_'):
+        arrays.update(_export_svc(model))
+    else:
+        raise ValueError(f"Unsupported model type for NumPy export: {kind}")
+
+    if scaler is not None:
+        n_features = scaler.n_features_in_
+        mean = scaler.mean_ if getattr(scaler, 'mean_', None) is not None else np.zeros(n_features)
+        scale = scaler.scale_ if getattr(scaler, 'scale_', None) is not None else np.ones(n_features)
+        arrays['scaler_mean'] = np.asarray(mean, dtype=np.float64)
+        arrays['scaler_scale'] = np.asarray(scale, dtype=np.float64)
+
+    arrays['source_type'] = np.array(kind)
+    arrays['meta_json'] = np.array(json.dumps(meta or {}, ensure_ascii=False, default=str))
+    return arrays
+
+
+def _export_forest(model):
+    left, right, feature, threshold, value, offsets = [], [], [], [], [], []
+    offset = 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        is_leaf = tree.children_left == -1
+        offsets.append(offset)
+        # Chỉ số node tuyệt đối trong mảng nối; leaf trỏ về chính nó để vòng duyệt đứng yên
+        own = np.arange(tree.node_count) + offset
+        left.append(np.where(is_leaf, own, tree.children_left + offset))
+        right.append(np.where(is_leaf, own, tree.children_right + offset))
+        feature.append(np.where(is_leaf, 0, tree.feature))
+        threshold.append(tree.threshold)
+        leaf_value = tree.value[:, 0, :]
+        totals = leaf_value.sum(axis=1, keepdims=True)
+        value.append(leaf_value / np.where(totals == 0, 1, totals))
+        offset += tree.node_count
+
+    return {
+        'kind': np.array('forest'),
+        'tree_offsets': np.asarray(offsets, dtype=np.int32),
+        'left': np.concatenate(left).astype(np.int32),
+        'right': np.concatenate(right).astype(np.int32),
+        'feature': np.concatenate(feature).astype(np.int32),
+        'threshold': np.concatenate(threshold).astype(np.float64),
+        'value': np.concatenate(value).astype(np.float64),
+        'max_depth': np.array(max(e.tree_.max_depth for e in model.estimators_)),
+    }
+
+
+def _export_mlp(model):
+    arrays = {
+        'kind': np.array('mlp'),
+        'n_layers': np.array(len(model.coefs_)),
+        'activation': np.array(model.activation),
+        'out_activation': np.array(model.out_activation_),
+    }
+    for i, (coef, intercept) in enumerate(zip(model.coefs_, model.intercepts_)):
+        arrays[f'coef_{i}'] = np.asarray(coef, dtype=np.float64)
+        arrays[f'intercept_{i}'] = np.asarray(intercept, dtype=np.float64)
+    return arrays
+
+
+def _export_svc(model):
+    if model.kernel not in ('rbf', 'linear'):
+        raise ValueError(f"Unsupported SVC kernel for NumPy export: {model.kernel}")
+    prob_a = getattr(model, '_probA', None)
+    prob_b = getattr(model, '_probB', None)
+    if prob_a is None or len(prob_a) == 0:
+        raise ValueError("SVC must be trained with probability=True to export predict_proba")
+    # _dual_coef_/_intercept_ giữ dấu gốc của libsvm (dual_coef_ public bị đảo dấu khi binary)
+    return {
+        'kind': np.array('svc'),
+        'kernel': np.array(model.kernel),
+        'gamma': np.array(float(model._gamma)),
+        'support_vectors': np.asarray(model.support_vectors_, dtype=np.float64),
+        'dual_coef': np.asarray(model._dual_coef_, dtype=np.float64),
+        'intercept': np.asarray(model._intercept_, dtype=np.float64),
+        'n_support': np.asarray(model.n_support_, dtype=np.int64),
+        'prob_a': np.asarray(prob_a, dtype=np.float64),
+        'prob_b': np.asarray(prob_b, dtype=np.float64),
+    }
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """sha256 nội dung file (vd. fingerprint model nguồn cho diagnosis_lut.py)"""
+    import hashlib
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def save_numpy_model(arrays, path):
+    # Ghi ra file tạm rồi rename: ai_server / run_ai đang mmap file cũ (_mmap_npz) không bị truncate (SIGBUS)
+    if not path.endswith('.npz'):
+        path += '.npz'  # như np.savez với đường dẫn
+    with open(path + '.tmp', 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+# ------------------------------- Evaluator ----------------------------------
+
+class NumpyScaler:
+    """Drop-in thay StandardScaler.transform"""
+
+    def __init__(self, mean, scale):
+        self.mean_ = mean
+        self.scale_ = scale
+
+    def transform(self, X):
+        return (np.asarray(X, dtype=np.float64) - self.mean_) / self.scale_
+
+
+class NumpyClassifier:
+    """predict / predict_proba từ mảng đã export, không phụ thuộc scikit-learn"""
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.kind = str(arrays['kind'])
+        self.classes_ = np.asarray(arrays['classes'])
+        self.source_type = str(arrays.get('source_type', self.kind))
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+    def predict_proba(self, X):
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        if self.kind == 'forest':
+            return self._forest_proba(X)
+        if self.kind == 'mlp':
+            return self._mlp_proba(X)
+        if self.kind == 'svc':
+            return self._svc_proba(X)
+        raise ValueError(f"Unknown exported model kind: {self.kind}")
+
+    def _forest_proba(self, X):
+        a = self.arrays
+        # sklearn so sánh trên float32, threshold float64
+        X = X.astype(np.float32).astype(np.float64)
+        out = np.empty((len(X), a['value'].shape[1]))
+        for start in range(0, len(X), FOREST_CHUNK_ROWS):
+            chunk = X[start:start + FOREST_CHUNK_ROWS]
+            rows = np.arange(len(chunk))[:, None]
+            nodes = np.broadcast_to(a['tree_offsets'], (len(chunk), len(a['tree_offsets']))).copy()
+            for _ in range(int(a['max_depth'])):
+                go_left = chunk[rows, a['feature'][nodes]] <= a['threshold'][nodes]
+                nodes = np.where(go_left, a['left'][nodes], a['right'][nodes])
+            out[start:start + len(chunk)] = a['value'][nodes].mean(axis=1)
+        return out
+
+    def _mlp_proba(self, X):
+        a = self.arrays
+        hidden = _ACTIVATIONS[str(a['activation'])]
+        n_layers = int(a['n_layers'])
+        out = X
+        for i in range(n_layers):
+            out = out @ a[f'coef_{i}'] + a[f'intercept_{i}']
+            if i < n_layers - 1:
+                out = hidden(out)
+
+        if str(a['out_activation']) == 'softmax':
+            out = np.exp(out - out.max(axis=1, keepdims=True))
+            return out / out.sum(axis=1, keepdims=True)
+        positive = _ACTIVATIONS['logistic'](out[:, 0])
+        return np.column_stack([1 - positive, positive])
+
+    def _svc_proba(self, X):
+        a = self.arrays
+        sv = a['support_vectors']
+        if str(a['kernel']) == 'rbf':
+            sq_dist = (X ** 2).sum(axis=1)[:, None] - 2 * X @ sv.T + (sv ** 2).sum(axis=1)[None, :]
+            kernel = np.exp(-float(a['gamma']) * np.maximum(sq_dist, 0))
+        else:
+            kernel = X @ sv.T
+
+        n_class = len(self.classes_)
+        starts = np.concatenate([[0], np.cumsum(a['n_support'])])
+        pairwise = np.zeros((len(X), n_class, n_class))
+        p = 0
+        for i in range(n_class):
+            for j in range(i + 1, n_class):
+                si = slice(starts[i], starts[i + 1])
+                sj = slice(starts[j], starts[j + 1])
+                dec = kernel[:, si] @ a['dual_coef'][j - 1, si] + kernel[:, sj] @ a['dual_coef'][i, sj] + a['intercept'][p]
+                prob = _sigmoid_predict(dec, a['prob_a'][p], a['prob_b'][p])
+                prob = np.clip(prob, SVM_MIN_PROB, 1 - SVM_MIN_PROB)
+                pairwise[:, i, j] = prob
+                pairwise[:, j, i] = 1 - prob
+                p += 1
+
+        # Bản libsvm của sklearn chạy pairwise coupling cả khi chỉ có 2 class
+        return _multiclass_probability(pairwise)
+
+
+def _sigmoid_predict(dec, A, B):
+    fApB = dec * A + B
+    # Hai nhánh như libsvm để tránh overflow
+    pos = np.exp(-np.abs(fApB))
+    return np.where(fApB >= 0, pos / (1.0 + pos), 1.0 / (1.0 + pos))
+
+
+def _multiclass_probability(r):
+    """libsvm multiclass_probability (Wu, Lin & Weng 2004), vectorized across samples"""
+    n, k, _ = r.shape
+    Q = -r.transpose(0, 2, 1) * r
+    diag = (r ** 2).sum(axis=1) - np.einsum('nii->ni', r) ** 2
+    Q[:, np.arange(k), np.arange(k)] = diag
+
+    p = np.full((n, k), 1.0 / k)
+    active = np.ones(n, dtype=bool)
+    eps = 0.005 / k
+    for _ in range(max(100, k)):
+        Qp = np.einsum('ntj,nj->nt', Q, p)
+        pQp = (p * Qp).sum(axis=1)
+        max_error = np.abs(Qp - pQp[:, None]).max(axis=1)
+        active &= max_error >= eps
+        if not active.any():
+            break
+        idx = np.flatnonzero(active)
+        Qa, pa, Qpa, pQpa = Q[idx], p[idx], Qp[idx], pQp[idx]
+        for t in range(k):
+            diff = (-Qpa[:, t] + pQpa) / Qa[:, t, t]
+            pa[:, t] += diff
+            scale = 1 + diff
+            pQpa = (pQpa + diff * (diff * Qa[:, t, t] + 2 * Qpa[:, t])) / scale ** 2
+            Qpa = (Qpa + diff[:, None] * Qa[:, t, :]) / scale[:, None]
+            pa /= scale[:, None]
+        p[idx] = pa
+    return p
+
+
+def _mmap_npz(path):
+    """Memory-map từng member của file .npz không nén (np.load bỏ qua mmap_mode với .npz).
+
+    np.savez lưu member dạng ZIP_STORED nên dữ liệu .npy nằm liền trong file: map trực tiếp
+    từ offset đó để nhiều worker process dùng chung page cache thay vì mỗi process một bản copy.
+    Member bị nén (np.savez_compressed) được đọc bình thường.
+    """
+    import zipfile
+
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as fh:
+        for info in archive.infolist():
+            key = info.filename[:-len('.npy')] if info.filename.endswith('.npy') else info.filename
+            if info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[key] = np.lib.format.read_array(member, allow_pickle=False)
+                continue
+
+            # Local file header: 30 byte cố định + tên file + extra field
+            fh.seek(info.header_offset)
+            header = fh.read(30)
+            name_len = int.from_bytes(header[26:28], 'little')
+            extra_len = int.from_bytes(header[28:30], 'little')
+            fh.seek(info.header_offset + 30 + name_len + extra_len)
+
+            version = np.lib.format.read_magic(fh)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(fh)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(fh)
+            if dtype.hasobject:
+                raise ValueError(f"Object arrays are not supported in {path}:{key}")
+            if shape == () or 0 in shape:
+                arrays[key] = np.fromfile(fh, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+            else:
+                arrays[key] = np.memmap(path, dtype=dtype, mode='r', shape=shape,
+                                        order='F' if fortran_order else 'C', offset=fh.tell())
+    return arrays
+
+
+def load_numpy_model(path, mmap=True):
+    """Load file .npz và trả về bundle cùng cấu trúc với joblib artifacts ({'model','scaler',...})"""
+    if mmap:
+        arrays = _mmap_npz(path)
+    else:
+        with np.load(path, allow_pickle=False) as data:
+            arrays = {key: data[key] for key in data.files}
+
+    bundle = json.loads(str(arrays.pop('meta_json', np.array('{}'))))
+    bundle['model'] = NumpyClassifier(arrays)
+    bundle['scaler'] = NumpyScaler(arrays['scaler_mean'], arrays['scaler_scale']) if 'scaler_mean' in arrays else None
+    return bundle
+
+
+# ------------------------------- Verify -------------------------------------
+
+def verify_parity(model, scaler, exported, X, atol=1e-6):
+    """So sánh predict_proba của sklearn và evaluator NumPy trên cùng dữ liệu đã scale"""
+    X_scaled = scaler.transform(X) if scaler is not None else np.asarray(X, dtype=np.float64)
+    expected = model.predict_proba(X_scaled)
+    X_exported = exported['scaler'].transform(X) if exported['scaler'] is not None else X_scaled
+    actual = exported['model'].predict_proba(X_exported)
+    max_diff = float(np.abs(expected - actual).max())
+    argmax_agreement = float((expected.argmax(axis=1) == actual.argmax(axis=1)).mean())
+    return {'rows': len(X), 'max_abs_diff': max_diff, 'argmax_agreement': argmax_agreement, 'ok': max_diff <= atol}
+
+
+def _verification_inputs(n_features, scaler, n_random=2000, seed=42):
+    """heart.csv (nếu khớp số feature) + điểm ngẫu nhiên quanh phân phối của scaler"""
+    rng = np.random.default_rng(seed)
+    parts = []
+    if n_features == 17 and os.path.exists('heart.csv'):
+        from ai_heart_diagnosis import HeartDiagnosisAI
+        ai = HeartDiagnosisAI()
+        df = ai.feature_engineering(ai.load_and_preprocess_data('heart.csv'))
+        parts.append(df.drop(columns=['target', 'severity']).to_numpy(dtype=np.float64))
+    mean = scaler.mean_ if scaler is not None else np.zeros(n_features)
+    scale = scaler.scale_ if scaler is not None else np.ones(n_features)
+    parts.append(mean + rng.standard_normal((n_random, n_features)) * scale)
+    return np.vstack(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a scikit-learn model bundle to NumPy arrays")
+    parser.add_argument("model", help="joblib bundle ({'model','scaler',...}) hoặc estimator")
+    parser.add_argument("--output", default=None, help="Đường dẫn .npz (mặc định: cùng tên với model)")
+    parser.add_argument("--verify", action="store_true", help="Kiểm tra predict_proba khớp sklearn")
+    parser.add_argument("--atol", type=float, default=1e-6)
+    args = parser.parse_args()
+
+    import joblib
+    bundle = joblib.load(args.model)
+    if not isinstance(bundle, dict):
+        bundle = {'model': bundle}
+    model = bundle.get('model')
+    scaler = bundle.get('scaler')
+    meta = {k: v for k, v in bundle.items() if k not in ('model', 'scaler')}
+    # Fingerprint của .pkl nguồn: lookup table build từ .pkl vẫn khớp khi serving bằng .npz
+    meta['source_sha256'] = file_sha256(args.model)
+
+    output = args.output or os.path.splitext(args.model)[0] + '.npz'
+    arrays = export_arrays(model, scaler, meta)
+    output = save_numpy_model(arrays, output)
+    print(f"💾 Exported {type(model).__name__} -> {output} ({os.path.getsize(output) / 1024:.1f} KB, "
+          f"source {os.path.getsize(args.model) / 1024:.1f} KB)")
+
+    if args.verify:
+        exported = load_numpy_model(output)
+        X = _verification_inputs(model.n_features_in_, scaler)
+        report = verify_parity(model, scaler, exported, X, args.atol)
+        print(f"🔍 Parity: rows={report['rows']} max_abs_diff={report['max_abs_diff']:.2e} "
+              f"argmax_agreement={report['argmax_agreement']:.4f}")
+        if not report['ok']:
+            print(f"❌ predict_proba lệch quá tolerance {args.atol}")
+            sys.exit(1)
+        print("✅ predict_proba khớp trong tolerance")
+
+
+if __name__ == "__main__":
+    main()
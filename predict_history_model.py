@@ -3,12 +3,19 @@ Dùng model đã train (history_model.pkl) để dự đoán label từ input m
 Usage:
   python predict_history_model.py --heartRate 78 --age 55 --gender female --weight 62 \
       --conditions hypertension,diabetes
+  python predict_history_model.py --batch rows.jsonl   # mỗi dòng {"heartRate": 78, "age": 55, ...}
+  python predict_history_model.py --heartRate 96 --recent 72,78,85,90 --interval 60  # model có window features
 Output: JSON string to stdout.
 """
-import os, json, argparse, sys
+import os, json, time, argparse, sys
+import timing
+_IMPORT_STARTED = time.perf_counter()
 import numpy as np
 import joblib
 
+from hr_window_features import window_feature_names, sequence_features
+timing.record('import', (time.perf_counter() - _IMPORT_STARTED) * 1000)
+
 ARTIFACT_MODEL = os.path.join('heart_model', 'history_model.pkl')
 ARTIFACT_META = os.path.join('heart_model', 'history_features.json')
 
@@ -19,102 +26,265 @@ ARTIFACT_META = os.path.join('heart_model', 'history_features.json')
 
 GENDER_MAP = {"male":0, "female":1, "other":2}
 
-def load_artifacts():
-    if not os.path.exists(ARTIFACT_MODEL):
-        print(json.dumps({"error":"Model file not found","path":ARTIFACT_MODEL}), file=sys.stdout)
-        sys.exit(1)
-    bundle = joblib.load(ARTIFACT_MODEL)
+def read_artifacts(model_path=ARTIFACT_MODEL, meta_path=ARTIFACT_META):
+    """Load bundle + meta; FileNotFoundError nếu chưa có model"""
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(model_path)
+    # Bundle lưu không nén (save_artifacts) nên các numpy buffer được memory-map (copy-on-write),
+    # share page cache giữa các process. File chỉ được thay bằng tmp + os.replace (save_artifacts),
+    # không ghi đè tại chỗ, nên mapping của process đang chạy vẫn trỏ vào inode cũ.
+    bundle = joblib.load(model_path, mmap_mode='c')
     meta = {}
-    if os.path.exists(ARTIFACT_META):
-        with open(ARTIFACT_META,'r',encoding='utf-8') as f:
+    if os.path.exists(meta_path):
+        with open(meta_path,'r',encoding='utf-8') as f:
             meta = json.load(f)
+    # Feature order lấy từ chính bundle nếu có: luôn khớp với model (meta json được ghi sau pkl)
+    for key in ('feature_names', 'conditions_used', 'window_sizes'):
+        if key in bundle:
+            meta[key] = bundle[key]
     return bundle, meta
 
+def load_artifacts():
+    try:
+        return read_artifacts()
+    except FileNotFoundError:
+        print(json.dumps({"error":"Model file not found","path":ARTIFACT_MODEL}), file=sys.stdout)
+        sys.exit(1)
+
 def parse_args():
     p = argparse.ArgumentParser()
-    p.add_argument('--heartRate', type=float, required=True)
+    p.add_argument('--heartRate', type=float, default=None)
     p.add_argument('--age', type=float, default=50)
     p.add_argument('--gender', type=str, default='other')
     p.add_argument('--weight', type=float, default=65)
     p.add_argument('--conditions', type=str, default='')
     p.add_argument('--hour', type=int, default=None)
-    return p.parse_args()
-
-def build_vector(args, meta):
-    feature_names = meta.get('feature_names', [])
-    conditions_used = meta.get('conditions_used', [])
-
-    gender_enc = GENDER_MAP.get(args.gender.lower(), 2)
-    created_hour = args.hour if args.hour is not None else 12
-    is_night = 1 if created_hour < 6 or created_hour >= 22 else 0
-    hr_is_low = 1 if args.heartRate < 60 else 0
-    hr_is_high = 1 if args.heartRate > 100 else 0
-
-    cond_list = [c.strip().lower() for c in args.conditions.split(',') if c.strip()]
-    cond_vec = [1 if c in cond_list else 0 for c in conditions_used]
-
-    # Build in same order as training
-    base_values = {
-        'heartRate': args.heartRate,
-        'age': args.age,
-        'weight': args.weight,
-        'gender_enc': gender_enc,
-        'created_hour': created_hour,
-        'is_night': is_night,
-        'hr_is_low': hr_is_low,
-        'hr_is_high': hr_is_high
-    }
+    p.add_argument('--recent', type=str, default='',
+                   help='Heart rate các reading trước đó (cũ -> mới), cho model train với --window-features')
+    p.add_argument('--interval', type=float, default=60, help='Số giây giữa các reading trong --recent')
+    p.add_argument('--batch', type=str, default=None,
+                   help="File JSONL hoặc JSON array các row ('-' = stdin), dự đoán trong một lần gọi model")
+    args = p.parse_args()
+    if args.batch is None and args.heartRate is None:
+        p.error('--heartRate is required (or use --batch)')
+    args.recent = [float(v) for v in args.recent.split(',') if v.strip()]
+    return args
 
-    vec = []
-    for name in feature_names:
-        if name.startswith('cond_'):
-            cond_name = name[len('cond_'):]
-            vec.append(1 if cond_name in cond_list else 0)
-        else:
-            vec.append(base_values.get(name, 0))
-    return np.array(vec, dtype=float), {
-        'gender_enc': gender_enc,
-        'conditions_used': conditions_used,
-        'provided_conditions': cond_list
+def read_batch(path):
+    """Row từ file JSON array hoặc JSONL"""
+    f = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+    try:
+        text = f.read()
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    if text.lstrip().startswith('['):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+BASE_FEATURES = ['heartRate', 'age', 'weight', 'gender_enc', 'created_hour', 'is_night', 'hr_is_low', 'hr_is_high']
+
+def parse_conditions(text):
+    return [c.strip().lower() for c in text.split(',') if c.strip()]
+
+class FeaturePlan:
+    """Thứ tự feature của meta, compile một lần khi load model: vị trí cột của từng base
+    feature + hash map tên condition -> cột. build_matrix điền cả batch bằng ghi mảng."""
+
+    def __init__(self, meta):
+        self.feature_names = list(meta.get('feature_names', []))
+        self.conditions_used = list(meta.get('conditions_used', []))
+        self.window_sizes = tuple(meta.get('window_sizes') or ())
+        self.base_columns = {}       # tên base feature -> cột
+        self.condition_columns = {}  # tên condition (lowercase) -> cột
+        window_names = window_feature_names(self.window_sizes)
+        window_index = {name: i for i, name in enumerate(window_names)}
+        window_cols = [None] * len(window_names)
+        for col, name in enumerate(self.feature_names):
+            if name.startswith('cond_'):
+                self.condition_columns[name[len('cond_'):]] = col
+            elif name in BASE_FEATURES:
+                self.base_columns[name] = col
+            elif name in window_index:
+                window_cols[window_index[name]] = col
+            # feature không biết -> giữ 0 như trước
+        self.window_columns = np.asarray(window_cols, dtype=np.intp) if window_names else None
+
+    def window_matrix(self, rows, engine=None):
+        """Feature cửa sổ trượt của từng row: từ `recent` của row nếu có, không thì từ state
+        theo deviceId trong engine (history_server, cộng các reading đã lưu của device mà engine
+        chưa thấy nếu engine có history), không thì chỉ reading hiện tại"""
+        W = np.empty((len(rows), len(self.window_columns)))
+        for i, a in enumerate(rows):
+            recent = getattr(a, 'recent', None)
+            device = getattr(a, 'deviceId', None)
+            if recent:
+                values = list(recent) + [a.heartRate]
+                times = [k * a.interval for k in range(len(values))]
+                W[i] = sequence_features(values, times, self.window_sizes)
+            elif engine is not None and device:
+                timestamp = getattr(a, 'timestamp', None)
+                t = time.time() if timestamp is None else timestamp
+                backlog = engine.backlog(device, t)
+                with engine.lock:
+                    engine.extend(device, backlog)
+                    W[i] = engine.update(device, t, a.heartRate)
+            else:
+                W[i] = sequence_features([a.heartRate], [0.0], self.window_sizes)
+        return W
+
+    def build_matrix(self, rows, engine=None):
+        """rows: list Namespace (parse_args / row_args); engine: WindowFeatureEngine giữ state theo deviceId.
+
+        Trả về (ma trận float64 (n_rows, n_features) theo đúng thứ tự lúc train,
+        list conditions đã chuẩn hoá của từng row)."""
+        n = len(rows)
+        X = np.zeros((n, len(self.feature_names)), dtype=float)
+
+        heart_rate = np.fromiter((a.heartRate for a in rows), dtype=float, count=n)
+        hour = np.fromiter((12 if a.hour is None else a.hour for a in rows), dtype=float, count=n)
+        base_values = {
+            'heartRate': heart_rate,
+            'age': np.fromiter((a.age for a in rows), dtype=float, count=n),
+            'weight': np.fromiter((a.weight for a in rows), dtype=float, count=n),
+            'gender_enc': np.fromiter((GENDER_MAP.get(a.gender.lower(), 2) for a in rows), dtype=float, count=n),
+            'created_hour': hour,
+            'is_night': (hour < 6) | (hour >= 22),
+            'hr_is_low': heart_rate < 60,
+            'hr_is_high': heart_rate > 100,
+        }
+        for name, col in self.base_columns.items():
+            X[:, col] = base_values[name]
+        if self.window_columns is not None:
+            X[:, self.window_columns] = self.window_matrix(rows, engine)
+
+        provided = [parse_conditions(a.conditions) for a in rows]
+        hit_rows, hit_cols = [], []
+        for i, cond_list in enumerate(provided):
+            for c in cond_list:
+                col = self.condition_columns.get(c)
+                if col is not None:
+                    hit_rows.append(i)
+                    hit_cols.append(col)
+        X[hit_rows, hit_cols] = 1
+        return X, provided
+
+def scale_matrix(scaler, X):
+    """StandardScaler áp dụng trực tiếp trên numpy (tránh validate/feature-name check của
+    sklearn cho mỗi request); scaler khác dùng transform"""
+    if type(scaler).__name__ != 'StandardScaler':
+        return scaler.transform(X)
+    if scaler.with_mean:
+        X = X - scaler.mean_
+    if scaler.with_std:
+        X = X / scaler.scale_
+    return X
+
+def build_vector(args, meta, plan=None):
+    plan = plan or FeaturePlan(meta)
+    X, provided = plan.build_matrix([args])
+    return X[0], {
+        'gender_enc': GENDER_MAP.get(args.gender.lower(), 2),
+        'conditions_used': plan.conditions_used,
+        'provided_conditions': provided[0]
     }
 
-def main():
-    args = parse_args()
-    bundle, meta = load_artifacts()
+def to_seconds(value):
+    """ISO string hoặc epoch (giây / mili giây) -> epoch giây"""
+    if isinstance(value, str):
+        from datetime import datetime
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    value = float(value)
+    return value / 1000 if value > 1e11 else value
+
+def row_args(row):
+    """Một row dạng dict (JSON request) -> Namespace giống parse_args, cùng giá trị mặc định"""
+    def value(key, default, cast):
+        v = row.get(key)
+        return default if v is None or v == '' else cast(v)
+
+    if row.get('heartRate') is None:
+        raise ValueError('heartRate is required')
+    conditions = row.get('conditions') or ''
+    if isinstance(conditions, (list, tuple)):
+        conditions = ','.join(str(c) for c in conditions)
+    recent = row.get('recent') or []
+    if isinstance(recent, str):
+        recent = recent.split(',')
+    return argparse.Namespace(
+        heartRate=float(row['heartRate']),
+        age=value('age', 50, float),
+        gender=value('gender', 'other', str),
+        weight=value('weight', 65, float),
+        conditions=str(conditions),
+        hour=value('hour', None, int),
+        recent=[float(v) for v in recent if str(v).strip()],
+        interval=value('interval', 60, float),
+        deviceId=value('deviceId', None, str),
+        timestamp=value('timestamp', None, to_seconds),
+    )
+
+def predict_rows(bundle, meta, rows, plan=None, engine=None):
+    """Dự đoán nhiều row trong một lần scale + predict_proba.
+
+    rows: list Namespace (parse_args / row_args). plan: FeaturePlan đã compile từ meta
+    (worker giữ lại giữa các request). engine: state window features theo deviceId.
+    Trả về list dict như output của CLI.
+    """
     model = bundle['model']
     scaler = bundle['scaler']
     label_map = bundle.get('label_map', {})
+    inv_label_map = {v:k for k,v in label_map.items()}
 
-    vec, extra = build_vector(args, meta)
-    scaled = scaler.transform([vec])
-    pred_index = int(model.predict(scaled)[0])
-    probs = model.predict_proba(scaled)[0]
+    with timing.span('features'):
+        plan = plan or FeaturePlan(meta)
+        X, provided = plan.build_matrix(rows, engine)
+    with timing.span('scale'):
+        scaled = scale_matrix(scaler, X)
+    with timing.span('predict'):
+        probs = model.predict_proba(scaled)
+    # Cùng kết quả với model.predict cho RandomForest (argmax của predict_proba)
+    pred_indices = model.classes_[probs.argmax(axis=1)]
 
-    inv_label_map = {v:k for k,v in label_map.items()}
-    label = inv_label_map.get(pred_index, 'unknown')
-
-    out = {
-        'success': True,
-        'prediction': {
-            'label': label,
-            'label_index': pred_index,
-            'probabilities': probs.tolist(),
-            'label_map': label_map,
-        },
-        'input': {
-            'heartRate': args.heartRate,
-            'age': args.age,
-            'gender': args.gender,
-            'weight': args.weight,
-            'conditions': extra['provided_conditions'],
-            'hour': args.hour
-        },
-        'meta': {
-            'feature_names_count': len(meta.get('feature_names', [])),
-            'conditions_vector_count': len(extra['conditions_used']),
-        }
-    }
-    print(json.dumps(out, ensure_ascii=False))
+    results = []
+    for args, cond_list, pred_index, row_probs in zip(rows, provided, pred_indices, probs):
+        pred_index = int(pred_index)
+        results.append({
+            'prediction': {
+                'label': inv_label_map.get(pred_index, 'unknown'),
+                'label_index': pred_index,
+                'probabilities': row_probs.tolist(),
+                'label_map': label_map,
+            },
+            'input': {
+                'heartRate': args.heartRate,
+                'age': args.age,
+                'gender': args.gender,
+                'weight': args.weight,
+                'conditions': cond_list,
+                'hour': args.hour
+            },
+            'meta': {
+                'feature_names_count': len(plan.feature_names),
+                'conditions_vector_count': len(plan.conditions_used),
+            }
+        })
+    return results
+
+def main():
+    args = parse_args()
+    with timing.trace('predict_history', batch=args.batch is not None):
+        with timing.span('load'):
+            bundle, meta = load_artifacts()
+        if args.batch is not None:
+            with timing.span('features'):
+                rows = [row_args(row) for row in read_batch(args.batch)]
+            predictions = predict_rows(bundle, meta, rows)
+            out = {'success': True, 'predictions': predictions, 'count': len(predictions)}
+        else:
+            out = {'success': True, **predict_rows(bundle, meta, [args])[0]}
+        with timing.span('serialize'):
+            print(json.dumps(out, ensure_ascii=False))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""rescore_history.py
+Chẩn đoán lại các record Data đã lưu sau khi ship model mới, thay cho spawn run_ai.py mỗi reading.
+
+Record được đọc từ MongoDB theo chunk, mỗi chunk được featurize + predict bằng một lần gọi
+vectorized (diagnose_batch_with_ai / predict_rows) trong process pool (model load một lần mỗi
+worker qua initializer), kết quả ghi lại bằng bulk_write unordered.
+
+  --mode diagnosis : heart_diagnosis_model.pkl -> aiDiagnosis (cùng format Node.js ghi khi nhận reading),
+                     cộng status theo severity mới (--sync-status, như mapSeverityToStatus của arduino.controller.js)
+  --mode history   : heart_model/history_model.pkl -> historyPrediction {label, confidence, predictedAt}
+
+Usage:
+  python rescore_history.py --days 30 --jobs 4
+  python rescore_history.py --days 30 --sync-status all   # ghi status của mọi record theo severity mới
+  python rescore_history.py --mode history --chunk-size 10000 --dry-run
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+from datetime import datetime
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from pymongo import UpdateOne
+
+from train_history_model import DEFAULT_URI, open_collections, build_time_filter, resolve_users, _user_key
+
+DIAGNOSIS_MODEL = "heart_diagnosis_model.pkl"
+HISTORY_MODEL = os.path.join("heart_model", "history_model.pkl")
+HISTORY_META = os.path.join("heart_model", "history_features.json")
+
+RESCORE_PROJECTION = {"_id": 1, "userId": 1, "deviceId": 1, "heartRate": 1, "timestamp": 1, "createdAt": 1,
+                      "status": 1, "aiDiagnosis.severity": 1}
+
+# Giống buildPythonDiagnosis trong src/services/ai.service.js
+SEVERITY_LEVELS = ["low", "medium", "high", "high", "critical"]
+DIAGNOSIS_TITLES = {
+    0: "Healthy heart rate",
+    1: "Heart rate needs monitoring",
+    2: "Moderate cardiovascular risk",
+    3: "High cardiovascular risk",
+    4: "Very high cardiovascular risk - URGENT",
+}
+URGENCY_LEVELS = {0: "routine", 1: "routine", 2: "urgent", 3: "urgent", 4: "emergency"}
+
+# Giống mapSeverityToStatus trong src/controllers/arduino.controller.js
+SEVERITY_TO_STATUS = {"low": "normal", "medium": "warning", "high": "warning", "critical": "critical"}
+SYNC_STATUS_CHOICES = ("derived", "all", "none")
+
+
+def status_for(severity):
+    return SEVERITY_TO_STATUS.get(severity, "normal")
+
+
+def should_sync_status(record, policy):
+    """Có ghi lại status theo severity mới không.
+
+    derived: chỉ record có status suy ra từ severity cũ (arduino.controller.js ghi
+    status = mapSeverityToStatus(severity)); record có status riêng (vd. ngưỡng nhịp tim của
+    heartrate.controller.js) thì giữ nguyên trừ khi trùng giá trị đó. all: mọi record. none: không ghi."""
+    if policy == "all":
+        return True
+    if policy == "none":
+        return False
+    previous = (record.get("aiDiagnosis") or {}).get("severity")
+    return previous is not None and record.get("status", "normal") == status_for(previous)
+
+# ------------------------------- Worker side --------------------------------
+
+_worker = {}
+
+
+def _init_worker(mode, model_path, meta_path):
+    """Initializer của process pool: load model một lần cho mỗi worker"""
+    import warnings
+    warnings.filterwarnings("ignore")  # process pool không kế thừa filter của process chính
+    _worker.clear()
+    if mode == "diagnosis":
+        from run_ai import load_diagnosis_ai
+        # load_diagnosis_ai in debug ra stdout
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            ai = load_diagnosis_ai(model_path)
+        if ai is None:
+            raise RuntimeError(f"Cannot load diagnosis model {model_path}")
+        _worker.update(mode=mode, ai=ai)
+    else:
+        from predict_history_model import read_artifacts, FeaturePlan
+        from hr_window_features import WindowFeatureEngine
+        bundle, meta = read_artifacts(model_path, meta_path)
+        plan = FeaturePlan(meta)
+        engine = WindowFeatureEngine(plan.window_sizes) if plan.window_sizes else None
+        _worker.update(mode=mode, bundle=bundle, meta=meta, plan=plan, engine=engine)
+
+
+def diagnosis_fields(result, diagnosed_at):
+    """Kết quả diagnose_batch_with_ai -> field aiDiagnosis của Data"""
+    severity = result["severity"]
+    return {"aiDiagnosis": {
+        "diagnosis": DIAGNOSIS_TITLES.get(severity, "Unknown"),
+        "severity": SEVERITY_LEVELS[severity] if 0 <= severity < len(SEVERITY_LEVELS) else str(severity),
+        "analysis": result.get("risk_assessment", ""),
+        "recommendations": result.get("recommendations", []),
+        "riskFactors": result.get("risk_factors", []),
+        "needsAttention": severity >= 2,
+        "urgencyLevel": URGENCY_LEVELS.get(severity, "routine"),
+        "aiModel": "python-advanced-ai",
+        "diagnosedAt": diagnosed_at,
+    }}
+
+
+def score_chunk(rows):
+    """Một chunk (list dict đã gắn profile user) -> (list $set cùng thứ tự, số giây predict)"""
+    started = time.perf_counter()
+    updates = _score(rows)
+    return updates, time.perf_counter() - started
+
+
+def _score(rows):
+    now = datetime.utcnow()
+    if _worker["mode"] == "diagnosis":
+        from run_ai import diagnose_batch_with_ai
+        readings = [(r["heartRate"], r["age"], r["sex"], 120, 200) for r in rows]
+        updates = []
+        for row, result in zip(rows, diagnose_batch_with_ai(_worker["ai"], readings)):
+            fields = diagnosis_fields(result, now)
+            if row["syncStatus"]:
+                # Label source "status" / "auto" của train_history_model đọc field này
+                fields["status"] = status_for(fields["aiDiagnosis"]["severity"])
+            updates.append(fields)
+        return updates
+
+    from predict_history_model import row_args, predict_rows
+    predictions = predict_rows(_worker["bundle"], _worker["meta"], [row_args(r) for r in rows],
+                               _worker["plan"], _worker["engine"])
+    updates = []
+    for p in predictions:
+        probs = p["prediction"]["probabilities"]
+        updates.append({"historyPrediction": {
+            "label": p["prediction"]["label"],
+            "confidence": round(max(probs) * 100, 2) if probs else None,
+            "predictedAt": now,
+        }})
+    return updates
+
+# -------------------------------- Main side ---------------------------------
+
+GENDER_TO_SEX = {"male": 1, "female": 0}
+
+
+def chunk_rows(records, users, mode, sync_status="derived"):
+    """Record Mongo + profile user -> row thuần (picklable) cho worker"""
+    rows = []
+    for r in records:
+        user = users.get(_user_key(r.get("userId")), {})
+        created = r.get("createdAt") or r.get("timestamp")
+        if mode == "diagnosis":
+            rows.append({
+                "heartRate": r["heartRate"],  # giữ nguyên kiểu: analysis in "142 bpm" như khi diagnose lúc nhận reading
+                "age": user.get("age") or 50,
+                "sex": GENDER_TO_SEX.get(str(user.get("gender")).lower(), 1),
+                "syncStatus": should_sync_status(r, sync_status),
+            })
+        else:
+            stamp = r.get("timestamp") or r.get("createdAt")
+            rows.append({
+                "heartRate": float(r["heartRate"]),
+                "age": user.get("age"),
+                "gender": user.get("gender"),
+                "weight": user.get("weight"),
+                "conditions": user.get("conditions") or [],
+                "hour": created.hour if created else None,
+                "deviceId": r.get("deviceId") or _user_key(r.get("userId")),
+                "timestamp": stamp.timestamp() if stamp else None,
+            })
+    return rows
+
+
+def iter_chunks(data_col, users_col, query, chunk_size, mode, sort=None, limit=None, sync_status="derived"):
+    """(ids, rows) theo từng chunk; profile user được resolve bằng một query $in mỗi chunk"""
+    cursor = data_col.find(query, RESCORE_PROJECTION, batch_size=chunk_size)
+    if sort:
+        cursor = cursor.sort(sort)
+    if limit:
+        cursor = cursor.limit(limit)
+    user_cache = {}
+    while True:
+        raw = list(islice(cursor, chunk_size))
+        if not raw:
+            break
+        batch = [r for r in raw if r.get("heartRate") is not None]
+        if not batch:
+            continue
+        missing = {_user_key(r.get("userId")) for r in batch} - user_cache.keys()
+        missing.discard(None)
+        if missing:
+            user_cache.update(resolve_users(users_col, missing))
+        yield [r["_id"] for r in batch], chunk_rows(batch, user_cache, mode, sync_status)
+
+
+def write_updates(data_col, ids, updates, write_batch, dry_run=False):
+    if dry_run:
+        return 0
+    modified = 0
+    ops = [UpdateOne({"_id": _id}, {"$set": fields}) for _id, fields in zip(ids, updates)]
+    for i in range(0, len(ops), write_batch):
+        result = data_col.bulk_write(ops[i:i + write_batch], ordered=False)
+        modified += result.modified_count
+    return modified
+
+
+def window_sizes_of(meta_path):
+    if not os.path.exists(meta_path):
+        return []
+    with open(meta_path, "r", encoding="utf-8") as f:
+        return json.load(f).get("window_sizes") or []
+
+
+def rescore(args):
+    model_path = args.model or (DIAGNOSIS_MODEL if args.mode == "diagnosis" else HISTORY_MODEL)
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(model_path)
+
+    sort, jobs = None, args.jobs
+    if args.mode == "history" and window_sizes_of(args.meta):
+        # Window features cần đọc từng device theo thứ tự thời gian trong cùng một process
+        sort = [("deviceId", 1), ("timestamp", 1)]
+        if jobs != 1:
+            print("⚠️ Model có window features: đọc theo deviceId/timestamp với --jobs 1")
+            jobs = 1
+
+    client, data_col, users_col = open_collections(args.uri)
+    query = build_time_filter(args.days, args.startDate, args.endDate)
+    chunks = iter_chunks(data_col, users_col, query, args.chunk_size, args.mode, sort, args.limit, args.sync_status)
+
+    stats = {"records": 0, "modified": 0, "chunks": 0, "fetch_s": 0.0, "score_s": 0.0, "write_s": 0.0}
+    started = time.perf_counter()
+
+    def next_chunk():
+        t0 = time.perf_counter()
+        chunk = next(chunks, None)
+        stats["fetch_s"] += time.perf_counter() - t0
+        return chunk
+
+    def handle(ids, scored):
+        updates, score_s = scored
+        stats["score_s"] += score_s
+        t0 = time.perf_counter()
+        stats["modified"] += write_updates(data_col, ids, updates, args.write_batch, args.dry_run)
+        stats["write_s"] += time.perf_counter() - t0
+        stats["records"] += len(ids)
+        stats["chunks"] += 1
+        elapsed = time.perf_counter() - started
+        print(f"   {stats['records']} records ({stats['records'] / elapsed:.0f} rec/s)", file=sys.stderr)
+
+    try:
+        if jobs == 1:
+            _init_worker(args.mode, model_path, args.meta)
+            while (chunk := next_chunk()) is not None:
+                handle(chunk[0], score_chunk(chunk[1]))
+        else:
+            workers = jobs if jobs > 0 else os.cpu_count()
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(args.mode, model_path, args.meta)) as pool:
+                # Tối đa 2 chunk mỗi worker đang chờ: đọc Mongo / predict / ghi chạy chồng lên nhau
+                pending = {}
+                exhausted = False
+                while pending or not exhausted:
+                    while not exhausted and len(pending) < 2 * workers:
+                        chunk = next_chunk()
+                        if chunk is None:
+                            exhausted = True
+                            break
+                        pending[pool.submit(score_chunk, chunk[1])] = chunk[0]
+                    if not pending:
+                        break
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        handle(pending.pop(future), future.result())
+    finally:
+        client.close()
+
+    stats["elapsed_s"] = time.perf_counter() - started
+    stats["records_per_s"] = stats["records"] / stats["elapsed_s"] if stats["elapsed_s"] else 0.0
+    stats["jobs"] = jobs
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-run diagnoses over stored Data records with a new model")
+    parser.add_argument("--mode", choices=["diagnosis", "history"], default="diagnosis")
+    parser.add_argument("--model", default=None, help=f"Mặc định {DIAGNOSIS_MODEL} / {HISTORY_MODEL} theo --mode")
+    parser.add_argument("--meta", default=HISTORY_META, help="history_features.json (--mode history)")
+    parser.add_argument("--uri", default=DEFAULT_URI, help="MongoDB URI")
+    parser.add_argument("--days", type=int, default=None, help="Chỉ record trong N ngày gần nhất (mặc định: tất cả)")
+    parser.add_argument("--startDate", type=str, default=None, help="ISO start date (YYYY-MM-DD)")
+    parser.add_argument("--endDate", type=str, default=None, help="ISO end date (YYYY-MM-DD)")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="Số record mỗi lần predict")
+    parser.add_argument("--write-batch", type=int, default=1000, help="Số UpdateOne mỗi bulk_write")
+    parser.add_argument("--jobs", type=int, default=-1, help="Số process predict (-1 = số CPU, 1 = không dùng pool)")
+    parser.add_argument("--limit", type=int, default=None, help="Chỉ xử lý N record đầu")
+    parser.add_argument("--dry-run", action="store_true", help="Predict nhưng không ghi lại MongoDB")
+    parser.add_argument("--sync-status", choices=SYNC_STATUS_CHOICES, default="derived",
+                        help="--mode diagnosis: ghi status theo severity mới cho record có status suy ra từ "
+                             "severity cũ (derived), mọi record (all) hoặc không (none)")
+    args = parser.parse_args()
+
+    print(f"🔁 Rescoring Data records ({args.mode}) from {args.uri}")
+    try:
+        stats = rescore(args)
+    except FileNotFoundError as exc:
+        print(f"❌ Model file không tồn tại: {exc}")
+        sys.exit(1)
+
+    print(f"✅ {stats['records']} records in {stats['elapsed_s']:.2f}s -> {stats['records_per_s']:.0f} records/s "
+          f"({stats['chunks']} chunks, jobs={stats['jobs']}, modified={stats['modified']}{', dry run' if args.dry_run else ''})")
+    # score_s là tổng thời gian predict của mọi worker (chạy song song nên có thể > elapsed)
+    print(f"   fetch {stats['fetch_s']:.2f}s | score {stats['score_s']:.2f}s | write {stats['write_s']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
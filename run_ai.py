@@ -8,8 +8,13 @@ Script để chạy AI chẩn đoán nhịp tim
 import sys
 import json
 import os
+import time
+import timing
+_IMPORT_STARTED = time.perf_counter()
 import joblib
 from ai_heart_diagnosis import HeartDiagnosisAI
+from diagnosis_lut import load_lut_for
+timing.record("import", (time.perf_counter() - _IMPORT_STARTED) * 1000)
 
 def _build_feature_vector(heart_rate, age, sex, trestbps, chol):
     """Derive more realistic feature values so ML model reacts to resting BPM."""
@@ -74,7 +79,14 @@ def _attach_trained_artifacts(ai_instance, model_path):
     """Load joblib artifacts (model + scaler + metadata) and attach to AI instance."""
     try:
         print(f"📦 Đang load artifacts từ {model_path}...")
-        artifacts = joblib.load(model_path)
+        if model_path.endswith(".npz"):
+            # Model đã export bằng numpy_model.py: không cần import scikit-learn
+            from numpy_model import load_numpy_model
+            artifacts = load_numpy_model(model_path)
+        else:
+            # mmap_mode='c' (copy-on-write): numpy buffers map thẳng từ file, các process dùng chung
+            # page cache; không dùng 'r' vì libsvm (SVC.predict_proba) không nhận buffer read-only
+            artifacts = joblib.load(model_path, mmap_mode="c")
         print(f"✅ Load thành công. Type: {type(artifacts)}")
     except Exception as exc:
         print(f"❌ Không thể load model từ {model_path}: {exc}")
@@ -141,68 +153,151 @@ def _ensure_model_loaded(ai_instance, model_path):
     print("🔄 Fallback: Load thủ công bằng joblib...")
     return _attach_trained_artifacts(ai_instance, model_path)
 
+MODEL_PATH = "heart_diagnosis_model.pkl"
+
+def load_diagnosis_ai(model_path=MODEL_PATH, use_lut=True):
+    """Tạo HeartDiagnosisAI và load artifacts; trả về None nếu không load được.
+
+    use_lut: gắn lookup table <model>.lut.npz (diagnosis_lut.py) nếu có và khớp model.
+    """
+    ai = HeartDiagnosisAI()
+    ai.lut = None
+
+    if not os.path.exists(model_path):
+        print(f"❌ Model file không tồn tại: {model_path}")
+        return None
+
+    with timing.span("load"):
+        loaded = _ensure_model_loaded(ai, model_path)
+    if not loaded:
+        print("❌ Không thể load model")
+        return None
+
+    # Kiểm tra lần cuối trước khi predict
+    if not hasattr(ai, "model") or ai.model is None:
+        print("❌ ai.model vẫn là None sau khi load")
+        return None
+
+    print(f"✅ Model đã sẵn sàng. Type: {type(ai.model)}")
+
+    # Kiểm tra scaler có bị mất không
+    has_scaler = hasattr(ai, "scaler") and ai.scaler is not None
+    print(f"🔍 Scaler status: {has_scaler}")
+    if has_scaler:
+        print(f"   Scaler type: {type(ai.scaler)}")
+
+    if use_lut:
+        with timing.span("load"):
+            ai.lut = load_lut_for(ai, model_path)
+
+    return ai
+
+def diagnose_with_ai(ai, heart_rate, age=30, sex=1, trestbps=120, chol=200):
+    """Chẩn đoán một lần đo với AI đã load sẵn (dùng chung cho CLI và ai_server.py)"""
+    with timing.span("features"):
+        features = _build_feature_vector(heart_rate, age, sex, trestbps, chol)
+    print(f"📊 Features: {features}")
+
+    # Debug: kiểm tra ai.model và ai.scaler trước khi gọi predict
+    print(f"🔍 Trước khi predict:")
+    print(f"   ai.model: {type(ai.model) if hasattr(ai, 'model') and ai.model else 'None'}")
+    print(f"   ai.scaler: {type(ai.scaler) if hasattr(ai, 'scaler') and ai.scaler else 'None'}")
+
+    # Input trên lưới của lookup table: đọc kết quả đã tính sẵn, không gọi model
+    lut = getattr(ai, "lut", None)
+    prediction = None
+    if lut is not None:
+        with timing.span("lookup"):
+            prediction = lut.lookup(heart_rate, age, sex, trestbps, chol)
+
+    try:
+        if prediction is None:
+            prediction = ai.predict_heart_rate_risk(features)
+    except AttributeError as attr_err:
+        print(f"⚠️ AttributeError trong predict_heart_rate_risk: {attr_err}")
+        print(f"   Checking ai attributes: model={getattr(ai, 'model', 'MISSING')}, scaler={getattr(ai, 'scaler', 'MISSING')}")
+        raise
+
+    # Dùng lại prediction ở trên, không predict lần hai trong generate_insights
+    with timing.span("insights"):
+        insights = ai.generate_insights(features, prediction)
+
+    return _build_result(heart_rate, prediction, insights)
+
+def _build_result(heart_rate, prediction, insights):
+    """Ghép prediction + insights thành kết quả trả về cho Node.js"""
+    # prepend note about actual resting heart rate
+    hr_note = ""
+    if heart_rate >= 140:
+        hr_note = f"Nhịp tim lúc nghỉ {heart_rate} bpm rất cao. "
+    elif heart_rate >= 120:
+        hr_note = f"Nhịp tim lúc nghỉ {heart_rate} bpm cao. "
+    elif heart_rate <= 50:
+        hr_note = f"Nhịp tim lúc nghỉ {heart_rate} bpm thấp bất thường. "
+
+    risk_assessment = (hr_note + insights["risk_assessment"]).strip()
+
+    return {
+        'severity': prediction['severity'],
+        'confidence': prediction['confidence'],
+        'risk_assessment': risk_assessment,
+        'recommendations': insights['recommendations'],
+        'risk_factors': insights['risk_factors']
+    }
+
+def _parse_reading(request):
+    """Đọc (heart_rate, age, sex, trestbps, chol) từ một request JSON, mặc định giống main()"""
+    heart_rate = request.get("heart_rate", request.get("heartRate"))
+    if heart_rate is None:
+        raise ValueError("heart_rate is required")
+    return (
+        float(heart_rate),
+        float(request.get("age", 50) or 50),
+        int(request.get("sex", 1) if request.get("sex") is not None else 1),
+        float(request.get("trestbps", 120) or 120),
+        float(request.get("chol", 200) or 200),
+    )
+
+def diagnose_batch_with_ai(ai, readings):
+    """Chẩn đoán nhiều lần đo bằng một lần predict_batch.
+
+    readings: list các tuple (heart_rate, age, sex, trestbps, chol).
+    Trả về list kết quả cùng định dạng với diagnose_with_ai.
+    """
+    if not readings:
+        return []
+
+    feature_rows = [_build_feature_vector(*reading) for reading in readings]
+
+    # Lần đo trên lưới lookup table lấy kết quả từ bảng; chỉ phần còn lại đi qua predict_batch
+    lut = getattr(ai, "lut", None)
+    predictions = [lut.lookup(*reading) for reading in readings] if lut is not None else [None] * len(readings)
+    misses = [i for i, prediction in enumerate(predictions) if prediction is None]
+    if misses:
+        batch = ai.predict_batch([feature_rows[i] for i in misses])
+        for j, i in enumerate(misses):
+            predictions[i] = {
+                'severity': int(batch['severity'][j]),
+                'confidence': float(batch['confidence'][j]),
+                'probabilities': batch['probabilities'][j].tolist(),
+                'risk_level': batch['risk_level'][j]
+            }
+
+    results = []
+    for reading, features, prediction in zip(readings, feature_rows, predictions):
+        insights = ai.generate_insights(features, prediction)
+        results.append(_build_result(reading[0], prediction, insights))
+    return results
+
 def run_ai_diagnosis(heart_rate, age=30, sex=1, trestbps=120, chol=200):
     """Chạy AI diagnosis với các tham số đầu vào"""
     try:
-        ai = HeartDiagnosisAI()
-
-        model_path = "heart_diagnosis_model.pkl"
-        if not os.path.exists(model_path):
-            print(f"❌ Model file không tồn tại: {model_path}")
-            return None
-            
-        if not _ensure_model_loaded(ai, model_path):
-            print("❌ Không thể load model")
-            return None
-
-        # Kiểm tra lần cuối trước khi predict
-        if not hasattr(ai, "model") or ai.model is None:
-            print("❌ ai.model vẫn là None sau khi load")
-            return None
-            
-        print(f"✅ Model đã sẵn sàng. Type: {type(ai.model)}")
-
-        # Kiểm tra scaler có bị mất không
-        has_scaler = hasattr(ai, "scaler") and ai.scaler is not None
-        print(f"🔍 Scaler status: {has_scaler}")
-        if has_scaler:
-            print(f"   Scaler type: {type(ai.scaler)}")
+        with timing.trace("run_ai_diagnosis", heart_rate=heart_rate):
+            ai = load_diagnosis_ai(MODEL_PATH)
+            if ai is None:
+                return None
 
-        features = _build_feature_vector(heart_rate, age, sex, trestbps, chol)
-        print(f"📊 Features: {features}")
-        
-        # Debug: kiểm tra ai.model và ai.scaler trước khi gọi predict
-        print(f"🔍 Trước khi predict:")
-        print(f"   ai.model: {type(ai.model) if hasattr(ai, 'model') and ai.model else 'None'}")
-        print(f"   ai.scaler: {type(ai.scaler) if hasattr(ai, 'scaler') and ai.scaler else 'None'}")
-        
-        try:
-            prediction = ai.predict_heart_rate_risk(features)
-        except AttributeError as attr_err:
-            print(f"⚠️ AttributeError trong predict_heart_rate_risk: {attr_err}")
-            print(f"   Checking ai attributes: model={getattr(ai, 'model', 'MISSING')}, scaler={getattr(ai, 'scaler', 'MISSING')}")
-            raise
-            
-        insights = ai.generate_insights(features)
-
-        # prepend note about actual resting heart rate
-        hr_note = ""
-        if heart_rate >= 140:
-            hr_note = f"Nhịp tim lúc nghỉ {heart_rate} bpm rất cao. "
-        elif heart_rate >= 120:
-            hr_note = f"Nhịp tim lúc nghỉ {heart_rate} bpm cao. "
-        elif heart_rate <= 50:
-            hr_note = f"Nhịp tim lúc nghỉ {heart_rate} bpm thấp bất thường. "
-
-        risk_assessment = (hr_note + insights["risk_assessment"]).strip()
-
-        return {
-            'severity': prediction['severity'],
-            'confidence': prediction['confidence'],
-            'risk_assessment': risk_assessment,
-            'recommendations': insights['recommendations'],
-            'risk_factors': insights['risk_factors']
-        }
+            return diagnose_with_ai(ai, heart_rate, age, sex, trestbps, chol)
 
     except Exception as e:
         import traceback
@@ -211,11 +306,82 @@ def run_ai_diagnosis(heart_rate, age=30, sex=1, trestbps=120, chol=200):
         traceback.print_exc()
         return None
 
+def stream_main(argv):
+    """Chế độ streaming: JSONL request từ stdin -> JSONL kết quả ra stdout.
+
+    Mỗi dòng vào: {"id": ..., "heart_rate": 85, "age": 45, "sex": 1, "trestbps": 130, "chol": 220}
+    Mỗi dòng ra:  {"id": ..., "ok": true, "result": {...}} hoặc {"id": ..., "ok": false, "error": "..."}
+    Model load một lần; các dòng được gom theo --batch-size và chạy qua predict_batch.
+    Không ghi ai_result.json; log debug ra stderr.
+    """
+    import argparse
+    import contextlib
+
+    parser = argparse.ArgumentParser(description="Batch heart diagnosis over stdin/stdout JSONL")
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--model", default=MODEL_PATH)
+    args = parser.parse_args(argv)
+
+    out = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        ai = load_diagnosis_ai(args.model)
+        if ai is None:
+            print("❌ Không thể load model cho chế độ stream")
+            return 1
+
+        def flush(pending):
+            readings = [reading for _, reading, _ in pending if reading is not None]
+            try:
+                results = iter(diagnose_batch_with_ai(ai, readings))
+                batch_error = None
+            except Exception as exc:
+                results, batch_error = None, str(exc)
+
+            for req_id, reading, error in pending:
+                if reading is None or batch_error is not None:
+                    response = {"id": req_id, "ok": False, "error": error or batch_error}
+                else:
+                    response = {"id": req_id, "ok": True, "result": next(results)}
+                out.write(json.dumps(response, ensure_ascii=False) + "\n")
+            out.flush()
+
+        pending = []
+        for line in sys.stdin:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as exc:
+                pending.append((None, None, f"Invalid JSON: {exc}"))
+                continue
+            if not isinstance(request, dict):
+                pending.append((None, None, "Request must be a JSON object"))
+                continue
+
+            try:
+                pending.append((request.get("id"), _parse_reading(request), None))
+            except (ValueError, TypeError) as exc:
+                pending.append((request.get("id"), None, str(exc)))
+
+            if len(pending) >= args.batch_size:
+                flush(pending)
+                pending = []
+
+        if pending:
+            flush(pending)
+    return 0
+
 def main():
     """Main function khi chạy từ command line"""
+    if "--stream" in sys.argv[1:]:
+        sys.exit(stream_main(sys.argv[1:]))
+
     if len(sys.argv) < 2:
         print("❌ Cần ít nhất 1 tham số: heart_rate")
         print("📝 Cách dùng: python3 run_ai.py <heart_rate> [age] [sex] [trestbps] [chol]")
+        print("📝 Hoặc batch: python3 run_ai.py --stream < requests.jsonl > results.jsonl")
         sys.exit(1)
 
     try:
@@ -229,14 +395,16 @@ def main():
         print(f"🔍 Đang chẩn đoán với nhịp tim: {heart_rate} bpm")
         print(f"📊 Thông tin bổ sung: Tuổi {age}, Giới tính {sex}, HA {trestbps}, Cholesterol {chol}")
 
-        # Chạy AI diagnosis
-        result = run_ai_diagnosis(heart_rate, age, sex, trestbps, chol)
+        # Chạy AI diagnosis (trace ngoài cùng để span serialize nằm cùng dòng metrics)
+        with timing.trace("run_ai_diagnosis", heart_rate=heart_rate):
+            result = run_ai_diagnosis(heart_rate, age, sex, trestbps, chol)
 
-        if result:
-            # Lưu kết quả vào file JSON để Node.js đọc
-            with open('ai_result.json', 'w', encoding='utf-8') as f:
-                json.dump(result, f, ensure_ascii=False, indent=2)
+            if result:
+                # Lưu kết quả vào file JSON để Node.js đọc
+                with timing.span("serialize"), open('ai_result.json', 'w', encoding='utf-8') as f:
+                    json.dump(result, f, ensure_ascii=False, indent=2)
 
+        if result:
             # In kết quả ra console
             print("\n" + "="*50)
             print("🩺 KẾT QUẢ CHẨN ĐOÁN AI")
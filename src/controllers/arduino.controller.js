@@ -113,7 +113,7 @@ const _saveArduinoDataForUser = async (userIdRaw, payload, res) => {
 
         // Run AI diagnosis (best-effort)
         try {
-            const aiResult = await diagnoseHeartRate({ heartRate: Number(bpm), age: payload.age, sex: payload.sex, trestbps: payload.trestbps, chol: payload.chol });
+            const aiResult = await diagnoseHeartRate({ heartRate: Number(bpm), deviceId: payload.deviceId, userId, age: payload.age, sex: payload.sex, trestbps: payload.trestbps, chol: payload.chol });
             if (aiResult && aiResult.diagnosis) {
                 const diag = aiResult.diagnosis;
                 dataDoc.aiDiagnosis = {
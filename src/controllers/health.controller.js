@@ -1,7 +1,7 @@
 // src/controllers/health.controller.js
 import { buildHealthDashboard } from "../services/health.service.js";
 import { analyzeHeartRate } from "../services/analysis.service.js";
-import { predictHistoryModel } from "../services/historyModel.service.js";
+import { predictHistoryModel, predictHistoryModelBatch } from "../services/historyModel.service.js";
 
 // GET /api/health/dashboard
 export const getHealthDashboard = async (req, res) => {
@@ -35,9 +35,19 @@ export const getHeartRateAnalysis = async (req, res) => {
 // POST /api/health/predict-history
 export const postPredictHistory = async (req, res) => {
     try {
-        const { heartRate, age, gender, weight, conditions, hour } = req.body;
+        // Batch: { rows: [{ heartRate, age, gender, weight, conditions, hour, deviceId, timestamp, recent }, ...] }
+        if (Array.isArray(req.body.rows)) {
+            if (req.body.rows.length === 0 || req.body.rows.some((row) => row?.heartRate === undefined)) {
+                return res.status(400).json({ error: "Every row requires heartRate" });
+            }
+            const rows = req.body.rows.map((row) => ({ ...row, heartRate: Number(row.heartRate) }));
+            const results = await predictHistoryModelBatch(rows);
+            return res.json({ success: true, predictions: results.map(({ prediction, input, meta }) => ({ prediction, input, meta })) });
+        }
+
+        const { heartRate, age, gender, weight, conditions, hour, deviceId, timestamp, recent } = req.body;
         if (heartRate === undefined) return res.status(400).json({ error: "heartRate is required" });
-        const result = await predictHistoryModel({ heartRate: Number(heartRate), age, gender, weight, conditions, hour });
+        const result = await predictHistoryModel({ heartRate: Number(heartRate), age, gender, weight, conditions, hour, deviceId, timestamp, recent });
         res.json({ success: true, prediction: result.prediction, input: result.input, meta: result.meta });
     } catch (error) {
         // Return a consistent English message
@@ -42,6 +42,12 @@ const DataSchema = new mongoose.Schema({
         aiModel: String,
         diagnosedAt: Date,
     },
+    // History model prediction (ghi bởi rescore_history.py --mode history)
+    historyPrediction: {
+        label: String,
+        confidence: Number,
+        predictedAt: Date,
+    },
     timestamp: {
         type: Date,
         default: Date.now,
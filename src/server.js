@@ -12,6 +12,8 @@ import adminRoutes from "./routes/admin.routes.js";
 import dashboardRoutes from "./routes/dashboard.routes.js";
 import devicesRoutes from "./routes/devices.routes.js";
 import heartRateApiRoutes from "./routes/heart-rate.routes.js";
+import { getAIWorkerHealth } from "./services/ai.service.js";
+import { getHistoryWorkerHealth } from "./services/historyModel.service.js";
 
 const app = express();
 app.use(cors());
@@ -55,6 +57,16 @@ app.get("/", (req, res) => {
 app.get("/health", (req, res) => {
     res.status(200).json({ status: "ok" });
 });
+// Python AI worker (ai_server.py): spawn lần đầu nếu chưa chạy, trả về model/uptime/request count
+app.get("/health/ai", async (req, res) => {
+    const result = await getAIWorkerHealth();
+    res.status(result.success ? 200 : 503).json(result);
+});
+// History model worker (history_server.py): latency p50/p99, số lần reload model
+app.get("/health/history", async (req, res) => {
+    const result = await getHistoryWorkerHealth();
+    res.status(result.success ? 200 : 503).json(result);
+});
 
 // Routes
 app.use("/api/data", dataRoutes);
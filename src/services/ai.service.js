@@ -3,6 +3,7 @@ import * as tf from "@tensorflow/tfjs-node";
 import fs from "fs";
 import path from "path";
 import { fileURLToPath } from "url";
+import { createPythonWorker } from "./pythonWorker.service.js";
 
 const __filename = fileURLToPath(import.meta.url);
 const __dirname = path.dirname(__filename);
@@ -219,8 +220,75 @@ export const diagnoseHeartRate = async (heartRateData) => {
     }
 };
 
+// ===== Persistent Python AI worker (ai_server.py) =====
+// Spawn một lần và giữ model trong bộ nhớ; request/response là JSONL qua stdin/stdout
+const aiWorker = createPythonWorker({
+    name: "Python AI worker",
+    script: "ai_server.py",
+    // Ưu tiên model đã export bằng numpy_model.py (không cần import scikit-learn) nếu không cũ hơn file .pkl
+    getArgs: () => {
+        const pklPath = path.join(process.cwd(), "heart_diagnosis_model.pkl");
+        const npzPath = path.join(process.cwd(), "heart_diagnosis_model.npz");
+        const useNpz = fs.existsSync(npzPath) && (!fs.existsSync(pklPath) || fs.statSync(npzPath).mtimeMs >= fs.statSync(pklPath).mtimeMs);
+        const args = useNpz ? ["--model", npzPath] : [];
+        // AI_MAX_BATCH > 0: worker gom các request đồng thời thành một predict_batch (microbatch.py)
+        const maxBatch = Number(process.env.AI_MAX_BATCH || 0);
+        if (maxBatch > 0) args.push("--max-batch", String(maxBatch), "--max-wait-ms", String(process.env.AI_MAX_WAIT_MS || 2));
+        // AI_GATE=1: reading bình thường so với lịch sử của device không gọi model (anomaly_gate.py)
+        if (process.env.AI_GATE === "1") args.push("--gate");
+        return args;
+    },
+    startupTimeoutMs: Number(process.env.AI_WORKER_STARTUP_TIMEOUT_MS || 60000),
+    requestTimeoutMs: Number(process.env.AI_WORKER_TIMEOUT_MS || 5000),
+});
+
+const requestAIWorker = (payload, timeoutMs) => aiWorker.request(payload, timeoutMs);
+
+export const getAIWorkerHealth = () => aiWorker.health();
+
+const buildPythonDiagnosis = (insights) => {
+    const severityLevels = ["low", "medium", "high", "high", "critical"];
+    return {
+        diagnosis: getDiagnosisTitle(insights.severity),
+        severity: typeof insights.severity === "number" ? severityLevels[insights.severity] : insights.severity,
+        analysis: insights.risk_assessment || "",
+        recommendations: insights.recommendations || [],
+        riskFactors: insights.risk_factors || [],
+        needsAttention: insights.severity >= 2,
+        urgencyLevel: getUrgencyLevel(insights.severity),
+    };
+};
+
 // ===== Advanced Python AI Diagnosis =====
 const diagnoseWithPythonAI = async (heartRateData) => {
+    const { heartRate, age = 50, sex = 1, trestbps = 120, chol = 200, deviceId, userId, timestamp } = heartRateData;
+    try {
+        const device = deviceId ?? userId;
+        const insights = await requestAIWorker({
+            op: "diagnose", heart_rate: heartRate, age, sex, trestbps, chol,
+            device_id: device != null ? String(device) : null,
+            timestamp: timestamp ? new Date(timestamp).getTime() : Date.now(),
+        });
+        if (insights.gated) {
+            // Worker chạy với --gate: reading clearly-normal của device, không gọi model
+            return { ...getRuleBasedDiagnosis(heartRateData), raw: { worker: true, gated: true } };
+        }
+        return {
+            success: true,
+            diagnosis: buildPythonDiagnosis(insights),
+            aiModel: "python-advanced-ai",
+            timestamp: new Date(),
+            raw: { worker: true, result: insights },
+        };
+    } catch (workerError) {
+        console.warn("Python AI worker unavailable, spawning run_ai.py:", workerError?.message || workerError);
+        return diagnoseWithPythonProcess(heartRateData);
+    }
+};
+
+// ===== One-shot run_ai.py --stream spawn (fallback khi worker không chạy được) =====
+// Gửi một dòng JSONL qua stdin và đọc kết quả từ stdout, không dùng file ai_result.json chung
+const diagnoseWithPythonProcess = async (heartRateData) => {
     const { spawn } = await import("child_process");
 
     return new Promise((resolve, reject) => {
@@ -229,25 +297,16 @@ const diagnoseWithPythonAI = async (heartRateData) => {
 
             const venvPython = path.join(process.cwd(), "ai_env", "bin", "python3");
             const scriptPath = path.join(process.cwd(), "run_ai.py");
-            const resultPath = path.join(process.cwd(), "ai_result.json");
 
             if (!fs.existsSync(scriptPath)) {
                 return reject(new Error(`Python AI script not found at ${scriptPath}`));
             }
 
-            // Remove stale result so we only accept fresh outputs
-            try {
-                if (fs.existsSync(resultPath)) fs.unlinkSync(resultPath);
-            } catch (e) {
-                // non-fatal
-                console.warn("Could not remove previous ai_result.json:", e?.message || e);
-            }
-
             const pythonCandidates = [];
             if (fs.existsSync(venvPython)) pythonCandidates.push(venvPython);
             pythonCandidates.push("python3", "python");
 
-            const startTime = Date.now();
+            const request = JSON.stringify({ id: "1", heart_rate: heartRate, age, sex, trestbps, chol }) + "\n";
             let stdout = "";
             let stderr = "";
             let tried = [];
@@ -261,7 +320,7 @@ const diagnoseWithPythonAI = async (heartRateData) => {
 
                 let child;
                 try {
-                    child = spawn(pythonExec, [scriptPath, String(heartRate), String(age), String(sex), String(trestbps), String(chol)], { cwd: process.cwd() });
+                    child = spawn(pythonExec, [scriptPath, "--stream"], { cwd: process.cwd() });
                 } catch (err) {
                     // try next candidate
                     return tryExec(idx + 1);
@@ -269,6 +328,7 @@ const diagnoseWithPythonAI = async (heartRateData) => {
 
                 stdout = "";
                 stderr = "";
+                let spawnFailed = false;
 
                 child.stdout.on("data", (d) => {
                     stdout += d.toString();
@@ -276,82 +336,40 @@ const diagnoseWithPythonAI = async (heartRateData) => {
                 child.stderr.on("data", (d) => {
                     stderr += d.toString();
                 });
+                child.stdin.on("error", () => {
+                    // process died before reading stdin; reported by "error"/"close"
+                });
 
                 child.on("error", (err) => {
                     // try next candidate
+                    spawnFailed = true;
                     stderr += `\nspawn-error:${err.message || err}`;
                     return tryExec(idx + 1);
                 });
 
                 child.on("close", (code) => {
-                    // Prefer ai_result.json if created after startTime
-                    try {
-                        if (fs.existsSync(resultPath)) {
-                            const st = fs.statSync(resultPath);
-                            if (st.mtimeMs >= startTime - 5000) {
-                                // allow small clock skew
-                                const raw = fs.readFileSync(resultPath, "utf8");
-                                const insights = safeJsonParse(raw, null);
-                                if (insights) {
-                                    const severityLevels = ["low", "medium", "high", "high", "critical"];
-                                    const sev = typeof insights.severity === "number" ? insights.severity : insights.severity ?? insights.severity_level ?? insights.severityIndex;
-                                    const severityIndex = typeof sev === "number" ? sev : typeof insights.severity === "string" ? null : null;
-                                    const severity = typeof severityIndex === "number" ? severityLevels[severityIndex] : Array.isArray(severityLevels) && insights.severity in severityLevels ? severityLevels[insights.severity] : severityLevels[insights.severity] || "low";
-                                    const diagnosis = {
-                                        diagnosis: insights.diagnosis || getDiagnosisTitle(insights.severity ?? insights.severityIndex),
-                                        severity: insights.severity_text || insights.severity_label || (typeof insights.severity === "number" ? severityLevels[insights.severity] : severity),
-                                        analysis: insights.risk_assessment || insights.analysis || insights.note || "",
-                                        recommendations: insights.recommendations || insights.recs || [],
-                                        riskFactors: insights.risk_factors || insights.riskFactors || [],
-                                        needsAttention: (typeof insights.severity === "number" && insights.severity >= 2) || insights.needsAttention || false,
-                                        urgencyLevel: insights.urgency || getUrgencyLevel(insights.severity),
-                                    };
-                                    return resolve({
-                                        success: true,
-                                        diagnosis,
-                                        aiModel: "python-advanced-ai",
-                                        timestamp: new Date(),
-                                        raw: { stdout, stderr, exitCode: code, file: insights },
-                                    });
-                                }
-                            }
-                        }
-                    } catch (readErr) {
-                        // continue to stdout parse
-                    }
-
-                    // Try parse stdout as JSON
-                    const trimmed = stdout.trim();
-                    if (trimmed) {
-                        const parsed = safeJsonParse(trimmed, null);
-                        if (parsed) {
-                            const severityLevels = ["low", "medium", "high", "high", "critical"];
-                            const severity = typeof parsed.severity === "number" ? severityLevels[parsed.severity] : parsed.severity;
-                            const diagnosis = {
-                                diagnosis: parsed.diagnosis || getDiagnosisTitle(parsed.severity),
-                                severity: severity,
-                                analysis: parsed.risk_assessment || parsed.analysis || "",
-                                recommendations: parsed.recommendations || [],
-                                riskFactors: parsed.risk_factors || [],
-                                needsAttention: parsed.severity >= 2,
-                                urgencyLevel: getUrgencyLevel(parsed.severity),
-                            };
-                            return resolve({
-                                success: true,
-                                diagnosis,
-                                aiModel: "python-advanced-ai",
-                                timestamp: new Date(),
-                                raw: { stdout, stderr, exitCode: code },
-                            });
-                        }
+                    if (spawnFailed) return;
+
+                    const lines = stdout.trim().split("\n");
+                    const response = safeJsonParse(lines[lines.length - 1], null);
+                    if (response && response.ok && response.result) {
+                        return resolve({
+                            success: true,
+                            diagnosis: buildPythonDiagnosis(response.result),
+                            aiModel: "python-advanced-ai",
+                            timestamp: new Date(),
+                            raw: { stdout, stderr, exitCode: code },
+                        });
                     }
 
                     // No usable output — fail with diagnostics
-                    const details = new Error(`Python AI exited code=${code}. stdout=${stdout} stderr=${stderr}`);
+                    const details = new Error(`Python AI exited code=${code}. error=${response?.error || ""} stdout=${stdout} stderr=${stderr}`);
                     // attach raw for upstream logging
                     details.raw = { stdout, stderr, exitCode: code, tried };
                     return reject(details);
                 });
+
+                child.stdin.end(request);
             };
 
             tryExec(0);
@@ -514,4 +532,4 @@ export function analyzeHeartRate(bpm) {
     };
 }
 
-export default { diagnoseHeartRate, analyzeTrend };
+export default { diagnoseHeartRate, analyzeTrend, getAIWorkerHealth };
@@ -1,21 +1,43 @@
 // src/services/historyModel.service.js
-// Service gọi Python script predict_history_model.py để dự đoán bằng history model
+// Service dự đoán bằng history model: ưu tiên worker Python chạy lâu dài (history_server.py),
+// fallback spawn predict_history_model.py cho mỗi lần gọi nếu worker không chạy được
 import { spawn } from 'child_process';
 import path from 'path';
+import { createPythonWorker, resolvePythonExec } from './pythonWorker.service.js';
 
-const PYTHON_PATH = path.join(process.cwd(), 'ai_env', 'bin', 'python3');
 const SCRIPT_PATH = path.join(process.cwd(), 'predict_history_model.py');
 
-export function predictHistoryModel({ heartRate, age, gender, weight, conditions = [], hour }) {
+const historyWorker = createPythonWorker({
+  name: 'History model worker',
+  script: 'history_server.py',
+  startupTimeoutMs: Number(process.env.HISTORY_WORKER_STARTUP_TIMEOUT_MS || 60000),
+  requestTimeoutMs: Number(process.env.HISTORY_WORKER_TIMEOUT_MS || 5000),
+});
+
+// deviceId/timestamp/recent chỉ dùng khi model được train với --window-features
+const toRow = ({ heartRate, age, gender, weight, conditions = [], hour, deviceId, timestamp, recent }) => ({
+  heartRate,
+  age: age ?? null,
+  gender: gender ?? null,
+  weight: weight ?? null,
+  conditions: Array.isArray(conditions) ? conditions : String(conditions || '').split(',').filter(Boolean),
+  hour: typeof hour === 'number' ? hour : null,
+  deviceId: deviceId ?? null,
+  timestamp: timestamp ?? null,
+  recent: Array.isArray(recent) ? recent : [],
+});
+
+function predictWithProcess({ heartRate, age, gender, weight, conditions = [], hour, recent }) {
   return new Promise((resolve, reject) => {
-    if (typeof heartRate !== 'number') {
-      return reject(new Error('heartRate must be number'));
-    }
     const condArg = Array.isArray(conditions) ? conditions.join(',') : String(conditions || '');
-    const args = [SCRIPT_PATH, '--heartRate', heartRate.toString(), '--age', String(age ?? ''), '--gender', String(gender ?? 'other'), '--weight', String(weight ?? ''), '--conditions', condArg];
+    const args = [SCRIPT_PATH, '--heartRate', heartRate.toString(), '--gender', String(gender ?? 'other'), '--conditions', condArg];
+    // Bỏ qua giá trị thiếu để script dùng default (argparse không parse được chuỗi rỗng thành float)
+    if (age !== undefined && age !== null && age !== '') args.push('--age', String(age));
+    if (weight !== undefined && weight !== null && weight !== '') args.push('--weight', String(weight));
     if (typeof hour === 'number') args.push('--hour', hour.toString());
+    if (Array.isArray(recent) && recent.length) args.push('--recent', recent.join(','));
 
-    const py = spawn(PYTHON_PATH, args, { cwd: process.cwd() });
+    const py = spawn(resolvePythonExec(), args, { cwd: process.cwd() });
     let stdout = ''; let stderr = '';
     py.stdout.on('data', d => { stdout += d.toString(); });
     py.stderr.on('data', d => { stderr += d.toString(); });
@@ -34,4 +56,60 @@ export function predictHistoryModel({ heartRate, age, gender, weight, conditions
   });
 }
 
-export default { predictHistoryModel };
+// Fallback cho batch: một process, các row gửi qua stdin (predict_history_model.py --batch -)
+function predictBatchWithProcess(inputs) {
+  return new Promise((resolve, reject) => {
+    const py = spawn(resolvePythonExec(), [SCRIPT_PATH, '--batch', '-'], { cwd: process.cwd() });
+    let stdout = ''; let stderr = '';
+    py.stdout.on('data', d => { stdout += d.toString(); });
+    py.stderr.on('data', d => { stderr += d.toString(); });
+    py.on('close', code => {
+      if (code !== 0) {
+        return reject(new Error(`Python exited ${code}: ${stderr}`));
+      }
+      try {
+        const json = JSON.parse(stdout.trim());
+        resolve(json.predictions.map(prediction => ({ success: true, ...prediction })));
+      } catch (e) {
+        reject(new Error('Failed to parse python output: ' + e.message + ' raw=' + stdout));
+      }
+    });
+    py.on('error', err => reject(err));
+    py.stdin.on('error', err => reject(err));
+    py.stdin.end(inputs.map(input => JSON.stringify(toRow(input))).join('\n'));
+  });
+}
+
+export async function predictHistoryModel(input) {
+  if (typeof input?.heartRate !== 'number') {
+    throw new Error('heartRate must be number');
+  }
+  try {
+    const result = await historyWorker.request({ op: 'predict', ...toRow(input) });
+    return { success: true, ...result };
+  } catch (workerError) {
+    console.warn('History model worker unavailable, spawning predict_history_model.py:', workerError?.message || workerError);
+    return predictWithProcess(input);
+  }
+}
+
+// Nhiều row trong một request tới worker (một lần predict_proba cho cả batch)
+export async function predictHistoryModelBatch(inputs) {
+  if (!Array.isArray(inputs) || inputs.length === 0) {
+    throw new Error('inputs must be a non-empty array');
+  }
+  if (inputs.some(input => typeof input?.heartRate !== 'number')) {
+    throw new Error('heartRate must be number');
+  }
+  try {
+    const result = await historyWorker.request({ op: 'predict', rows: inputs.map(toRow) });
+    return result.predictions.map(prediction => ({ success: true, ...prediction }));
+  } catch (workerError) {
+    console.warn('History model worker unavailable, spawning predict_history_model.py --batch:', workerError?.message || workerError);
+    return predictBatchWithProcess(inputs);
+  }
+}
+
+export const getHistoryWorkerHealth = () => historyWorker.health();
+
+export default { predictHistoryModel, predictHistoryModelBatch, getHistoryWorkerHealth };
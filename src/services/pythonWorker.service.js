@@ -0,0 +1,129 @@
+// src/services/pythonWorker.service.js
+// Python worker chạy lâu dài (ai_server.py, history_server.py): spawn một lần, giữ model trong
+// bộ nhớ, request/response là JSONL qua stdin/stdout (xem inference_worker.py)
+import fs from "fs";
+import path from "path";
+import { spawn } from "child_process";
+import { createInterface } from "readline";
+
+const safeJsonParse = (text, fallback) => {
+    try {
+        return JSON.parse(text);
+    } catch {
+        return fallback;
+    }
+};
+
+export const resolvePythonExec = () => {
+    const venvPython = path.join(process.cwd(), "ai_env", "bin", "python3");
+    return fs.existsSync(venvPython) ? venvPython : "python3";
+};
+
+// name: tên hiển thị trong log/lỗi; script: file .py trong thư mục gốc; getArgs(): tham số thêm lúc spawn
+export const createPythonWorker = ({ name, script, getArgs = () => [], startupTimeoutMs = 60000, requestTimeoutMs = 5000 }) => {
+    let workerPromise = null;
+
+    // release(): bỏ workerPromise, chỉ khi nó vẫn là của lần start() này
+    const start = async (release) => {
+        const scriptPath = path.join(process.cwd(), script);
+        if (!fs.existsSync(scriptPath)) {
+            throw new Error(`${name} script not found at ${scriptPath}`);
+        }
+
+        const child = spawn(resolvePythonExec(), [scriptPath, ...getArgs()], { cwd: process.cwd() });
+        const worker = { child, pending: new Map(), nextId: 1, stderrTail: "" };
+
+        let onReady;
+        let onFail;
+        const ready = new Promise((resolve, reject) => {
+            onReady = resolve;
+            onFail = reject;
+        });
+
+        // Chạy một lần cho mỗi worker: sau startup timeout, "exit" của child bị kill còn tới
+        // sau đó và không được đụng vào worker mới mà request khác đã start
+        let failed = false;
+        const fail = (err) => {
+            if (failed) return;
+            failed = true;
+            onFail(err);
+            for (const entry of worker.pending.values()) {
+                clearTimeout(entry.timer);
+                entry.reject(err);
+            }
+            worker.pending.clear();
+            release();
+        };
+
+        createInterface({ input: child.stdout }).on("line", (line) => {
+            const message = safeJsonParse(line, null);
+            if (!message) return;
+            if (message.event === "ready") return onReady(message);
+
+            const entry = worker.pending.get(message.id);
+            if (!entry) return;
+            worker.pending.delete(message.id);
+            clearTimeout(entry.timer);
+            if (message.ok) entry.resolve(message.result);
+            else entry.reject(new Error(message.error || `${name} error`));
+        });
+        child.stderr.on("data", (d) => {
+            worker.stderrTail = (worker.stderrTail + d.toString()).slice(-2000);
+        });
+        child.stdin.on("error", fail);
+        child.on("error", fail);
+        child.on("exit", (code) => fail(new Error(`${name} exited code=${code}. stderr=${worker.stderrTail}`)));
+
+        const startupTimer = setTimeout(() => {
+            fail(new Error(`${name} not ready after ${startupTimeoutMs}ms`));
+            child.kill();
+        }, startupTimeoutMs);
+        try {
+            worker.readyInfo = await ready;
+        } finally {
+            clearTimeout(startupTimer);
+        }
+        console.info(`${name} ready:`, worker.readyInfo);
+        return worker;
+    };
+
+    const get = () => {
+        if (!workerPromise) {
+            const release = () => {
+                if (workerPromise === promise) workerPromise = null;
+            };
+            const promise = start(release).catch((err) => {
+                release();
+                throw err;
+            });
+            workerPromise = promise;
+        }
+        return workerPromise;
+    };
+
+    const request = async (payload, timeoutMs = requestTimeoutMs) => {
+        const worker = await get();
+        const id = String(worker.nextId++);
+        return new Promise((resolve, reject) => {
+            const timer = setTimeout(() => {
+                worker.pending.delete(id);
+                reject(new Error(`${name} timeout after ${timeoutMs}ms`));
+            }, timeoutMs);
+            worker.pending.set(id, { resolve, reject, timer });
+            worker.child.stdin.write(JSON.stringify({ id, ...payload }) + "\n");
+        });
+    };
+
+    const health = async () => {
+        try {
+            const result = await request({ op: "health" });
+            return { success: true, health: result };
+        } catch (error) {
+            return { success: false, error: error?.message || String(error) };
+        }
+    };
+
+    return { request, health };
+};
+
+export default { createPythonWorker, resolvePythonExec };
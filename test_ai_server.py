@@ -0,0 +1,140 @@
+"""Reload của ai_server.DiagnosisServer khi artifact bị thay trong lúc đang phục vụ request.
+
+  python -m pytest -q test_ai_server.py
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import contextlib
+import unittest
+
+import ai_server
+from ai_server import DiagnosisServer
+from ai_heart_diagnosis import HeartDiagnosisAI
+
+HEART_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "heart.csv")
+
+
+def train_small_model(path, n_estimators, seed):
+    """RandomForest nhỏ trên heart.csv (cùng feature_engineering với ai_heart_diagnosis.py), lưu bằng save_model"""
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.preprocessing import StandardScaler
+
+    ai = HeartDiagnosisAI()
+    with contextlib.redirect_stdout(None):
+        df = ai.feature_engineering(ai.load_and_preprocess_data(HEART_CSV))
+        X, y = df.drop(columns=["target", "severity"]), df["severity"]
+        ai.scaler = StandardScaler().fit(X.values)
+        ai.best_model = RandomForestClassifier(n_estimators=n_estimators, max_depth=4, random_state=seed)
+        ai.best_model.fit(ai.scaler.transform(X.values), y.values)
+        ai.save_model(path, feature_names=list(X.columns))
+
+
+class ReloadWhileServingTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.model_path = os.path.join(self.tmp, "heart_diagnosis_model.pkl")
+        train_small_model(self.model_path, n_estimators=5, seed=0)
+        self._interval = ai_server.RELOAD_CHECK_INTERVAL_S
+        ai_server.RELOAD_CHECK_INTERVAL_S = 0.0  # kiểm tra artifact ở mọi request
+
+        self.server = DiagnosisServer(self.model_path, cache_size=0)
+        with contextlib.redirect_stdout(None):
+            self.server.load()
+
+    def tearDown(self):
+        ai_server.RELOAD_CHECK_INTERVAL_S = self._interval
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def replace_artifact(self, write):
+        """Ghi artifact mới ra file tạm rồi os.replace, như save_model / train_history_model"""
+        tmp_path = self.model_path + ".new"
+        write(tmp_path)
+        os.replace(tmp_path, self.model_path)
+
+    def serve_during(self, action, clients=4):
+        """Gửi diagnose liên tục từ nhiều thread trong lúc chạy action(); trả về các lỗi gặp phải"""
+        errors, stop = [], threading.Event()
+
+        def client(i):
+            heart_rate = 60 + i
+            while not stop.is_set():
+                try:
+                    result = self.server.diagnose({"heart_rate": heart_rate, "age": 50})
+                    assert 0 <= int(result["severity"]) <= 4
+                except Exception as exc:
+                    errors.append(exc)
+                    return
+
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+        for thread in threads:
+            thread.start()
+        try:
+            with contextlib.redirect_stdout(None), contextlib.redirect_stderr(None):
+                action()
+                # vài request sau khi đổi file để chắc chắn maybe_reload đã chạy
+                for _ in range(20):
+                    self.server.diagnose({"heart_rate": 75})
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        return errors
+
+    def test_bad_artifact_keeps_previous_model(self):
+        model_before = self.server.ai.model
+
+        def write_garbage(path):
+            with open(path, "wb") as f:
+                f.write(b"not a joblib bundle")
+
+        errors = self.serve_during(lambda: self.replace_artifact(write_garbage))
+        self.assertEqual(errors, [])
+        self.assertIs(self.server.ai.model, model_before)
+        self.assertEqual(self.server.reloads, 0)
+        # File hỏng chỉ được thử một lần, không phải ở mọi request
+        self.assertFalse(self.server.maybe_reload())
+
+    def test_new_artifact_is_picked_up(self):
+        model_before = self.server.ai.model
+        errors = self.serve_during(lambda: self.replace_artifact(
+            lambda path: train_small_model(path, n_estimators=7, seed=1)))
+        self.assertEqual(errors, [])
+        self.assertEqual(self.server.reloads, 1)
+        self.assertIsNot(self.server.ai.model, model_before)
+        self.assertEqual(len(self.server.ai.model.estimators_), 7)
+
+    def test_lookup_table_written_after_model_is_picked_up(self):
+        from diagnosis_lut import build_lookup_table, lut_path_for, model_fingerprint
+
+        # Như ai_heart_diagnosis.py: .pkl mới được lưu trước, bảng cũ (của model trước) vẫn còn
+        # trên đĩa cho tới khi build xong bảng mới
+        lut_path = lut_path_for(self.model_path)
+        small_grid = dict(ages=(40, 50), sexes=(0, 1), trestbps=(120, 130), chol=(200, 210))
+        with contextlib.redirect_stdout(None):
+            build_lookup_table(self.server.ai, lut_path, source_sha256=model_fingerprint(self.model_path),
+                               **small_grid)
+        self.server._last_reload_check = 0.0
+        with contextlib.redirect_stdout(None), contextlib.redirect_stderr(None):
+            self.assertTrue(self.server.maybe_reload())
+        self.assertIsNotNone(self.server.ai.lut)
+
+        errors = self.serve_during(lambda: self.replace_artifact(
+            lambda path: train_small_model(path, n_estimators=7, seed=1)))
+        self.assertEqual(errors, [])
+        self.assertIsNone(self.server.ai.lut)  # bảng cũ không khớp model mới
+
+        with contextlib.redirect_stdout(None):
+            build_lookup_table(self.server.ai, lut_path, source_sha256=model_fingerprint(self.model_path),
+                               **small_grid)
+        self.server._last_reload_check = 0.0
+        with contextlib.redirect_stdout(None), contextlib.redirect_stderr(None):
+            self.assertTrue(self.server.maybe_reload())
+        self.assertIsNotNone(self.server.ai.lut)
+        self.assertEqual(self.server.ai.lut.meta["source_sha256"], model_fingerprint(self.model_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+"""Window features của history_server khớp lúc train khi request chỉ gửi một phần reading của device.
+
+Train tính window trên mọi reading đã lưu trong Data (add_window_features); server nạp phần
+còn thiếu qua DataStreamHistory. Chạy với mongomock:
+
+  python -m pytest -q test_history_server.py
+"""
+
+import contextlib
+import unittest
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from history_server import DataStreamHistory
+from hr_window_features import WindowFeatureEngine, window_feature_names, window_features
+from predict_history_model import FeaturePlan, row_args
+
+WINDOWS = (3, 5)
+START = datetime(2026, 1, 1, 8, 0)  # naive UTC, như pymongo trả về
+
+
+class FailingCollection:
+    def find(self, *args, **kwargs):
+        raise ConnectionError("mongod unreachable")
+
+
+class WindowHistoryTest(unittest.TestCase):
+    def setUp(self):
+        import mongomock
+
+        rng = np.random.default_rng(0)
+        self.stamps = [START + timedelta(seconds=60 * k + int(rng.integers(0, 30))) for k in range(30)]
+        self.heart_rates = np.round(rng.uniform(55, 140, len(self.stamps)), 1).tolist()
+        self.data = mongomock.MongoClient().db.datas
+        self.data.insert_many([{"deviceId": "dev-1", "timestamp": ts, "heartRate": hr}
+                               for ts, hr in zip(self.stamps, self.heart_rates)])
+        self.data.insert_one({"deviceId": "dev-2", "timestamp": self.stamps[5], "heartRate": 200.0})
+
+        seconds = [ts.replace(tzinfo=timezone.utc).timestamp() for ts in self.stamps]
+        self.trained = window_features(["dev-1"] * len(seconds), seconds, self.heart_rates, WINDOWS)
+        self.plan = FeaturePlan({"feature_names": window_feature_names(WINDOWS), "window_sizes": list(WINDOWS)})
+
+    def serve(self, engine, k):
+        row = {"heartRate": self.heart_rates[k], "deviceId": "dev-1",
+               "timestamp": self.stamps[k].replace(tzinfo=timezone.utc).isoformat()}
+        return self.plan.window_matrix([row_args(row)], engine)[0]
+
+    def test_sparse_requests_match_training_windows(self):
+        engine = WindowFeatureEngine(WINDOWS, history=DataStreamHistory(None, data_col=self.data))
+        for k in (0, 7, 8, 20, 29):
+            np.testing.assert_allclose(self.serve(engine, k), self.trained[k], rtol=1e-9, atol=1e-9)
+
+    def test_restart_is_seeded_from_stored_readings(self):
+        for k in (12, 13):
+            engine = WindowFeatureEngine(WINDOWS, history=DataStreamHistory(None, data_col=self.data))
+            np.testing.assert_allclose(self.serve(engine, k), self.trained[k], rtol=1e-9, atol=1e-9)
+
+    def test_unreachable_database_falls_back_to_request_readings(self):
+        engine = WindowFeatureEngine(WINDOWS, history=DataStreamHistory(None, data_col=FailingCollection()))
+        alone = WindowFeatureEngine(WINDOWS)
+        with contextlib.redirect_stderr(None):
+            np.testing.assert_allclose(self.serve(engine, 20), self.serve(alone, 20))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+"""rescore_history.py --mode diagnosis giữ status khớp aiDiagnosis.severity (label source của train_history_model).
+
+Chạy với mongomock và một RandomForest nhỏ train trên heart.csv:
+
+  python -m pytest -q test_rescore_history.py
+"""
+
+import os
+import shutil
+import argparse
+import tempfile
+import contextlib
+import unittest
+from unittest import mock
+
+import rescore_history
+from rescore_history import status_for
+from test_ai_server import train_small_model
+
+
+class UpdateOneCollection:
+    """mongomock 4.3 không chạy được bulk_write với UpdateOne của pymongo 4.x: áp dụng từng op bằng update_one"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def bulk_write(self, ops, ordered=True):
+        modified = sum(self.collection.update_one(op._filter, op._doc).modified_count for op in ops)
+        return argparse.Namespace(modified_count=modified)
+
+
+class RescoreStatusTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp()
+        cls.model_path = os.path.join(cls.tmp, "heart_diagnosis_model.pkl")
+        train_small_model(cls.model_path, n_estimators=5, seed=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp, ignore_errors=True)
+
+    def setUp(self):
+        import mongomock
+
+        db = mongomock.MongoClient().db
+        self.data, self.users = UpdateOneCollection(db.datas), db.users
+        self.data.insert_many([
+            # arduino.controller.js: status = mapSeverityToStatus(severity)
+            {"_id": "derived", "heartRate": 160, "status": "critical", "aiDiagnosis": {"severity": "critical"}},
+            # heartrate.controller.js: status theo ngưỡng nhịp tim, khác severity
+            {"_id": "own", "heartRate": 160, "status": "warning", "aiDiagnosis": {"severity": "critical"}},
+            {"_id": "undiagnosed", "heartRate": 160, "status": "warning"},
+        ])
+
+    def rescore(self, sync_status):
+        args = argparse.Namespace(mode="diagnosis", model=self.model_path, meta=rescore_history.HISTORY_META,
+                                  uri="mongodb://test/be_project", days=None, startDate=None, endDate=None,
+                                  chunk_size=100, write_batch=100, jobs=1, limit=None, dry_run=False,
+                                  sync_status=sync_status)
+        client = mock.Mock()
+        with mock.patch.object(rescore_history, "open_collections", return_value=(client, self.data, self.users)), \
+                contextlib.redirect_stdout(None), contextlib.redirect_stderr(None):
+            return rescore_history.rescore(args)
+
+    def record(self, _id):
+        return self.data.find_one({"_id": _id})
+
+    def test_derived_status_follows_new_severity(self):
+        self.rescore("derived")
+        derived = self.record("derived")
+        self.assertNotEqual(derived["aiDiagnosis"]["severity"], "critical")  # model nhỏ: HR 160 không còn critical
+        self.assertEqual(derived["status"], status_for(derived["aiDiagnosis"]["severity"]))
+        self.assertEqual(self.record("own")["status"], "warning")
+        self.assertEqual(self.record("undiagnosed")["status"], "warning")
+
+    def test_all_rewrites_every_status(self):
+        self.rescore("all")
+        for _id in ("derived", "own", "undiagnosed"):
+            record = self.record(_id)
+            self.assertEqual(record["status"], status_for(record["aiDiagnosis"]["severity"]))
+
+    def test_none_keeps_status(self):
+        self.rescore("none")
+        self.assertEqual(self.record("derived")["status"], "critical")
+        self.assertEqual(self.record("own")["status"], "warning")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+"""Parity của tfjs_model.py với output TF.js đã lưu (heart_model/reference_outputs.json).
+
+Reference commit cùng model; tạo lại bằng `node export_tfjs_reference.js` (cần @tensorflow/tfjs-node)
+mỗi khi train.js ghi model mới. Thiếu file thì test fail, không skip.
+
+  python -m pytest -q test_tfjs_model.py
+"""
+
+import os
+import json
+import tempfile
+import unittest
+
+from tfjs_model import MODEL_DIR, NORMALIZATION_PATH, REFERENCE_NAME, load_tfjs_model, verify
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+REFERENCE_PATH = os.path.join(ROOT, MODEL_DIR, REFERENCE_NAME)
+
+
+class TfjsParityTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.model = load_tfjs_model(os.path.join(ROOT, MODEL_DIR), os.path.join(ROOT, NORMALIZATION_PATH))
+
+    def test_matches_tfjs_reference(self):
+        report = verify(self.model, REFERENCE_PATH)
+        self.assertTrue(report["ok"], report)
+
+    def test_missing_reference_is_an_error(self):
+        with self.assertRaises(FileNotFoundError):
+            verify(self.model, os.path.join(tempfile.gettempdir(), "no_such_reference.json"))
+
+    def test_mismatching_reference_fails(self):
+        inputs = [45.0, 80.0, 130.0]
+        outputs = (self.model.predict(inputs) + 1e-3).tolist()
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            json.dump({"generatedBy": "test", "inputs": inputs, "outputs": outputs}, f)
+        try:
+            self.assertFalse(verify(self.model, f.name)["ok"])
+        finally:
+            os.unlink(f.name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""tfjs_model.py
+Evaluator NumPy cho model TF.js layers (heart_model/model.json + weights.bin, train bằng train.js),
+để job Python batch dùng cùng model fallback với ai.service.js mà không phải gọi Node cho từng reading.
+
+- Topology: Sequential gồm Dense (+ Activation / Dropout / InputLayer) đọc từ modelTopology
+- Weights: weightsManifest -> view float32 little-endian trên np.memmap của weights.bin (không copy)
+- Input chuẩn hoá bằng normalization.json giống normalizeInput() của ai.service.js: (x - mean) / (std || 1)
+- Tính bằng float32 như backend TF.js, theo chunk `batch_size` row để batch lớn không tốn bộ nhớ trung gian
+
+Usage:
+  python tfjs_model.py 60 85 140                  # JSON: outputs + severity/confidence như ai.service.js
+  python tfjs_model.py --verify                   # so với heart_model/reference_outputs.json (export_tfjs_reference.js)
+  python tfjs_model.py --bench 1000000            # throughput
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import argparse
+
+import numpy as np
+
+MODEL_DIR = 'heart_model'
+NORMALIZATION_PATH = 'normalization.json'
+REFERENCE_NAME = 'reference_outputs.json'
+BATCH_SIZE = 65536
+
+_DTYPES = {'float32': '<f4', 'int32': '<i4'}
+
+
+def _sigmoid(x):
+    with np.errstate(over='ignore'):
+        return 1.0 / (1.0 + np.exp(-x))
+
+
+def _softmax(x):
+    e = np.exp(x - x.max(axis=1, keepdims=True))
+    return e / e.sum(axis=1, keepdims=True)
+
+
+# Tên activation theo tfjs-layers
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0),
+    'relu6': lambda x: np.clip(x, 0, 6),
+    'sigmoid': _sigmoid,
+    'hardSigmoid': lambda x: np.clip(0.2 * x + 0.5, 0, 1),
+    'tanh': np.tanh,
+    'softmax': _softmax,
+    'softplus': lambda x: np.logaddexp(x, 0),
+    'softsign': lambda x: x / (1 + np.abs(x)),
+    'elu': lambda x: np.where(x > 0, x, np.expm1(np.minimum(x, 0))),
+}
+_PASSTHROUGH_LAYERS = ('Dropout', 'InputLayer')
+
+
+class DenseLayer:
+    def __init__(self, name, kernel, bias, activation):
+        self.name = name
+        self.kernel = kernel  # (in, out)
+        self.bias = bias      # (out,) hoặc None
+        self.activation = activation
+
+    def __call__(self, x):
+        y = x @ self.kernel
+        if self.bias is not None:
+            y += self.bias
+        return ACTIVATIONS[self.activation](y)
+
+
+class TfjsDenseModel:
+    """Chuỗi DenseLayer + normalization của input"""
+
+    def __init__(self, layers, mean=None, std=None):
+        self.layers = layers
+        self.input_dim = layers[0].kernel.shape[0]
+        self.output_dim = layers[-1].kernel.shape[1]
+        self.mean = None if mean is None else np.asarray(mean, dtype=np.float32)
+        self.std = None if std is None else np.where(np.asarray(std, dtype=np.float32) == 0, 1, std).astype(np.float32)
+
+    def normalize(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        if self.mean is not None:
+            X = (X - self.mean) / self.std
+        return X
+
+    def predict(self, X, batch_size=BATCH_SIZE):
+        """X: (n, input_dim) hoặc (n,) khi input_dim = 1, giá trị chưa chuẩn hoá -> float32 (n, output_dim)"""
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(-1, self.input_dim)
+        if X.shape[1] != self.input_dim:
+            raise ValueError(f"expected {self.input_dim} input features, got {X.shape[1]}")
+        out = np.empty((len(X), self.output_dim), dtype=np.float32)
+        for start in range(0, len(X), batch_size):
+            h = self.normalize(X[start:start + batch_size])
+            for layer in self.layers:
+                h = layer(h)
+            out[start:start + batch_size] = h
+        return out
+
+    def diagnose(self, heart_rates, batch_size=BATCH_SIZE):
+        """(severity int (n,), confidence % (n,)) theo cùng quy tắc với ai.service.js:
+        severity = output lớn nhất (index đầu tiên), 0 nếu mọi output <= 0; confidence = output đó * 100"""
+        probs = self.predict(heart_rates, batch_size)
+        severity = probs.argmax(axis=1)
+        best = probs[np.arange(len(probs)), severity]
+        severity[best <= 0] = 0
+        return severity, np.maximum(best, 0) * 100
+
+
+def read_weights(model_dir, manifest, mmap=True):
+    """{tên weight: ndarray} theo thứ tự trong weightsManifest; mỗi group là các file nối liền"""
+    weights = {}
+    for group in manifest:
+        paths = [os.path.join(model_dir, p) for p in group['paths']]
+        if mmap and len(paths) == 1:
+            buffer = np.memmap(paths[0], dtype=np.uint8, mode='r')
+        else:
+            buffer = np.concatenate([np.fromfile(p, dtype=np.uint8) for p in paths])
+        offset = 0
+        for spec in group['weights']:
+            if spec.get('quantization'):
+                raise ValueError(f"quantized weights are not supported: {spec['name']}")
+            dtype = np.dtype(_DTYPES[spec['dtype']])
+            count = math.prod(spec['shape'])
+            weights[spec['name']] = np.frombuffer(buffer, dtype=dtype, count=count,
+                                                  offset=offset).reshape(spec['shape'])
+            offset += count * dtype.itemsize
+        if offset != len(buffer):
+            raise ValueError(f"{group['paths']}: manifest covers {offset} bytes, file has {len(buffer)}")
+    return weights
+
+
+def build_layers(topology, weights):
+    config = topology['config']
+    if topology.get('class_name') != 'Sequential':
+        raise ValueError(f"only Sequential models are supported, got {topology.get('class_name')}")
+    layer_configs = config['layers'] if isinstance(config, dict) else config
+
+    layers = []
+    for layer in layer_configs:
+        kind, cfg = layer['class_name'], layer['config']
+        if kind in _PASSTHROUGH_LAYERS:
+            continue  # Dropout chỉ có tác dụng khi train
+        if kind == 'Activation':
+            if not layers:
+                raise ValueError("Activation layer before any Dense layer")
+            layers.append(DenseLayer(cfg['name'], np.eye(layers[-1].kernel.shape[1], dtype=np.float32),
+                                     None, cfg['activation']))
+            continue
+        if kind != 'Dense':
+            raise ValueError(f"unsupported layer type: {kind}")
+        activation = cfg.get('activation') or 'linear'
+        if activation not in ACTIVATIONS:
+            raise ValueError(f"unsupported activation: {activation}")
+        name = cfg['name']
+        bias = weights[f"{name}/bias"] if cfg.get('use_bias', True) else None
+        layers.append(DenseLayer(name, weights[f"{name}/kernel"], bias, activation))
+    if not layers:
+        raise ValueError("model has no Dense layers")
+    return layers
+
+
+def load_tfjs_model(model_dir=MODEL_DIR, normalization_path=NORMALIZATION_PATH, mmap=True):
+    """Load model.json + weights + normalization.json (bỏ qua normalization nếu thiếu file, như ai.service.js)"""
+    with open(os.path.join(model_dir, 'model.json'), encoding='utf-8') as f:
+        spec = json.load(f)
+    weights = read_weights(model_dir, spec['weightsManifest'], mmap=mmap)
+    layers = build_layers(spec['modelTopology'], weights)
+
+    mean = std = None
+    if normalization_path and os.path.exists(normalization_path):
+        with open(normalization_path, encoding='utf-8') as f:
+            norm = json.load(f)
+        if isinstance(norm.get('mean'), list) and isinstance(norm.get('std'), list):
+            mean, std = norm['mean'], norm['std']
+    return TfjsDenseModel(layers, mean, std)
+
+
+# ------------------------------- Verify -------------------------------------
+
+
+def verify(model, reference_path, atol=1e-5):
+    """So predict với output TF.js lưu bởi export_tfjs_reference.js; FileNotFoundError nếu chưa có file"""
+    if not os.path.exists(reference_path):
+        raise FileNotFoundError(reference_path)
+    with open(reference_path, encoding='utf-8') as f:
+        reference = json.load(f)
+    inputs = np.asarray(reference['inputs'], dtype=np.float32)
+    expected = np.asarray(reference['outputs'], dtype=np.float64)
+    actual = model.predict(inputs).astype(np.float64)
+    max_diff = float(np.abs(expected.reshape(actual.shape) - actual).max())
+    return {'rows': len(inputs), 'source': reference.get('generatedBy', reference_path),
+            'max_abs_diff': max_diff, 'ok': max_diff <= atol}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NumPy evaluator for the TF.js heart_model")
+    parser.add_argument('heart_rates', nargs='*', type=float)
+    parser.add_argument('--model-dir', default=MODEL_DIR)
+    parser.add_argument('--normalization', default=NORMALIZATION_PATH)
+    parser.add_argument('--verify', action='store_true', help='Kiểm tra output khớp reference của TF.js')
+    parser.add_argument('--reference', default=None, help=f'Mặc định: <model-dir>/{REFERENCE_NAME}')
+    parser.add_argument('--atol', type=float, default=1e-5)
+    parser.add_argument('--bench', type=int, default=0, help='Đo throughput trên N heart rate ngẫu nhiên')
+    args = parser.parse_args()
+
+    model = load_tfjs_model(args.model_dir, args.normalization)
+
+    if args.verify:
+        reference = args.reference or os.path.join(args.model_dir, REFERENCE_NAME)
+        try:
+            report = verify(model, reference, args.atol)
+        except FileNotFoundError:
+            print(f"❌ Không có {reference}: chạy node export_tfjs_reference.js (cần @tensorflow/tfjs-node) rồi commit file")
+            sys.exit(1)
+        print(f"🔍 Parity vs {report['source']}: rows={report['rows']} max_abs_diff={report['max_abs_diff']:.2e}")
+        if not report['ok']:
+            print(f"❌ Output lệch quá tolerance {args.atol}")
+            sys.exit(1)
+        print("✅ Output khớp trong tolerance")
+
+    if args.bench:
+        heart_rates = np.random.default_rng(42).uniform(40, 200, args.bench).astype(np.float32)
+        model.predict(heart_rates[:1000])
+        started = time.perf_counter()
+        model.predict(heart_rates)
+        elapsed = time.perf_counter() - started
+        print(f"⏱️ {args.bench} readings: {elapsed * 1000:.1f} ms ({args.bench / elapsed:,.0f} readings/s)")
+
+    if args.heart_rates:
+        outputs = model.predict(args.heart_rates)
+        severity, confidence = model.diagnose(args.heart_rates)
+        print(json.dumps([{
+            'heartRate': hr,
+            'outputs': out.tolist(),
+            'severity': int(sev),
+            'confidence': round(float(conf), 1),
+        } for hr, out, sev, conf in zip(args.heart_rates, outputs, severity, confidence)]))
+
+
+if __name__ == '__main__':
+    main()
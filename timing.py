@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""timing.py
+Span thời gian cho từng giai đoạn của đường chẩn đoán (import, load artifact, feature, scale,
+predict, insights, serialize), ghi ra JSONL để gom thành histogram.
+
+Bật bằng biến môi trường HEART_TIMING:
+  HEART_TIMING=/tmp/heart_timing.jsonl   append mỗi trace một dòng JSON vào file
+  HEART_TIMING=stderr (hoặc 1)           in ra stderr (stdout là kênh kết quả cho Node.js)
+Không set: span() trả về một nullcontext dùng chung, không đo gì.
+
+Trong code:
+  with timing.trace("run_ai_diagnosis", heart_rate=85):
+      with timing.span("load"):
+          ...
+Span cùng tên trong một trace được cộng dồn; span ngoài trace bị bỏ qua. Trace lồng nhau
+gộp vào trace ngoài cùng. timing.record() cho các giai đoạn xảy ra trước khi trace mở
+(vd. import module) - được gắn vào trace đầu tiên của process.
+
+Một dòng JSONL:
+  {"trace": "run_ai_diagnosis", "ts": 1718000000.1, "pid": 123, "ok": true, "total_ms": 1234.5,
+   "spans": {"interpreter": 20.0, "import": 150.2, "load": 1001.3, ...}, "heart_rate": 85}
+
+Histogram:
+  python timing.py report /tmp/heart_timing.jsonl
+  python timing.py report /tmp/heart_timing.jsonl --trace predict_history --json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from contextlib import nullcontext
+
+ENV_VAR = "HEART_TIMING"
+ENABLED = bool(os.environ.get(ENV_VAR))
+
+# Cận trên (ms) của các bucket histogram; bucket cuối là > 5000 ms
+BUCKET_EDGES_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_NULL = nullcontext()
+_local = threading.local()
+_pending = {}
+_write_lock = threading.Lock()
+
+
+class _Trace:
+    __slots__ = ("name", "fields", "spans", "started")
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.spans = {}
+        self.started = None
+
+    def add(self, name, ms):
+        self.spans[name] = self.spans.get(name, 0.0) + ms
+
+    def __enter__(self):
+        if _pending:
+            self.spans.update(_pending)
+            _pending.clear()
+        _local.trace = self
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        total_ms = (time.perf_counter() - self.started) * 1000
+        _local.trace = None
+        record = {
+            "trace": self.name,
+            "ts": round(time.time(), 3),
+            "pid": os.getpid(),
+            "ok": exc_type is None,
+            "total_ms": round(total_ms, 3),
+            "spans": {name: round(ms, 3) for name, ms in self.spans.items()},
+        }
+        record.update(self.fields)
+        emit(record)
+        return False
+
+
+class _Span:
+    __slots__ = ("trace", "name", "started")
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.trace.add(self.name, (time.perf_counter() - self.started) * 1000)
+        return False
+
+
+def trace(name, **fields):
+    """Context manager gom các span bên trong thành một dòng JSONL khi thoát"""
+    if not ENABLED or getattr(_local, "trace", None) is not None:
+        return _NULL
+    return _Trace(name, fields)
+
+
+def span(name):
+    """Context manager đo một giai đoạn trong trace hiện tại (nullcontext khi tắt)"""
+    if not ENABLED:
+        return _NULL
+    current = getattr(_local, "trace", None)
+    if current is None:
+        return _NULL
+    return _Span(current, name)
+
+
+def record(name, ms):
+    """Ghi một giai đoạn đã đo sẵn vào trace hiện tại, hoặc giữ lại cho trace kế tiếp"""
+    if not ENABLED:
+        return
+    current = getattr(_local, "trace", None)
+    if current is not None:
+        current.add(name, ms)
+    else:
+        _pending[name] = _pending.get(name, 0.0) + ms
+
+
+def emit(record):
+    target = os.environ.get(ENV_VAR, "")
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    with _write_lock:
+        if target.lower() in ("1", "true", "stderr"):
+            sys.stderr.write(line)
+            sys.stderr.flush()
+        else:
+            # O_APPEND: nhiều process (mỗi lần Node spawn) ghi chung một file không đè nhau
+            with open(target, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+def _process_age_ms():
+    """Thời gian từ lúc process được tạo tới giờ (Linux /proc, độ phân giải ~10 ms); None nếu không đọc được"""
+    try:
+        with open("/proc/self/stat") as f:
+            # field 22 (starttime, clock tick từ lúc boot), đếm sau tên process trong ngoặc
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return max(uptime - start_ticks / os.sysconf("SC_CLK_TCK"), 0.0) * 1000
+
+
+if ENABLED:
+    # Interpreter startup: từ lúc spawn tới khi module này được import (đầu run_ai / predict_history_model)
+    _age = _process_age_ms()
+    if _age is not None:
+        record("interpreter", _age)
+
+# ------------------------------- Report --------------------------------------
+
+
+def read_records(paths):
+    records = []
+    for path in paths:
+        f = sys.stdin if path == "-" else open(path, encoding="utf-8")
+        try:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # dòng log khác lẫn vào stderr
+                if isinstance(rec, dict) and "trace" in rec and "spans" in rec:
+                    records.append(rec)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+    return records
+
+
+def histogram(samples):
+    """[[cận trên ms hoặc None (vô cùng), số sample], ...] theo BUCKET_EDGES_MS"""
+    counts = [0] * (len(BUCKET_EDGES_MS) + 1)
+    for ms in samples:
+        i = 0
+        while i < len(BUCKET_EDGES_MS) and ms > BUCKET_EDGES_MS[i]:
+            i += 1
+        counts[i] += 1
+    edges = list(BUCKET_EDGES_MS) + [None]
+    return [[edge, count] for edge, count in zip(edges, counts)]
+
+
+def aggregate(records, trace_name=None):
+    """{trace: {stage: {count, p50_ms, p90_ms, p99_ms, max_ms, histogram}}}, stage "total" = cả trace"""
+    import numpy as np
+
+    stages = {}
+    for rec in records:
+        if trace_name and rec["trace"] != trace_name:
+            continue
+        by_stage = stages.setdefault(rec["trace"], {})
+        for name, ms in rec["spans"].items():
+            by_stage.setdefault(name, []).append(ms)
+        by_stage.setdefault("total", []).append(rec["total_ms"])
+
+    out = {}
+    for name, by_stage in stages.items():
+        out[name] = {}
+        for stage, samples in by_stage.items():
+            arr = np.asarray(samples, dtype=float)
+            p50, p90, p99 = np.percentile(arr, [50, 90, 99])
+            out[name][stage] = {
+                "count": len(arr),
+                "p50_ms": round(float(p50), 3),
+                "p90_ms": round(float(p90), 3),
+                "p99_ms": round(float(p99), 3),
+                "max_ms": round(float(arr.max()), 3),
+                "histogram": histogram(samples),
+            }
+    return out
+
+
+def print_report(summary):
+    for name, by_stage in summary.items():
+        print(f"\n⏱️  {name} ({by_stage['total']['count']} traces)")
+        print(f"   {'stage':14s} {'count':>7s} {'p50':>10s} {'p90':>10s} {'p99':>10s} {'max':>10s}")
+        for stage, s in by_stage.items():
+            print(f"   {stage:14s} {s['count']:7d} {s['p50_ms']:10.3f} {s['p90_ms']:10.3f} "
+                  f"{s['p99_ms']:10.3f} {s['max_ms']:10.3f}")
+        for stage, s in by_stage.items():
+            peak = max(count for _, count in s["histogram"]) or 1
+            print(f"\n   📊 {stage}")
+            for edge, count in s["histogram"]:
+                if count:
+                    label = f"<= {edge:g} ms" if edge is not None else f"> {BUCKET_EDGES_MS[-1]:g} ms"
+                    print(f"   {label:>12s} {count:7d} {'█' * max(1, round(count / peak * 40))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate HEART_TIMING JSONL spans into per-stage histograms")
+    sub = parser.add_subparsers(dest="command", required=True)
+    report = sub.add_parser("report", help="Percentile + histogram theo stage")
+    report.add_argument("files", nargs="+", help="File JSONL ('-' = stdin)")
+    report.add_argument("--trace", default=None, help="Chỉ trace này (vd. run_ai_diagnosis)")
+    report.add_argument("--json", action="store_true", help="Chỉ in kết quả JSON")
+    args = parser.parse_args()
+
+    records = read_records(args.files)
+    if not records:
+        print("❌ Không có trace nào trong input")
+        sys.exit(1)
+    summary = aggregate(records, args.trace)
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        print_report(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,19 +9,23 @@ Yêu cầu:
 Cách chạy:
   source ai_env/bin/activate
   python train_history_model.py --label-source aiDiagnosis.severity --days 30
+  python train_history_model.py --incremental   # chỉ record mới hơn checkpoint, thêm cây vào model
+  python train_history_model.py --feature-store # đọc window từ shard .npy theo ngày, chỉ lấy phần mới từ MongoDB
+  python train_history_model.py --window-features 10,60  # thêm feature cửa sổ trượt theo device (hr_window_features.py)
 
 Artifacts:
-  - heart_model/history_model.pkl : pickle chứa {'model','scaler','feature_names','conditions_used'}
+  - heart_model/history_model.pkl : pickle chứa {'model','scaler','feature_names','conditions_used','window_sizes'}
   - heart_model/history_features.json : metadata feature order & encodings
+  - heart_model/history_checkpoint.json : createdAt mới nhất đã train (cho --incremental)
+  - heart_model/feature_store/ : cột thô theo ngày (--feature-store, xem history_feature_store.py)
 """
 
 import os
 import sys
 import json
-import math
 import argparse
 from datetime import datetime, timedelta
-from collections import Counter
+from itertools import islice
 
 import numpy as np
 import pandas as pd
@@ -34,132 +38,323 @@ from sklearn.metrics import classification_report, confusion_matrix
 from sklearn.utils.class_weight import compute_class_weight
 import joblib
 
+from hr_window_features import DEFAULT_WINDOWS, window_features, window_feature_names, parse_windows
+
 DEFAULT_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017/be_project")
 ARTIFACT_DIR = os.path.join("heart_model")
 os.makedirs(ARTIFACT_DIR, exist_ok=True)
 
 # ------------------------------- Data Fetch ---------------------------------
 
-def fetch_records(uri: str, days: int | None, start_date: str | None, end_date: str | None):
-    client = MongoClient(uri)
+# Chỉ lấy các field mà build_dataframe dùng, thay vì cả BSON document
+RECORD_PROJECTION = {"_id": 0, "userId": 1, "deviceId": 1, "heartRate": 1, "status": 1, "aiDiagnosis.severity": 1,
+                     "timestamp": 1, "createdAt": 1}
+USER_PROJECTION = {"age": 1, "gender": 1, "weight": 1, "conditions": 1}
+
+FETCH_BATCH_SIZE = 5000  # số document mỗi batch cursor / mỗi lần resolve user
+USER_IN_CHUNK = 1000     # số _id tối đa trong một query $in
+
+
+def open_collections(uri: str, **client_options):
+    client = MongoClient(uri, **client_options)
     db = client.get_default_database() if uri.endswith("be_project") else client.get_database()
-    data_col = db["datas"] if "datas" in db.list_collection_names() else db["data"] if "data" in db.list_collection_names() else db["Data"]
-    users_col = db["users"] if "users" in db.list_collection_names() else db["user"] if "user" in db.list_collection_names() else db["User"]
+    names = db.list_collection_names()
+    data_col = db["datas"] if "datas" in names else db["data"] if "data" in names else db["Data"]
+    users_col = db["users"] if "users" in names else db["user"] if "user" in names else db["User"]
+    return client, data_col, users_col
 
-    time_filter = {}
+
+def window_bounds(days: int | None, start_date: str | None, end_date: str | None):
+    """(start, end) của window train, None = không giới hạn"""
     if start_date or end_date:
+        return (datetime.fromisoformat(start_date) if start_date else None,
+                datetime.fromisoformat(end_date) if end_date else None)
+    if days:
+        return datetime.utcnow() - timedelta(days=days), None
+    return None, None
+
+
+def build_time_filter(days: int | None, start_date: str | None, end_date: str | None,
+                      after: datetime | None = None):
+    time_filter = {}
+    if after is not None:
+        # Incremental: chỉ record mới hơn checkpoint
+        time_filter["createdAt"] = {"$gt": after}
+        return time_filter
+    start, end = window_bounds(days, start_date, end_date)
+    if start or end:
         time_filter["createdAt"] = {}
-        if start_date:
-            time_filter["createdAt"]["$gte"] = datetime.fromisoformat(start_date)
-        if end_date:
-            time_filter["createdAt"]["$lte"] = datetime.fromisoformat(end_date)
-    elif days:
-        since = datetime.utcnow() - timedelta(days=days)
-        time_filter["createdAt"] = {"$gte": since}
-
-    query = time_filter if time_filter else {}
-    records = list(data_col.find(query))
-
-    # Attach user profile
+        if start:
+            time_filter["createdAt"]["$gte"] = start
+        if end:
+            time_filter["createdAt"]["$lte"] = end
+    return time_filter
+
+
+def _user_key(uid):
+    return str(uid) if isinstance(uid, ObjectId) else uid
+
+
+def resolve_users(users_col, uid_strs, chunk_size=USER_IN_CHUNK):
+    """Lấy profile của nhiều user bằng query $in (thay cho một find_one mỗi user)"""
+    users = {}
+    uid_strs = list(uid_strs)
+    for i in range(0, len(uid_strs), chunk_size):
+        chunk = uid_strs[i:i + chunk_size]
+        # userId có thể là ObjectId hoặc string thường, giống find_one cũ
+        ids = [ObjectId(u) if ObjectId.is_valid(u) else u for u in chunk]
+        for doc in users_col.find({"_id": {"$in": ids}}, USER_PROJECTION):
+            users[str(doc.pop("_id"))] = doc
+        for u in chunk:
+            users.setdefault(u, {})
+    return users
+
+
+def iter_records(data_col, users_col, query=None, batch_size=FETCH_BATCH_SIZE):
+    """Stream record (đã gắn "_user") theo từng batch cursor, chỉ với các field cần thiết"""
+    cursor = data_col.find(query or {}, RECORD_PROJECTION, batch_size=batch_size)
     user_cache = {}
-    for r in records:
-        uid = r.get("userId")
-        if isinstance(uid, ObjectId):
-            uid_str = str(uid)
-        else:
-            uid_str = uid
-        if uid_str and uid_str not in user_cache:
-            user_doc = users_col.find_one({"_id": ObjectId(uid_str)}) if ObjectId.is_valid(uid_str) else users_col.find_one({"_id": uid_str})
-            user_cache[uid_str] = user_doc or {}
-        r["_user"] = user_cache.get(uid_str, {})
-    client.close()
-    return records
+    while True:
+        batch = list(islice(cursor, batch_size))
+        if not batch:
+            break
+        missing = {_user_key(r.get("userId")) for r in batch} - user_cache.keys()
+        missing.discard(None)
+        missing.discard("")
+        if missing:
+            user_cache.update(resolve_users(users_col, missing))
+        for r in batch:
+            r["_user"] = user_cache.get(_user_key(r.get("userId")), {})
+            yield r
+
+
+def fetch_query(uri: str, query: dict, batch_size: int = FETCH_BATCH_SIZE):
+    """Generator: record khớp `query`, đọc batch-by-batch từ MongoDB"""
+    client, data_col, users_col = open_collections(uri)
+    try:
+        yield from iter_records(data_col, users_col, query, batch_size)
+    finally:
+        client.close()
+
+
+def fetch_records(uri: str, days: int | None, start_date: str | None, end_date: str | None,
+                  batch_size: int = FETCH_BATCH_SIZE, after: datetime | None = None):
+    """Generator: record trong khoảng thời gian (hoặc sau `after`), đọc batch-by-batch từ MongoDB"""
+    yield from fetch_query(uri, build_time_filter(days, start_date, end_date, after), batch_size)
 
 # ----------------------------- Feature Engineering ---------------------------
 
-def build_dataframe(records, label_source: str):
-    rows = []
-    for r in records:
-        user = r.get("_user", {})
-        ai_diag = r.get("aiDiagnosis", {})
-        severity = ai_diag.get("severity")  # 'low','medium','high','critical'
-        status = r.get("status")  # 'normal','warning','critical'
-
-        # Pick label
-        label = None
-        if label_source == "aiDiagnosis.severity":
-            label = severity
-        elif label_source == "status":
-            label = status
-        else:
-            label = severity or status
-
-        if not label:
-            continue  # skip unlabeled
-
-        row = {
-            "heartRate": r.get("heartRate"),
-            "age": user.get("age"),
-            "gender": user.get("gender"),
-            "weight": user.get("weight"),
-            "conditions": user.get("conditions", []),
-            "label": label,
-            "created_hour": r.get("createdAt", datetime.utcnow()).hour if r.get("createdAt") else None,
-            "is_night": 1 if r.get("createdAt") and (r.get("createdAt").hour < 6 or r.get("createdAt").hour >= 22) else 0,
-        }
-        rows.append(row)
-
-    df = pd.DataFrame(rows)
+HISTORY_COLUMNS = ["heartRate", "age", "gender", "weight", "conditions", "label",
+                   "created_hour", "is_night", "severity", "status", "createdAt"]
+
+# Cột thô lấy trực tiếp từ record; label / created_hour / is_night được tính theo cột
+RAW_COLUMNS = ["heartRate", "age", "gender", "weight", "conditions", "severity", "status", "createdAt",
+               "deviceId", "timestamp"]
+
+
+def pick_labels(severity: pd.Series, status: pd.Series, label_source: str):
+    if label_source == "aiDiagnosis.severity":
+        return severity
+    if label_source == "status":
+        return status
+    return severity.where(severity.notna() & (severity != ""), status)
+
+
+class HistoryColumnBuilder:
+    """Gom record thành các cột (list theo cột) rồi tạo DataFrame một lần"""
+
+    def __init__(self, label_source: str):
+        self.label_source = label_source
+        self.columns = {name: [] for name in RAW_COLUMNS}
+        self.seen = 0
+
+    def append(self, r):
+        self.seen += 1
+        user = r.get("_user") or {}
+        cols = self.columns
+        cols["heartRate"].append(r.get("heartRate"))
+        cols["age"].append(user.get("age"))
+        cols["gender"].append(user.get("gender"))
+        cols["weight"].append(user.get("weight"))
+        cols["conditions"].append(user.get("conditions", []))
+        cols["severity"].append((r.get("aiDiagnosis") or {}).get("severity"))  # 'low','medium','high','critical'
+        cols["status"].append(r.get("status"))  # 'normal','warning','critical'
+        cols["createdAt"].append(r.get("createdAt"))
+        # Stream cho window features: reading không có deviceId gộp theo user
+        cols["deviceId"].append(r.get("deviceId") or _user_key(r.get("userId")))
+        cols["timestamp"].append(r.get("timestamp"))
+
+    def extend(self, records):
+        for r in records:
+            self.append(r)
+        return self
+
+    def raw_dataframe(self):
+        """Các cột thô (RAW_COLUMNS), chưa lọc label; dùng cho history_feature_store"""
+        return pd.DataFrame({name: pd.Series(values, dtype=object) for name, values in self.columns.items()})
+
+    def to_dataframe(self, window_sizes=()):
+        return frame_from_raw(self.raw_dataframe(), self.label_source, window_sizes)
+
+
+def add_window_features(df: pd.DataFrame, window_sizes):
+    """Cột hr_<stat>_w<N> theo từng deviceId, thứ tự timestamp (thiếu thì createdAt)"""
+    stamp = pd.to_datetime(df["timestamp"]).fillna(pd.to_datetime(df["createdAt"]))
+    seconds = (stamp - pd.Timestamp(0)).dt.total_seconds()
+    features = window_features(df["deviceId"].to_numpy(dtype=object), seconds.to_numpy(dtype=float),
+                               pd.to_numeric(df["heartRate"], errors="coerce").to_numpy(dtype=float), window_sizes)
+    return pd.concat([df, pd.DataFrame(features, columns=window_feature_names(window_sizes), index=df.index)], axis=1)
+
+
+def frame_from_raw(raw: pd.DataFrame, label_source: str, window_sizes=()):
+    """Cột thô (từ Mongo hoặc feature store) -> DataFrame HISTORY_COLUMNS (+ window features) cho encode_features"""
+    df = raw.copy()
+    # createdAt mới nhất đã đọc (kể cả record không có label) cho checkpoint incremental
+    last_created_at = pd.to_datetime(df["createdAt"]).max() if len(df) else pd.NaT
+    if window_sizes:
+        # Tính trên mọi reading (kể cả chưa có label) để window giống chuỗi thực tế của device
+        df = add_window_features(df, window_sizes)
+    df["label"] = pick_labels(df["severity"], df["status"], label_source)
+    labeled = df["label"].notna() & (df["label"] != "")
+    df = df[labeled].reset_index(drop=True)  # skip unlabeled
+
+    df["heartRate"] = df["heartRate"].infer_objects()
+    created = pd.to_datetime(df["createdAt"])
+    hour = created.dt.hour
+    df["created_hour"] = hour.astype("int64") if hour.notna().all() else hour
+    df["is_night"] = (((hour < 6) | (hour >= 22)) & hour.notna()).astype("int64")
+    df["createdAt"] = created
+
     # Clean
-    df = df.dropna(subset=["heartRate"])  # heartRate is required
+    df = df[HISTORY_COLUMNS + window_feature_names(window_sizes)].dropna(subset=["heartRate"])  # heartRate is required
+    df.attrs["fetched"] = len(raw)
+    df.attrs["last_created_at"] = None if pd.isna(last_created_at) else last_created_at.to_pydatetime()
     return df
 
+
+def build_dataframe(records, label_source: str, window_sizes=()):
+    """records: iterable bất kỳ (generator từ fetch_records hoặc list)"""
+    return HistoryColumnBuilder(label_source).extend(records).to_dataframe(window_sizes)
+
+
+def load_history_frame(args, after: datetime | None = None, window_sizes=()):
+    """DataFrame cho window của args (hoặc record sau `after`), từ MongoDB hoặc --feature-store"""
+    if not args.feature_store:
+        records = fetch_records(args.uri, args.days, args.startDate, args.endDate, args.batch_size, after)
+        return build_dataframe(records, args.label_source, window_sizes)
+
+    from history_feature_store import FeatureStore
+
+    store = FeatureStore(args.feature_store)
+    start, end = (None, None) if after else window_bounds(args.days, args.startDate, args.endDate)
+
+    def fetch_raw(query):
+        records = fetch_query(args.uri, query, args.batch_size)
+        return HistoryColumnBuilder(args.label_source).extend(records).raw_dataframe()
+
+    synced = store.sync(fetch_raw, after or start, refresh_days=args.refresh_days)
+    raw = store.read(start=start, end=end, after=after)
+    print(f"🗄️ Feature store {args.feature_store}: {synced} new records from MongoDB, {len(raw)} rows read")
+    return frame_from_raw(raw, args.label_source, window_sizes)
+
 CONDITION_LIMIT = 20  # limit distinct conditions for one-hot
+BASE_FEATURES = ["heartRate", "age", "weight", "gender_enc", "created_hour", "is_night", "hr_is_low", "hr_is_high"]
+GENDER_MAP = {"male": 0, "female": 1, "other": 2}
 
 
-def encode_features(df: pd.DataFrame):
-    # Normalize gender
-    df["gender"] = df["gender"].fillna("other").astype(str)
-    gender_map = {"male": 0, "female": 1, "other": 2}
-    df["gender_enc"] = df["gender"].map(gender_map).fillna(2)
+def explode_conditions(conditions: pd.Series):
+    """(row_position, condition lower-case) cho mọi condition của mọi row"""
+    lists = conditions.where(conditions.map(lambda c: isinstance(c, list)), None)
+    exploded = lists.reset_index(drop=True).explode().dropna()
+    return exploded.index.to_numpy(), exploded.astype(str).str.lower().to_numpy()
 
-    # Fill age / weight missing with median
-    for col in ["age", "weight"]:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors="coerce")
-            df[col] = df[col].fillna(df[col].median())
 
-    # Conditions flatten & top-k frequency one-hot
-    all_conditions = [c.lower() for arr in df["conditions"].tolist() for c in (arr if isinstance(arr, list) else [])]
-    top_conditions = [c for c, _ in Counter(all_conditions).most_common(CONDITION_LIMIT)]
+def top_conditions_from(values: np.ndarray, limit: int = CONDITION_LIMIT):
+    """Top-k theo tần suất; hòa thì giữ thứ tự xuất hiện đầu tiên (giống Counter.most_common)"""
+    if len(values) == 0:
+        return []
+    codes, uniques = pd.factorize(values)
+    counts = np.bincount(codes)
+    order = np.argsort(-counts, kind="stable")[:limit]
+    return [str(uniques[i]) for i in order]
 
-    def cond_vector(conds):
-        vec = []
-        lower = [c.lower() for c in conds] if isinstance(conds, list) else []
-        for c in top_conditions:
-            vec.append(1 if c in lower else 0)
-        return vec
 
-    cond_matrix = df["conditions"].apply(cond_vector).tolist()
-    cond_cols = [f"cond_{c}" for c in top_conditions]
-    cond_df = pd.DataFrame(cond_matrix, columns=cond_cols)
+def condition_matrix(rows: np.ndarray, values: np.ndarray, n_rows: int, top_conditions, sparse: bool = False):
+    """One-hot float32 (n_rows, len(top_conditions)) từ kết quả explode_conditions"""
+    col_of = {c: i for i, c in enumerate(top_conditions)}
+    cols = pd.Series(values, dtype=object).map(col_of).to_numpy(dtype=float, na_value=np.nan)
+    keep = ~np.isnan(cols)
+    rows, cols = rows[keep], cols[keep].astype(np.int64)
+    shape = (n_rows, len(top_conditions))
 
-    # Risk engineered features
-    df["hr_is_low"] = (df["heartRate"] < 60).astype(int)
-    df["hr_is_high"] = (df["heartRate"] > 100).astype(int)
+    if sparse:
+        from scipy import sparse as sp
+        matrix = sp.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=shape)
+        matrix.sum_duplicates()
+        matrix.data[:] = 1.0  # condition lặp trong một user vẫn chỉ là 1
+        return matrix
 
-    # Assemble final
-    feature_df = pd.concat([
-        df[["heartRate", "age", "weight", "gender_enc", "created_hour", "is_night", "hr_is_low", "hr_is_high"]].reset_index(drop=True),
-        cond_df.reset_index(drop=True)
-    ], axis=1)
+    matrix = np.zeros(shape, dtype=np.float32)
+    matrix[rows, cols] = 1.0
+    return matrix
+
+
+def derive_base_features(df: pd.DataFrame):
+    """Các feature số (BASE_FEATURES) tính theo cột, dạng float32 (n_rows, 8)"""
+    # Normalize gender
+    gender = df["gender"].fillna("other").astype(str)
+    gender_enc = gender.map(GENDER_MAP).fillna(2).to_numpy(dtype=np.float32)
 
-    return feature_df, df["label"], {
-        "gender_map": gender_map,
+    # Fill age / weight missing with median
+    filled = {}
+    for col in ["age", "weight"]:
+        values = pd.to_numeric(df[col], errors="coerce")
+        filled[col] = values.fillna(values.median()).to_numpy(dtype=np.float32)
+
+    heart_rate = pd.to_numeric(df["heartRate"], errors="coerce").to_numpy(dtype=np.float32)
+    created_hour = pd.to_numeric(df["created_hour"], errors="coerce").to_numpy(dtype=np.float32)
+
+    # Risk engineered features
+    return np.column_stack([
+        heart_rate,
+        filled["age"],
+        filled["weight"],
+        gender_enc,
+        created_hour,
+        df["is_night"].to_numpy(dtype=np.float32),
+        (heart_rate < 60).astype(np.float32),
+        (heart_rate > 100).astype(np.float32),
+    ])
+
+
+def encode_feature_matrix(df: pd.DataFrame, top_conditions=None, sparse: bool = False, window_sizes=()):
+    """Ma trận feature float32 (dense hoặc scipy CSR) + metadata; không tạo cột phụ trong df"""
+    rows, values = explode_conditions(df["conditions"])
+    if top_conditions is None:
+        top_conditions = top_conditions_from(values)
+
+    window_columns = window_feature_names(window_sizes)
+    base = np.hstack([derive_base_features(df), df[window_columns].to_numpy(dtype=np.float32).reshape(len(df), -1)])
+    conds = condition_matrix(rows, values, len(df), top_conditions, sparse)
+    if sparse:
+        from scipy import sparse as sp
+        matrix = sp.hstack([sp.csr_matrix(base), conds], format="csr", dtype=np.float32)
+    else:
+        matrix = np.hstack([base, conds])
+
+    return matrix, {
+        "gender_map": GENDER_MAP,
         "conditions_used": top_conditions,
-        "feature_columns": list(feature_df.columns),
+        "window_sizes": list(window_sizes),
+        "feature_columns": BASE_FEATURES + window_columns + [f"cond_{c}" for c in top_conditions],
     }
 
+
+def encode_features(df: pd.DataFrame, window_sizes=()):
+    matrix, meta = encode_feature_matrix(df, window_sizes=window_sizes)
+    feature_df = pd.DataFrame(matrix, columns=meta["feature_columns"])
+    return feature_df, df["label"].reset_index(drop=True), meta
+
 # ------------------------------- Label Encoding ------------------------------
 
 LABEL_ORDER = ["low", "medium", "high", "critical", "normal", "warning"]  # union
@@ -173,8 +368,8 @@ def encode_labels(labels: pd.Series):
 
 # ------------------------------- Training -----------------------------------
 
-def train(df: pd.DataFrame):
-    features, labels_raw, meta = encode_features(df)
+def train(df: pd.DataFrame, window_sizes=()):
+    features, labels_raw, meta = encode_features(df, window_sizes)
     labels_enc, label_map = encode_labels(labels_raw)
 
     # Drop rows with NaN labels
@@ -210,18 +405,112 @@ def train(df: pd.DataFrame):
         "feature_names": meta["feature_columns"],
         "label_map": label_map,
         "conditions_used": meta["conditions_used"],
+        "window_sizes": meta["window_sizes"],
     }
     return artifacts
 
+
+def update_model(artifacts, df: pd.DataFrame, add_trees: int = 50, max_trees: int = 1000):
+    """Incremental: thêm `add_trees` cây (warm_start) fit trên record mới.
+
+    Feature order, conditions_used, label_map và scaler giữ nguyên từ lần train đầy đủ.
+    Trả về "updated", "deferred" (record mới chưa có đủ mọi class, giữ lại cho lần sau)
+    hoặc "retrain" (có label mà model chưa từng thấy hoặc feature columns đã khác, cần train lại toàn bộ).
+    """
+    model = artifacts["model"]
+    label_map = artifacts["label_map"]
+
+    # Label ngoài LABEL_ORDER cũng bị bỏ khi train toàn bộ (encode_labels)
+    df = df[df["label"].isin(LABEL_ORDER)].reset_index(drop=True)
+    if df.empty:
+        print("💤 Không có label hợp lệ trong record mới.")
+        return "updated"
+
+    matrix, meta = encode_feature_matrix(df, top_conditions=artifacts["conditions_used"],
+                                         window_sizes=artifacts.get("window_sizes", ()))
+    if meta["feature_columns"] != artifacts["feature_names"]:
+        print("⚠️ Feature columns của record mới khác model đã lưu")
+        return "retrain"
+
+    labels_enc = df["label"].map(label_map)
+    new_labels = sorted(set(df.loc[labels_enc.isna(), "label"]))
+    if new_labels:
+        print(f"⚠️ Label mới {new_labels} không có trong model")
+        return "retrain"
+    y_new = labels_enc.to_numpy(dtype=np.int64)
+    # Cây mới phải thấy đủ mọi class để predict_proba của forest vẫn cùng shape;
+    # nếu chưa đủ thì không tiến checkpoint, record này sẽ được gộp vào lần chạy sau
+    if set(np.unique(y_new)) != set(model.classes_.tolist()):
+        print(f"⏸️ Dữ liệu mới chỉ có class {sorted(np.unique(y_new).tolist())}, model cần {model.classes_.tolist()}; hoãn cập nhật")
+        return "deferred"
+
+    X_new = artifacts["scaler"].transform(pd.DataFrame(matrix, columns=artifacts["feature_names"]))
+
+    # Độ chính xác của model cũ trên dữ liệu mới (trước khi cập nhật) để theo dõi drift
+    print(f"📉 Accuracy on new records before update: {model.score(X_new, y_new):.3f}")
+
+    class_weights = compute_class_weight(class_weight="balanced", classes=model.classes_, y=y_new)
+    model.set_params(
+        warm_start=True,
+        n_estimators=len(model.estimators_) + add_trees,
+        class_weight={cls: w for cls, w in zip(model.classes_, class_weights)},
+    )
+    model.fit(X_new, y_new)
+
+    # Giữ tối đa max_trees cây mới nhất: model không lớn dần và quên dữ liệu quá cũ
+    if len(model.estimators_) > max_trees:
+        model.estimators_ = model.estimators_[-max_trees:]
+        model.n_estimators = max_trees
+    print(f"🌲 Added {add_trees} trees on {len(y_new)} new records -> {len(model.estimators_)} trees")
+    return "updated"
+
 # ------------------------------- Save/Load ----------------------------------
 
-def save_artifacts(artifacts, path=os.path.join(ARTIFACT_DIR, "history_model.pkl")):
-    joblib.dump(artifacts, path)
+MODEL_PATH = os.path.join(ARTIFACT_DIR, "history_model.pkl")
+CHECKPOINT_PATH = os.path.join(ARTIFACT_DIR, "history_checkpoint.json")
+
+
+def load_checkpoint(path=CHECKPOINT_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    checkpoint["last_created_at"] = datetime.fromisoformat(checkpoint["last_created_at"])
+    return checkpoint
+
+
+def save_checkpoint(last_created_at, mode, artifacts, records, label_source, previous=None, path=CHECKPOINT_PATH):
+    """Ghi createdAt mới nhất đã train để lần --incremental sau chỉ lấy record mới hơn"""
+    if last_created_at is None:
+        # Không có createdAt (dữ liệu cũ, --label-source status): không biết mốc để --incremental tiếp tục
+        print("⚠️ Record không có createdAt, bỏ qua checkpoint (lần --incremental sau sẽ train lại toàn bộ)")
+        if os.path.exists(path):
+            os.remove(path)  # checkpoint cũ không còn khớp model vừa lưu
+        return
+    checkpoint = {
+        "last_created_at": last_created_at.isoformat(),
+        "mode": mode,
+        "label_source": label_source,
+        "records": records + (previous or {}).get("records", 0) if mode == "incremental" else records,
+        "n_estimators": len(artifacts["model"].estimators_),
+        "saved_at": datetime.utcnow().isoformat(),
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, ensure_ascii=False, indent=2)
+    print(f"📌 Saved checkpoint to {path} (last createdAt {checkpoint['last_created_at']})")
+
+
+def save_artifacts(artifacts, path=MODEL_PATH):
+    # compress=0: numpy buffers nằm nguyên trong file để loader memory-map được (joblib.load(..., mmap_mode=...))
+    # Ghi ra file tạm rồi rename: history_server.py đang chạy không bao giờ đọc phải file ghi dở
+    joblib.dump(artifacts, path + ".tmp", compress=0)
+    os.replace(path + ".tmp", path)
     meta_path = os.path.join(ARTIFACT_DIR, "history_features.json")
     meta_json = {
         "feature_names": artifacts["feature_names"],
         "label_map": artifacts["label_map"],
         "conditions_used": artifacts["conditions_used"],
+        "window_sizes": artifacts.get("window_sizes", []),
         "saved_at": datetime.utcnow().isoformat()
     }
     with open(meta_path, "w", encoding="utf-8") as f:
@@ -238,15 +527,37 @@ def main():
     parser.add_argument("--startDate", type=str, default=None, help="ISO start date (YYYY-MM-DD)")
     parser.add_argument("--endDate", type=str, default=None, help="ISO end date (YYYY-MM-DD)")
     parser.add_argument("--label-source", type=str, default="aiDiagnosis.severity", choices=["aiDiagnosis.severity", "status", "auto"], help="Nguồn nhãn để train")
+    parser.add_argument("--batch-size", type=int, default=FETCH_BATCH_SIZE, help="Số document mỗi batch khi đọc MongoDB")
+    parser.add_argument("--feature-store", nargs="?", const=os.path.join(ARTIFACT_DIR, "feature_store"), default=None,
+                        help="Đọc/ghi cột thô qua feature store theo ngày (mặc định heart_model/feature_store)")
+    parser.add_argument("--refresh-days", type=int, default=1,
+                        help="Feature store: đọc lại N ngày cuối để nhận label/profile đã đổi và record đến muộn (0 = chỉ record mới)")
+    parser.add_argument("--window-features", type=parse_windows, nargs="?", const=DEFAULT_WINDOWS, default=(),
+                        help="Feature cửa sổ trượt theo deviceId, kích thước window (số reading), vd. 10,60")
+    parser.add_argument("--incremental", action="store_true", help="Chỉ train trên record mới hơn checkpoint (thêm cây vào model hiện có)")
+    parser.add_argument("--add-trees", type=int, default=50, help="Số cây thêm mỗi lần incremental")
+    parser.add_argument("--max-trees", type=int, default=1000, help="Số cây tối đa, bỏ cây cũ nhất khi vượt")
     args = parser.parse_args()
 
     print("🫀 Training history-based model")
     print("URI:", args.uri)
 
-    records = fetch_records(args.uri, args.days, args.startDate, args.endDate)
-    print(f"📦 Fetched {len(records)} raw records")
+    checkpoint = None
+    if args.incremental:
+        checkpoint = load_checkpoint()
+        if checkpoint is None or not os.path.exists(MODEL_PATH):
+            print("⚠️ Chưa có model/checkpoint, chuyển sang train toàn bộ.")
+        elif checkpoint.get("label_source") != args.label_source:
+            print(f"⚠️ Checkpoint dùng label-source {checkpoint.get('label_source')}, chuyển sang train toàn bộ.")
+            checkpoint = None
+        else:
+            if run_incremental(args, checkpoint):
+                print("✅ Done")
+                return
+            print("🔁 Train lại toàn bộ với --days/--startDate/--endDate")
 
-    df = build_dataframe(records, args.label_source)
+    df = load_history_frame(args, window_sizes=args.window_features)
+    print(f"📦 Fetched {df.attrs['fetched']} raw records")
     print(f"🧹 After cleaning: {len(df)} usable rows")
 
     if df.empty:
@@ -257,9 +568,41 @@ def main():
     print("🎯 Label distribution:")
     print(df["label"].value_counts())
 
-    artifacts = train(df)
+    artifacts = train(df, args.window_features)
     save_artifacts(artifacts)
+    save_checkpoint(df.attrs["last_created_at"], "full", artifacts, len(df), args.label_source)
     print("✅ Done")
 
+
+def run_incremental(args, checkpoint):
+    """Cập nhật model với record mới hơn checkpoint; False nếu cần train lại toàn bộ"""
+    since = checkpoint["last_created_at"]
+    print(f"⏩ Incremental: records after {since.isoformat()}")
+
+    artifacts = joblib.load(MODEL_PATH)
+    window_sizes = tuple(artifacts.get("window_sizes", ()))
+    if args.window_features and tuple(args.window_features) != window_sizes:
+        print(f"⚠️ Model dùng window features {list(window_sizes)}, khác --window-features")
+        return False
+
+    # Window features chỉ tính trên record mới: vài reading đầu mỗi device có window chưa đầy
+    df = load_history_frame(args, after=since, window_sizes=window_sizes)
+    print(f"📦 Fetched {df.attrs['fetched']} new records, {len(df)} usable rows")
+
+    if df.empty:
+        print("💤 Không có record mới, giữ nguyên model.")
+        return True
+
+    status = update_model(artifacts, df, args.add_trees, args.max_trees)
+    if status == "retrain":
+        return False
+    if status == "deferred":
+        return True
+
+    save_artifacts(artifacts)
+    save_checkpoint(df.attrs["last_created_at"], "incremental", artifacts, len(df), args.label_source, checkpoint)
+    return True
+
+
 if __name__ == "__main__":
     main()